@@ -25,7 +25,7 @@ import math
 import S
 import V
 
-P = print
+P = V.P
 
 def reinit():
     global addr_w, mem_addr_w, mem_dat_w
@@ -20,45 +20,575 @@
 # 
 # V.py - utility functions for generating Verilog
 #
+import sys
+import os
+import types
+import mmap
+import re
+import time
+import json
+import atexit
+import threading
 import S
 
-P = print
-
-def reinit( _clk='clk', _reset_='reset_', _vdebug=True, _vassert=True, _ramgen_cmd='' ):
-    global clk, reset_, vdebug, vassert, ramgen_cmd
-    global module_name, rams, post_modules
-    global default_rand_seed_z_init, default_rand_seed_w_init, rand_seed_z_init_addend, rand_seed_w_init_addend, seed_i
-    global custom_cla
-    global io
-    global in_module_header
-    global vlint_off_width, vlint_on_width
-    global vlint_off_unused, vlint_on_unused
-    global vlint_off_filename, vlint_on_filename
-    global vlint_off_caseincomplete, vlint_on_caseincomplete
-    clk = _clk
-    reset_ = _reset_
-    vdebug = _vdebug
-    vassert = _vassert
-    ramgen_cmd = _ramgen_cmd
-    module_name = ''
-    io = []
-    in_module_header = False
-    rams = {}
-    post_modules = {}
-    default_rand_seed_z_init = "32'h12345678"
-    default_rand_seed_w_init = "32'hbabecaf3"
-    rand_seed_z_init_addend = 0
-    rand_seed_w_init_addend = 0
-    seed_i = 0
-    custom_cla = False
-    vlint_off_width    = 'verilator lint_off WIDTH' 
-    vlint_on_width     = 'verilator lint_on WIDTH' 
-    vlint_off_unused   = 'verilator lint_off UNUSEDSIGNAL' 
-    vlint_on_unused    = 'verilator lint_on UNUSEDSIGNAL' 
-    vlint_off_filename = 'verilator lint_off DECLFILENAME' 
-    vlint_on_filename  = 'verilator lint_on DECLFILENAME' 
-    vlint_off_caseincomplete = 'verilator lint_off CASEINCOMPLETE'
-    vlint_on_caseincomplete  = 'verilator lint_on CASEINCOMPLETE'
+#-------------------------------------------
+# EMITTER
+#
+# All generated Verilog goes through P(), which appends one line to the current 
+# Emitter. An Emitter is an in-memory buffer of lines that is compacted into 
+# large chunks every chunk_line_cnt lines, then written out by flush() to:
+#
+#     None           - sys.stdout (the default)
+#     'foo.v'        - a named file (written through an mmap if use_mmap=True)
+#     <file object>  - anything with a writelines() method, such as io.StringIO
+#
+# The first flush() to a named file truncates it, later ones append.
+#
+# emit_begin( e ) redirects P() to Emitter e until the matching emit_end(), 
+# which flushes e. If the current Emitter has split_modules=True, then 
+# module_footer() uses these to put each ram and post module in its own 
+# <module_name>.v file in the same directory instead of appending it to 
+# the current file.
+#-------------------------------------------
+class Emitter:
+    def __init__( self, file=None, use_mmap=False, split_modules=False, chunk_line_cnt=8192 ):
+        self.file = file
+        self.use_mmap = use_mmap
+        self.split_modules = split_modules
+        self.chunk_line_cnt = chunk_line_cnt
+        self.lines = []
+        self.chunks = []
+        self.flushed = False
+
+    def write( self, s='' ):
+        self.lines.append( s )
+        if len( self.lines ) >= self.chunk_line_cnt: self.compact()
+
+    def compact( self ):
+        if len( self.lines ) == 0: return
+        self.lines.append( '' )
+        self.chunks.append( '\n'.join( self.lines ) )
+        self.lines = []
+
+    def getvalue( self ):
+        self.compact()
+        return ''.join( self.chunks )
+
+    def module_file( self, mn ):
+        dir_name = os.path.dirname( self.file ) if isinstance( self.file, str ) else ''
+        return os.path.join( dir_name, f'{mn}.v' )
+
+    def flush( self ):
+        self.compact()
+        if len( self.chunks ) == 0 and (self.flushed or not isinstance( self.file, str )): return
+        if self.file is None:
+            sys.stdout.writelines( self.chunks )
+            sys.stdout.flush()
+        elif not isinstance( self.file, str ):
+            self.file.writelines( self.chunks )
+        elif self.use_mmap:
+            data = ''.join( self.chunks ).encode()
+            with open( self.file, 'r+b' if self.flushed else 'w+b' ) as f:
+                offset = f.seek( 0, os.SEEK_END )
+                if len( data ) != 0:
+                    f.truncate( offset + len( data ) )
+                    with mmap.mmap( f.fileno(), 0 ) as m:
+                        m[offset:offset+len(data)] = data
+        else:
+            with open( self.file, 'a' if self.flushed else 'w' ) as f:
+                f.writelines( self.chunks )
+        self.chunks = []
+        self.flushed = True
+
+#-------------------------------------------
+# GENERATION CONTEXT
+#
+# A Gen holds all of the state that reinit() and the module_*() functions 
+# used to keep in module globals (clk, reset_, io, rams, post_modules, the 
+# rand seed addends, etc.) plus the current Emitter.
+#
+# The free functions in this file always operate on the current Gen for the
+# calling thread, which is a default Gen unless another one has been entered
+# using a with statement:
+#
+#     with V.Gen( 'lclk', 'lreset_' ) as g:
+#         fifo.make( p, 'my_fifo' )
+#
+# Entering a Gen does not disturb the Gen that was current before, so a 
+# sub-module generator can be nested inside a parent module, and separate 
+# threads can each generate their own design at the same time. The current Gen's 
+# Emitter is flushed on exit.
+#
+# The usual V.clk, V.reset_, V.module_name, V.post_modules, etc. still work
+# and return the value in the current Gen. Any V.py function can also be called 
+# as a method of a Gen, which enters the Gen for the duration of the call:
+#
+#     g.wirea( 'x', 8, 'y + z' )
+#
+# ir=True selects the netlist IR mode described below, and dce=True also
+# removes dead logic. memoize=True selects shared helper modules (see 
+# MEMOIZED HELPER MODULES). Unlike the reinit() settings, these stay in effect 
+# across reinit() calls.
+#-------------------------------------------
+class Gen:
+    def __init__( self, clk='clk', reset_='reset_', vdebug=True, vassert=True, ramgen_cmd='', emitter=None, ir=False, dce=False, memoize=False ):
+        self.emitter = emitter if emitter is not None else Emitter()
+        self.emitters = []
+        self.ir = ir or dce
+        self.dce = dce
+        self.memoize = memoize
+        self.dce_signal_cnt = 0
+        self.dce_bit_cnt = 0
+        self.profiler = None
+        self.reinit( clk, reset_, vdebug, vassert, ramgen_cmd )
+
+    def reinit( self, clk='clk', reset_='reset_', vdebug=True, vassert=True, ramgen_cmd='', profile='' ):
+        if profile != '' and self.profiler is None: 
+            self.profiler = Profiler( profile )
+            self.profiler.start()
+        self.clk = clk
+        self.reset_ = reset_
+        self.vdebug = vdebug
+        self.vassert = vassert
+        self.ramgen_cmd = ramgen_cmd
+        self.module_name = ''
+        self.io = []
+        self.in_module_header = False
+        self.netlist = None
+        self.rams = {}
+        self.fifos = {}
+        self.post_modules = {}
+        self.default_rand_seed_z_init = "32'h12345678"
+        self.default_rand_seed_w_init = "32'hbabecaf3"
+        self.rand_seed_z_init_addend = 0
+        self.rand_seed_w_init_addend = 0
+        self.seed_i = 0
+        self.custom_cla = False
+        self.perf_op_last = 200
+        self.memo_modules = set()
+
+    def __enter__( self ):
+        tls.gens.append( tls.gen )
+        tls.gen = self
+        return self
+
+    def __exit__( self, *exc ):
+        tls.gen = tls.gens.pop()
+        for e in self.emitters + [self.emitter]: e.flush()
+        self.profile_end()
+        return False
+
+    def profile_end( self ):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler.report()
+            self.profiler = None
+
+    def __getattr__( self, name ):
+        fn = globals().get( name )
+        if name.startswith( '_' ) or not callable( fn ): raise AttributeError( name )
+        def call( *args, **kwargs ):
+            with self: return fn( *args, **kwargs )
+        return call
+
+default_gen = Gen()
+
+class GenLocal( threading.local ):
+    def __init__( self ):
+        self.gen = default_gen
+        self.gens = []
+
+tls = GenLocal()
+
+#-------------------------------------------
+# CLOCK DOMAINS
+#
+# Within "with V.ClockDomain( clk, reset_ ):", V.clk and V.reset_ are clk and reset_,
+# so always_at_posedge(), dassert(), tb_clk(), tb_reset_(), tb_randbits(), etc. 
+# generate logic in that clock domain. The previous clk and reset_ are restored on exit.
+#-------------------------------------------
+class ClockDomain:
+    def __init__( self, clk, reset_ ):
+        self.clk = clk
+        self.reset_ = reset_
+
+    def __enter__( self ):
+        g = tls.gen
+        self.saved = ( g.clk, g.reset_ )
+        g.clk = self.clk
+        g.reset_ = self.reset_
+        return self
+
+    def __exit__( self, *exc ):
+        g = tls.gen
+        g.clk, g.reset_ = self.saved
+        return False
+
+def gen():
+    return tls.gen
+
+# V.clk, V.reset_, etc. come from the current Gen, 
+# and assignments to them, such as V.custom_cla = True, go to the current Gen
+def __getattr__( name ):
+    g = tls.gen
+    if name in g.__dict__: return g.__dict__[name]
+    raise AttributeError( f'module V has no attribute {name}' )
+
+class GenModule( types.ModuleType ):
+    def __setattr__( self, name, val ):
+        g = tls.gen
+        if name in g.__dict__: 
+            setattr( g, name, val )
+        else:
+            super().__setattr__( name, val )
+
+sys.modules[__name__].__class__ = GenModule
+
+def P( s='' ):
+    g = tls.gen
+    e = g.emitter
+    e.lines.append( s )
+    if len( e.lines ) >= e.chunk_line_cnt: e.compact()
+    if g.profiler is not None: g.profiler.emit( s )
+
+def emit_begin( e ):
+    g = tls.gen
+    g.emitters.append( g.emitter )
+    g.emitter = e
+    return e
+
+def emit_end():
+    g = tls.gen
+    if len( g.emitters ) == 0: S.die( 'emit_end() called without a matching emit_begin()' )
+    e = g.emitter
+    g.emitter = g.emitters.pop()
+    e.flush()
+    return e
+
+def emit_flush():
+    tls.gen.emitter.flush()
+
+@atexit.register
+def emit_flush_all():
+    for e in default_gen.emitters + [default_gen.emitter]: e.flush()
+    default_gen.profile_end()
+
+#-------------------------------------------
+# PROFILER
+#
+# reinit( _profile=dest ), or the VPY_PROFILE environment variable when _profile is '', 
+# turns on a profiler for the current Gen. It attributes the lines and bytes emitted by P(), 
+# the bits declared by decl()/decla(), and wall time to:
+#
+#     - each function in the profiled modules (V.py, fifo.py and cache.py by default), 
+#       both self (directly in that function) and total (including its callees)
+#     - each user-level call site, i.e., the file:line outside of those modules that called into them
+#       or called P() directly
+#
+# The profiler stops when the Gen exits (or at process exit for the default Gen), then 
+# prints a report to stderr sorted by total time, or, if dest ends in .json, dumps the 
+# numbers as JSON to that file. Profiling uses sys.setprofile(), so it slows generation down a lot.
+#-------------------------------------------
+profile_modules = { 'V', 'fifo', 'cache' }
+profile_skip    = { 'P', '__getattr__', 'gen', 'ir_add', '<module>' }
+
+class Profiler:
+    def __init__( self, dest, modules=None ):
+        self.dest = dest
+        self.modules = modules if modules is not None else profile_modules
+        self.names = {}                 # code object -> function name, or None if not profiled
+        self.stack = []                 # [frame, name, t, lines, bytes, bits, child_t, is_outer] per active call
+        self.funcs = {}                 # name -> [calls, lines, bytes, bits, t, total_lines, total_bytes, total_bits, total_t]
+        self.sites = {}                 # site -> [calls, lines, bytes, bits, t]
+        self.site = ''
+        self.lines = 0
+        self.bytes = 0
+        self.bits = 0
+        self.t = 0.0
+        self.prev_hook = None
+
+    def start( self ):
+        self.t = time.perf_counter()
+        self.prev_hook = sys.getprofile()
+        sys.setprofile( self.hook )
+
+    def stop( self ):
+        sys.setprofile( self.prev_hook )
+        self.t = time.perf_counter() - self.t
+
+    def name( self, code ):
+        if code not in self.names:
+            module = os.path.splitext( os.path.basename( code.co_filename ) )[0]
+            qualname = getattr( code, 'co_qualname', code.co_name )
+            self.names[code] = f'{module}.{qualname}' if module in self.modules and qualname not in profile_skip and '.' not in qualname else None
+        return self.names[code]
+
+    def hook( self, frame, event, arg ):
+        if event == 'call':
+            name = self.name( frame.f_code )
+            if name is None: return
+            is_outer = len( self.stack ) == 0
+            if is_outer: self.site = self.site_name( frame.f_back )
+            self.stack.append( [frame, name, time.perf_counter(), self.lines, self.bytes, self.bits, 0.0, is_outer] )
+        elif event == 'return' and len( self.stack ) != 0 and self.stack[-1][0] is frame:
+            _, name, t, lines, bytes, bits, child_t, is_outer = self.stack.pop()
+            t = time.perf_counter() - t
+            if name not in self.funcs: self.funcs[name] = [0, 0, 0, 0, 0.0, 0, 0, 0, 0.0]
+            f = self.funcs[name]
+            f[0] += 1
+            f[4] += t - child_t
+            if all( call[1] != name for call in self.stack ):
+                # not recursive
+                f[5] += self.lines - lines
+                f[6] += self.bytes - bytes
+                f[7] += self.bits - bits
+                f[8] += t
+            if len( self.stack ) != 0: 
+                self.stack[-1][6] += t
+            if is_outer:
+                self.site_add( self.site, self.lines - lines, self.bytes - bytes, self.bits - bits, t )
+
+    def site_name( self, frame ):
+        return f'{os.path.basename( frame.f_code.co_filename )}:{frame.f_lineno} {frame.f_code.co_name}' if frame is not None else '?'
+
+    def site_add( self, site, lines, bytes, bits, t=0.0, calls=1 ):
+        if site not in self.sites: self.sites[site] = [0, 0, 0, 0, 0.0]
+        f = self.sites[site]
+        f[0] += calls
+        f[1] += lines
+        f[2] += bytes
+        f[3] += bits
+        f[4] += t
+
+    def emit( self, s ):
+        self.lines += s.count( '\n' ) + 1
+        self.bytes += len( s ) + 1
+        if len( self.stack ) != 0:
+            f = self.funcs.setdefault( self.stack[-1][1], [0, 0, 0, 0, 0.0, 0, 0, 0, 0.0] )
+            f[1] += s.count( '\n' ) + 1
+            f[2] += len( s ) + 1
+        else:
+            # direct P() from user code
+            self.site_add( self.site_name( sys._getframe( 2 ) ), s.count( '\n' ) + 1, len( s ) + 1, 0, calls=0 )
+
+    def decl( self, w ):
+        self.bits += w
+        if len( self.stack ) != 0: self.funcs.setdefault( self.stack[-1][1], [0, 0, 0, 0, 0.0, 0, 0, 0, 0.0] )[3] += w
+
+    def as_dict( self ):
+        fields = [ 'calls', 'lines', 'bytes', 'bits', 'sec', 'total_lines', 'total_bytes', 'total_bits', 'total_sec' ]
+        return { 'lines':     self.lines,
+                 'bytes':     self.bytes,
+                 'bits':      self.bits,
+                 'sec':       self.t,
+                 'functions': { name: dict( zip( fields, f ) ) for name, f in self.funcs.items() },
+                 'sites':     { site: dict( zip( fields[:5], f ) ) for site, f in self.sites.items() } }
+
+    def report( self ):
+        if self.dest.endswith( '.json' ):
+            with open( self.dest, 'w' ) as f:
+                json.dump( self.as_dict(), f, indent=4 )
+            return
+        out = sys.stderr
+        print( f'VPY PROFILE: {self.lines} lines, {self.bytes} bytes, {self.bits} declared bits, {self.t:.3f} sec', file=out )
+        print( file=out )
+        print( f'{"function":40s} {"calls":>8s} {"lines":>9s} {"lines*":>9s} {"bytes":>10s} {"bytes*":>10s} {"bits":>8s} {"bits*":>8s} {"sec":>8s} {"sec*":>8s}', file=out )
+        for name, f in sorted( self.funcs.items(), key=lambda item: -item[1][8] ):
+            print( f'{name:40s} {f[0]:8d} {f[1]:9d} {f[5]:9d} {f[2]:10d} {f[6]:10d} {f[3]:8d} {f[7]:8d} {f[4]:8.3f} {f[8]:8.3f}', file=out )
+        print( f'(* = including callees)', file=out )
+        print( file=out )
+        print( f'{"call site":40s} {"calls":>8s} {"lines":>9s} {"bytes":>10s} {"bits":>8s} {"sec":>8s}', file=out )
+        for site, f in sorted( self.sites.items(), key=lambda item: (-item[1][4], -item[1][2]) ):
+            print( f'{site:40s} {f[0]:8d} {f[1]:9d} {f[2]:10d} {f[3]:8d} {f[4]:8.3f}', file=out )
+
+#-------------------------------------------
+# NETLIST IR
+#
+# By default, every helper P()'s its Verilog immediately. With Gen( ir=True ), 
+# module_header_end() instead starts a Netlist for the module body and makes it the 
+# current Emitter. decl()/decla() (so wire(), wirea(), reg(), etc.), assign() and 
+# always_at_posedge() then record a Node for what they would have printed:
+#
+#     kind  - 'wire', 'reg', 'wire signed', 'reg signed', 'assign', 'always', or 'comb'
+#     name  - signal declared or driven ('' for an always block with a begin/end body)
+#     w     - width (0 for always, and for a comb block that doesn't declare name)
+#     expr  - driver expression (None for a bare decl); '@( posedge clk ) stmt' for always
+#     fanin - tuple of identifiers read by expr
+#
+# Helpers that drive one signal from a multi-line always @(*) block, such as 
+# count_leading_zeroes(), bracket it with comb_begin( name[, w] ) and comb_end()
+# so that it becomes a single 'comb' Node. These are no-ops in direct mode.
+#
+# Everything else that is P()'d in the module body is kept in order as an opaque 
+# line of text. module_footer() serializes the Netlist back to exactly the Verilog 
+# that direct mode would have printed, just before endmodule. 
+#
+# The Netlist is available as V.netlist until then, for passes that want to 
+# analyze or rewrite the module body.
+#
+# With Gen( dce=True ) (which implies ir=True), module_footer() first runs 
+# Netlist.eliminate_dead(), which removes every signal declared by a Node that 
+# is not read, directly or transitively, by an output port, a line of text, or 
+# a Node that doesn't drive a declared signal, along with the Nodes that drive it. 
+# Signals that are only read through hierarchical references from other modules
+# therefore must not be left unread. A comment before endmodule reports the number 
+# of signals and bits removed, and the Gen's dce_signal_cnt and dce_bit_cnt 
+# accumulate them.
+#-------------------------------------------
+ident_re  = re.compile( r"(?<![\w$'`])[A-Za-z_][\w$]*" )
+always_re = re.compile( r"\s*([A-Za-z_][\w$]*)\s*<=(.*)$", re.S )
+
+keywords  = frozenset( [ 'always', 'assign', 'begin', 'case', 'casez', 'default', 'else', 'end', 'endcase', 'for', 
+                         'if', 'initial', 'input', 'integer', 'negedge', 'output', 'posedge', 'reg', 'signed', 'wire' ] )
+
+def idents( expr ):
+    return tuple( name for name in dict.fromkeys( ident_re.findall( expr ) ) if name not in keywords )
+
+def decl_text( kind, name, w, v=None ):
+    s = kind + ' ' + (('[' + str(w-1) + ':' + '0] ') if w != 1 else '') + name
+    return s + ';' if v is None else s + ' = ' + f'{v}' + ';'
+
+class Node:
+    __slots__ = ( 'kind', 'name', 'w', 'expr', 'fanin' )
+
+    def __init__( self, kind, name, w, expr=None, fanin=None ):
+        self.kind = kind
+        self.name = name
+        self.w = w
+        self.expr = expr
+        self.fanin = fanin if fanin is not None else (idents( expr ) if expr is not None else ())
+
+    def text( self ):
+        if self.kind == 'assign': return f'assign {self.name} = {self.expr};'
+        if self.kind == 'always': return f'always {self.expr}'
+        if self.kind == 'comb':   return self.expr
+        return decl_text( self.kind, self.name, self.w, self.expr )
+
+    def is_decl( self ):
+        return self.kind not in ( 'assign', 'always', 'comb' ) or (self.kind == 'comb' and self.w != 0)
+
+# a Block collects the lines of a module body or comb block in memory
+class Block( Emitter ):
+    def __init__( self, name, w=0 ):
+        super().__init__( chunk_line_cnt=sys.maxsize )
+        self.name = name
+        self.w = w
+
+    def compact( self ):
+        pass
+
+    def flush( self ):
+        pass
+
+class Netlist( Block ):
+    def __init__( self, module_name, outputs ):
+        super().__init__( module_name )
+        self.outputs = outputs          # output port names
+
+    def add( self, node ):
+        self.lines.append( node )
+
+    def nodes( self ):
+        return [item for item in self.lines if isinstance( item, Node )]
+
+    # returns the number of readers of each signal, counting each Node that 
+    # reads it and each line of text that mentions it
+    def fanout( self ):
+        cnts = {}
+        for item in self.lines:
+            for name in (item.fanin if isinstance( item, Node ) else idents( item )):
+                cnts[name] = cnts.get( name, 0 ) + 1
+        return cnts
+
+    # returns the number of signals and bits removed
+    def eliminate_dead( self ):
+        decls = {}
+        drivers = {}
+        for item in self.lines:
+            if isinstance( item, Node ):
+                if item.is_decl(): decls[item.name] = item
+                if item.expr is not None: drivers.setdefault( item.name, [] ).append( item )
+
+        live = set()
+        todo = []
+        def mark( names ):
+            for name in names:
+                if name not in live:
+                    live.add( name )
+                    todo.append( name )
+        mark( self.outputs )
+        for item in self.lines:
+            if not isinstance( item, Node ):
+                mark( idents( item ) )
+            elif item.name not in decls:
+                mark( item.fanin )
+        while len( todo ) != 0:
+            for node in drivers.get( todo.pop(), [] ): mark( node.fanin )
+
+        dead = [name for name in decls if name not in live]
+        if len( dead ) != 0:
+            dead_set = set( dead )
+            self.lines = [item for item in self.lines if not isinstance( item, Node ) or item.name not in dead_set]
+        return len( dead ), sum( decls[name].w for name in dead )
+
+    def serialize( self ):
+        # not through P(), so that the profiler doesn't count these lines twice
+        e = tls.gen.emitter
+        for item in self.lines:
+            e.write( item.text() if isinstance( item, Node ) else item )
+
+def ir_add( node ):
+    g = tls.gen
+    g.netlist.add( node )
+    if g.profiler is not None: g.profiler.emit( node.text() )
+
+def ir_begin():
+    g = tls.gen
+    g.netlist = Netlist( g.module_name, [io['name'] for io in g.io if io['kind'].startswith( 'output' )] )
+    emit_begin( g.netlist )
+
+def ir_end():
+    g = tls.gen
+    nl = g.netlist
+    if g.emitter is not nl: S.die( f'module_footer(): module {nl.name} body did not end with its netlist as the current Emitter' )
+    g.netlist = None
+    g.emitter = g.emitters.pop()
+    if g.dce: 
+        signal_cnt, bit_cnt = nl.eliminate_dead()
+        g.dce_signal_cnt += signal_cnt
+        g.dce_bit_cnt += bit_cnt
+    nl.serialize()
+    if g.dce and signal_cnt != 0: 
+        P()
+        P(f'// dead logic elimination removed {signal_cnt} signals ({bit_cnt} bits)' )
+    return nl
+
+def comb_begin( name, w=0 ):
+    g = tls.gen
+    if g.netlist is None: return
+    if g.emitter is not g.netlist: S.die( f'comb_begin( {name} ): comb blocks must be directly inside the module body' )
+    emit_begin( Block( name, w ) )
+
+def comb_end():
+    g = tls.gen
+    if g.netlist is None: return
+    b = g.emitter
+    g.emitter = g.emitters.pop()
+    expr = '\n'.join( b.lines )
+    g.netlist.add( Node( 'comb', b.name, b.w, expr, tuple( name for name in idents( expr ) if name != b.name ) ) )
+
+vlint_off_width    = 'verilator lint_off WIDTH' 
+vlint_on_width     = 'verilator lint_on WIDTH' 
+vlint_off_unused   = 'verilator lint_off UNUSEDSIGNAL' 
+vlint_on_unused    = 'verilator lint_on UNUSEDSIGNAL' 
+vlint_off_filename = 'verilator lint_off DECLFILENAME' 
+vlint_on_filename  = 'verilator lint_on DECLFILENAME' 
+vlint_off_caseincomplete = 'verilator lint_off CASEINCOMPLETE'
+vlint_on_caseincomplete  = 'verilator lint_on CASEINCOMPLETE'
+
+def reinit( _clk='clk', _reset_='reset_', _vdebug=True, _vassert=True, _ramgen_cmd='', _profile='' ):
+    if _profile == '': _profile = os.environ.get( 'VPY_PROFILE', '' )
+    tls.gen.reinit( _clk, _reset_, _vdebug, _vassert, _ramgen_cmd, _profile )
 
 #-------------------------------------------
 # Returns number of bits to hold 0 .. n-1
@@ -93,33 +623,38 @@ def value_bitwidth( n ):
 # MODULE HEADER
 #-------------------------------------------
 def module_header_begin( mn, with_file_header=True ):
-    global module_name
-    module_name = mn
-    global rams, fifos
-    global io
-    global in_module_header
-    if in_module_header: S.die( 'module_header_begin() called while already in a module header' )
-    rams = {}
-    fifos = {}
+    g = tls.gen
+    g.module_name = mn
+    if g.in_module_header: S.die( 'module_header_begin() called while already in a module header' )
+    g.rams = {}
+    g.fifos = {}
     if with_file_header:
         P(f'// AUTOMATICALLY GENERATED - DO NOT EDIT OR CHECK IN' )
         P()
         P(f'`timescale 1ns/1ps' )
         P()
-    io = []
-    in_module_header = True
+    g.io = []
+    g.in_module_header = True
 
 def decl( kind, name, w, is_io=False ):     
     if w <= 0: S.die( f'{kind} {name} has width {w}' )
-    global io
+    g = tls.gen
     if is_io:
-        io.append( { 'name': name, 'kind': kind, 'width': w } )
+        g.io.append( { 'name': name, 'kind': kind, 'width': w } )
+    elif g.netlist is not None:
+        ir_add( Node( kind, name, w ) )
     else:
-        P( kind + ' ' + (('[' + str(w-1) + ':' + '0] ') if w != 1 else '') + name + ';' )
+        P( decl_text( kind, name, w ) )
+    if g.profiler is not None: g.profiler.decl( w )
 
 def decla( kind, name, w, v ):
     if w <= 0: S.die( f'{kind} {name} has width {w}' )
-    P( kind + ' ' + (('[' + str(w-1) + ':' + '0] ') if w != 1 else '') + name + ' = ' + f'{v}' + ';' )
+    g = tls.gen
+    if g.netlist is not None:
+        ir_add( Node( kind, name, w, f'{v}' ) )
+    else:
+        P( decl_text( kind, name, w, v ) )
+    if g.profiler is not None: g.profiler.decl( w )
 
 def input( name, w ):      
     decl( 'input ', name, w, True )
@@ -137,7 +672,12 @@ def wire( name, w ):       decl( 'wire', name, w )
 def wirea( name, w, v ):   decla( 'wire', name, w, v )
 def swire( name, w ):      decl( 'wire signed', name, w )
 def swirea( name, w, v ):  decla( 'wire signed', name, w, v )
-def assign( name, w, v ):  P( f'assign {name} = {v};' )
+def assign( name, w, v ):  
+    g = tls.gen
+    if g.netlist is not None:
+        ir_add( Node( 'assign', name, w, f'{v}' ) )
+    else:
+        P( f'assign {name} = {v};' )
 def reg( name, w ):        decl( 'reg', name, w )
 def rega( name, w, v ):    
     reg( name, w )    
@@ -148,9 +688,9 @@ def srega( name, w, v ):
     always_at_posedge( f'{name} <= {v};' )
 
 def module_header_end( no_warn_filename=False ):
-    global in_module_header
-    global io
-    if not in_module_header: S.die( 'module_header_end() called while not already in a module header' )
+    g = tls.gen
+    io = g.io
+    if not g.in_module_header: S.die( 'module_header_end() called while not already in a module header' )
     ports_s = ''
     io_s = ''
     for i in range( len(io) ):
@@ -164,11 +704,11 @@ def module_header_end( no_warn_filename=False ):
     if no_warn_filename: P( f'// {vlint_off_filename}' )
     if ports_s == '': 
         P(f'`ifndef VERILATOR' )
-    P(f'module {module_name}{ports_s};' )
+    P(f'module {g.module_name}{ports_s};' )
     if ports_s == '': 
         P(f'`else' )
-        P(f'module {module_name}( {clk} );' )
-        P(f'input {clk};' )
+        P(f'module {g.module_name}( {g.clk} );' )
+        P(f'input {g.clk};' )
         P(f'`endif' )
     if no_warn_filename: P( f'// {vlint_on_filename}' )
     P()
@@ -178,8 +718,9 @@ def module_header_end( no_warn_filename=False ):
             P( io[i]['kind'] + ' ' + (('[' + str(w-1) + ':' + '0] ') if w != 1 else '') + io[i]['name'] + ';' )
         else:
             P()
-    in_module_header = False
-    io = []
+    g.in_module_header = False
+    if g.ir: ir_begin()
+    g.io = []
 
 #-------------------------------------------
 # ENUMERATION TYPES
@@ -232,19 +773,19 @@ def display( msg, sigs, use_hex_w=16, prefix='        ', show_module=False ):
     P( f'{prefix}$display( "{fmt}", $stime{vals} );' )
 
 def dprint( msg, sigs, pvld, use_hex_w=16, with_clk=True, indent='' ):
-    if not vdebug: return
+    if not tls.gen.vdebug: return
     P(f'// synopsys translate_off' )
     prefix = indent
-    if with_clk: prefix += f'always @( posedge {clk} ) '
+    if with_clk: prefix += f'always @( posedge {tls.gen.clk} ) '
     if pvld != '': prefix += f'if ( {pvld} ) '
     display( msg, sigs, use_hex_w, prefix )
     P(f'// synopsys translate_on' )
 
 def dassert( expr, msg, pvld='', with_clk=True, indent='    ', if_fatal='' ):
-    if not vassert: return
+    if not tls.gen.vassert: return
     P(f'// synopsys translate_off' )
     if with_clk: always_at_posedge()
-    reset_test = f'{reset_} === 1\'b1 && ' if with_clk else ''
+    reset_test = f'{tls.gen.reset_} === 1\'b1 && ' if with_clk else ''
     pvld_test  = f'({pvld}) && '             if pvld != '' else ''
     P(f'{indent}if ( {reset_test}{pvld_test}(({expr}) !== 1\'b1) ) begin' )
     P(f'{indent}    $display( "%0d: ERROR: {msg}", $stime );' )
@@ -260,8 +801,15 @@ def dassert_no_x( expr, pvld='', with_clk=True, indent='    ', if_fatal='' ):
 # Common Verilog code wrappers
 #-------------------------------------------
 def always_at_posedge( stmt='begin', _clk='' ):
-    if _clk == '': _clk = clk
-    P( f'always @( posedge {_clk} ) {stmt}' )
+    g = tls.gen
+    if _clk == '': _clk = g.clk
+    if g.netlist is not None:
+        m = always_re.match( stmt )
+        name = m.group( 1 ) if m else ''
+        fanin = idents( f'{_clk} {m.group( 2 )}' if m else f'{_clk} {stmt}' )
+        ir_add( Node( 'always', name, 0, f'@( posedge {_clk} ) {stmt}', fanin ) )
+    else:
+        P( f'always @( posedge {_clk} ) {stmt}' )
 
 #-------------------------------------------
 # Replicate expression cnt times as a concatenation
@@ -299,9 +847,11 @@ def resize( expr, w, r_w ):
 #-------------------------------------------
 def reverse( bits, w, rbits='' ):
     if rbits == '': rbits = f'{bits}_rev' 
+    comb_begin( rbits, w )
     P(f'reg [{w-1}:0] {rbits};' )
     i = f'{rbits}_i'
     P(f'integer {i}; always @(*) for( {i} = 0; {i} < {w}; {i} = {i} + 1 ) {rbits}[{i}] = {bits}[{w-1}-{i}]; // reverses bits; generates no logic' )
+    comb_end()
     return rbits
 
 #-------------------------------------------
@@ -339,6 +889,37 @@ def unconcata( combined, cnt, w, r='', reverse=True ):
         if r != '': wirea( f'{r}{i}', w, v )
     return vals
 
+#-------------------------------------------
+# Gray code conversions.
+# These return expressions. b and g should be signal names.
+#-------------------------------------------
+def binary_to_gray( b ):
+    return f'({b} ^ ({b} >> 1))'
+
+def gray_to_binary( g, w ):
+    return concata( [f'^{g}[{w-1}:{i}]' for i in range( w-1, -1, -1 )], 1, reverse=False )
+
+#-------------------------------------------
+# Synchronizes x into the _clk domain through a chain of sync_cnt flops named {r}0 .. {r}{sync_cnt-1}
+# and returns the name of the last one. x should change at most one bit per cycle of its
+# own clock, as a gray-coded pointer does.
+#-------------------------------------------
+def synchronizer( r, w, x, sync_cnt=2, _clk='', _reset_='' ):
+    g = tls.gen
+    if sync_cnt < 1: S.die( f'synchronizer(): sync_cnt must be >= 1' )
+    if _clk == '': _clk = g.clk
+    if _reset_ == '': _reset_ = g.reset_
+    for i in range( sync_cnt ): reg( f'{r}{i}', w )
+    always_at_posedge( _clk=_clk )
+    P(f'    if ( !{_reset_} ) begin' )
+    for i in range( sync_cnt ): P(f'        {r}{i} <= 0;' )
+    P(f'    end else begin' )
+    P(f'        {r}0 <= {x};' )
+    for i in range( 1, sync_cnt ): P(f'        {r}{i} <= {r}{i-1};' )
+    P(f'    end' )
+    P(f'end' )
+    return f'{r}{sync_cnt-1}'
+
 #-------------------------------------------
 # INTERFACES
 #-------------------------------------------
@@ -350,7 +931,7 @@ def iface_width( sigs ):
 
 def iface_decl( kind, name, sigs, is_io=False, stallable=True ):
     if is_io:
-        io.append( { 'name': '', 'kind': '', 'width': 0 } )
+        tls.gen.io.append( { 'name': '', 'kind': '', 'width': 0 } )
         if stallable:
             rkind = 'output' if kind == 'input' else 'input' if kind == 'output' else kind
             decl( rkind, name + '_prdy', 1, True )
@@ -452,8 +1033,25 @@ def iface_split( iname, oname, sigs, reverse=True, do_decl=True ):
     assign = 'assign ' if do_decl else '    '
     P(f'{assign}{oconcat} = {iname};' )
 
-def iface_stage( iname, oname, sigs, pvld, prdy='', full_handshake=False, do_dprint=True ):
-    if prdy == '' or not full_handshake:
+#---------------------------------------------------------
+# Register an interface. mode is one of:
+#
+# pipe   - one set of flops; {iname}_{prdy} is !{oname}_pvld || {oname}_{prdy}
+#          (without prdy, this is a plain sample flop)
+# skid   - two sets of flops; {iname}_prdy comes straight from flops, so it
+#          breaks the ready path without losing throughput
+# bypass - zero latency; {iname} passes straight through to {oname} unless
+#          {oname} is stalled, in which case one entry is held in flops
+#
+# The default mode is skid if there is a prdy and full_handshake=True, else pipe.
+#---------------------------------------------------------
+def iface_stage( iname, oname, sigs, pvld, prdy='', full_handshake=False, do_dprint=True, mode='', with_perf=False ):
+    g = tls.gen
+    if mode == '': mode = 'skid' if prdy != '' and full_handshake else 'pipe'
+    if mode not in [ 'pipe', 'skid', 'bypass' ]: S.die( f'iface_stage: unknown mode {mode}' )
+    if mode != 'pipe' and (pvld == '' or prdy == ''): S.die( f'iface_stage: mode={mode} requires pvld and prdy' )
+    if with_perf and (pvld == '' or prdy == ''): S.die( f'iface_stage: with_perf=True requires pvld and prdy' )
+    if mode == 'pipe':
         #-----------------------------------------
         # sample - one set of flops
         #-----------------------------------------
@@ -463,7 +1061,7 @@ def iface_stage( iname, oname, sigs, pvld, prdy='', full_handshake=False, do_dpr
             reg( f'{oname}_{sig}', sigs[sig] )
         always_at_posedge()
         if pvld != '':
-            P(f'    if ( !{reset_} ) begin' )
+            P(f'    if ( !{g.reset_} ) begin' )
             P(f'        {oname}_{pvld} <= 0;' )
             if prdy == '':
                 P(f'    end else begin' )
@@ -480,6 +1078,28 @@ def iface_stage( iname, oname, sigs, pvld, prdy='', full_handshake=False, do_dpr
                 P(f'    {oname}_{sig} <= {iname}_{sig};' )
         P(f'end' )
         if do_dprint and pvld != '': iface_dprint( iname, sigs, f'{iname}_{pvld}' )
+    elif mode == 'bypass':
+        #-----------------------------------------
+        # bypass - one set of flops that is used only when {oname} stalls
+        #-----------------------------------------
+        reg( f'{oname}__0_{pvld}', 1 )
+        iface_reg( f'{oname}__0', sigs )
+        P(f'assign {iname}_{prdy} = !{oname}__0_{pvld} || {oname}_{prdy};' )
+        wirea( f'{oname}_{pvld}', 1, f'{oname}__0_{pvld} || {iname}_{pvld}' )
+        for sig in sigs: wirea( f'{oname}_{sig}', sigs[sig], f'{oname}__0_{pvld} ? {oname}__0_{sig} : {iname}_{sig}' )
+        wirea( f'{oname}__0_ld', 1, f'{iname}_{pvld} && {iname}_{prdy} && ({oname}__0_{pvld} || !{oname}_{prdy})' )
+        always_at_posedge()
+        P(f'    if ( !{g.reset_} ) begin' )
+        P(f'        {oname}__0_{pvld} <= 1\'b0;' )
+        P(f'    end else begin' )
+        P(f'        {oname}__0_{pvld} <= {oname}__0_ld || ({oname}__0_{pvld} && !{oname}_{prdy});' )
+        P(f'    end' )
+        P()
+        P(f'    if ( {oname}__0_ld ) begin' )
+        iface_reg_assign( f'{oname}__0', f'{iname}', sigs )
+        P(f'    end' )
+        P(f'end' )
+        if do_dprint: iface_dprint( iname, sigs, f'{iname}_{pvld}', f'{iname}_{prdy}' )
     else:
         #-----------------------------------------
         # full handshake - two sets of flops
@@ -497,7 +1117,7 @@ def iface_stage( iname, oname, sigs, pvld, prdy='', full_handshake=False, do_dpr
         P(f'wire {oname}_wr_1 = {iname}_pvld && ({iname}_prdy && ({oname}_pvld ?  {oname}_rd_0 : !{oname}_rd_0));' )
         P()
         always_at_posedge()
-        P(f'    if ( !{reset_} ) begin' )
+        P(f'    if ( !{g.reset_} ) begin' )
         P(f'        {oname}_pvld   <= 1\'b0;' )
         P(f'        {oname}_pvld_n <= 1\'b0;' )
         P(f'        {oname}_rd_0   <= 1\'b0;' )
@@ -520,9 +1140,144 @@ def iface_stage( iname, oname, sigs, pvld, prdy='', full_handshake=False, do_dpr
         P(f'    end' )
         P(f'end' )
         if do_dprint: iface_dprint( iname, sigs, f'{iname}_{pvld}', f'{iname}_prdy' )
+    if with_perf: iface_perf( f'{oname}_perf', iname, oname, pvld, prdy )
+
+#---------------------------------------------------------
+# Register stage p of a pipeline of interfaces p0, p1, ..., i.e., p{p} -> p{p+1}.
+# mode is one of iface_stage()'s modes or 'credit', which uses iface_credit() with latency flops 
+# each way, so long or retimed pipelines have no ready path between stages.
+#---------------------------------------------------------
+def iface_stageN( p, sigs, pvld, prdy='', full_handshake=False, do_print=False, mode='', latency=1, credit_cnt=0 ):
+    if mode == 'credit':
+        iface_credit( f'p{p}', f'p{p+1}', sigs, credit_cnt, latency, pvld, prdy, do_print )
+    else:
+        iface_stage( f'p{p}', f'p{p+1}', sigs, pvld, prdy, full_handshake, do_print, mode )
 
-def iface_stageN( p, sigs, pvld, prdy='', full_handshake=False, do_print=False ):
-    iface_stage( f'p{p}', f'p{p+1}', sigs, pvld, prdy, full_handshake, do_print )
+#---------------------------------------------------------
+# Register an interface through depth stages: iname -> {oname}_p1 -> ... -> {oname}_p{depth-1} -> oname.
+# mode is either one mode for all stages or a list with one mode per stage, so plain-flop (pipe), 
+# full-handshake (skid), and bypass stages can be mixed. 'credit' is also allowed and uses iface_credit() 
+# with latency flops each way. The intermediate {oname}_p* prdy's are declared here; as with iface_stage(), 
+# the caller declares {iname} and {oname}_{prdy}. With with_perf=True, each stage gets iface_perf() counters 
+# named {stage oname}_perf_*, whose stall_cycles and empty_cycles give the stage's stall and bubble rates.
+# Returns the list of interface names from iname to oname, e.g., for iface_perf_display().
+#---------------------------------------------------------
+def iface_pipeline( iname, oname, sigs, depth, mode='', pvld='pvld', prdy='prdy', latency=1, do_dprint=False, with_perf=False ):
+    modes = mode if isinstance( mode, list ) else [mode] * depth
+    if depth < 1: S.die( f'iface_pipeline: depth must be >= 1' )
+    if len( modes ) != depth: S.die( f'iface_pipeline: got {len( modes )} modes for {depth} stages' )
+    names = [iname] + [ f'{oname}_p{i}' for i in range( 1, depth ) ] + [oname]
+    if prdy != '':
+        for i in range( 1, depth ): wire( f'{names[i]}_{prdy}', 1 )
+    for i in range( depth ):
+        if modes[i] == 'credit':
+            iface_credit( names[i], names[i+1], sigs, 0, latency, pvld, prdy, do_dprint, with_perf )
+        else:
+            iface_stage( names[i], names[i+1], sigs, pvld, prdy, do_dprint=do_dprint, mode=modes[i], with_perf=with_perf )
+    return names
+
+#---------------------------------------------------------
+# Credit-based interfaces.
+#
+# The sender of a credit-based link lname starts with credit_cnt credits, spends one for each entry 
+# it sends on {lname}_{pvld}/{lname}_{sig}, and gets one back in each cycle that {lname}_credit is 1.
+# {iname}_{prdy} is {lname}_credits != 0, which comes from a flop, so there is no ready path back 
+# from the receiver. The receiver holds up to credit_cnt entries in flops and returns a credit 
+# each time one is popped from {oname}. Because the sender can never send more entries than the receiver 
+# has room for, the link needs no prdy, and iface_credit_delay() can add any number of plain flops to it.
+#
+# iface_credit_send(), iface_credit_delay(), and iface_credit_recv() may be in different modules. 
+# With do_decl=False, the sender's {lname}_{pvld}/{lname}_{sig}, the receiver's {lname}_credit, and the delay's 
+# {iname}_credit are not declared (e.g., because they are output ports), so the caller must declare them first.
+#
+# iface_credit() builds the whole link iname -> oname: the sender, latency flops each way, and the receiver,
+# with the link named {oname}_l0 ... {oname}_l{latency}. A credit takes 2*latency+2 cycles to get back to 
+# the sender, so that is the smallest credit_cnt that allows full throughput and is the default (credit_cnt=0).
+# The caller declares {iname} and {oname}_{prdy}, as with iface_stage().
+#---------------------------------------------------------
+def iface_credit( iname, oname, sigs, credit_cnt=0, latency=1, pvld='pvld', prdy='prdy', do_dprint=True, with_perf=False ):
+    if credit_cnt == 0: credit_cnt = 2*latency + 2
+    if latency < 0: S.die( f'iface_credit: latency must be >= 0' )
+    links = [ f'{oname}_l{i}' for i in range( latency+1 ) ]
+    for i in range( latency ): reg( f'{links[i]}_credit', 1 )
+    wire( f'{links[-1]}_credit', 1 )
+    iface_credit_send( iname, links[0], sigs, credit_cnt, pvld, prdy )
+    for i in range( latency ):
+        iface_credit_delay( links[i], links[i+1], sigs, pvld, do_decl=False )
+    iface_credit_recv( links[-1], oname, sigs, credit_cnt, pvld, prdy, do_decl=False )
+    if do_dprint: iface_dprint( iname, sigs, f'{iname}_{pvld}', f'{iname}_{prdy}' )
+    if with_perf: iface_perf( f'{oname}_perf', iname, oname, pvld, prdy )
+
+def iface_credit_send( iname, lname, sigs, credit_cnt, pvld='pvld', prdy='prdy', do_decl=True ):
+    g = tls.gen
+    cnt_w = value_bitwidth( credit_cnt )
+    reg( f'{lname}_credits', cnt_w )
+    P(f'assign {iname}_{prdy} = {lname}_credits != 0;' )
+    if do_decl:
+        wirea( f'{lname}_{pvld}', 1, f'{iname}_{pvld} && {iname}_{prdy}' )
+        for sig in sigs: wirea( f'{lname}_{sig}', sigs[sig], f'{iname}_{sig}' )
+    else:
+        P(f'assign {lname}_{pvld} = {iname}_{pvld} && {iname}_{prdy};' )
+        for sig in sigs: P(f'assign {lname}_{sig} = {iname}_{sig};' )
+    always_at_posedge()
+    P(f'    if ( !{g.reset_} ) begin' )
+    P(f'        {lname}_credits <= {credit_cnt};' )
+    P(f'    end else if ( {lname}_{pvld} != {lname}_credit ) begin' )
+    P(f'        // {vlint_off_width}' )
+    P(f'        {lname}_credits <= {lname}_credits + {lname}_credit - {lname}_{pvld};' )
+    P(f'        // {vlint_on_width}' )
+    P(f'    end' )
+    P(f'end' )
+    dassert( f'!{lname}_credit || {lname}_{pvld} || {lname}_credits != {credit_cnt}', f'{lname} returned more credits than it has' )
+
+def iface_credit_delay( iname, oname, sigs, pvld='pvld', do_decl=True ):
+    g = tls.gen
+    iface_stage( iname, oname, sigs, pvld, '', do_dprint=False )
+    if do_decl: reg( f'{iname}_credit', 1 )
+    always_at_posedge()
+    P(f'    if ( !{g.reset_} ) begin' )
+    P(f'        {iname}_credit <= 1\'b0;' )
+    P(f'    end else begin' )
+    P(f'        {iname}_credit <= {oname}_credit;' )
+    P(f'    end' )
+    P(f'end' )
+
+def iface_credit_recv( lname, oname, sigs, credit_cnt, pvld='pvld', prdy='prdy', do_decl=True ):
+    g = tls.gen
+    a_w   = max( 1, log2( credit_cnt ) )
+    cnt_w = value_bitwidth( credit_cnt )
+    for i in range( credit_cnt ): iface_reg( f'{oname}__{i}', sigs )
+    reg( f'{oname}_cnt', cnt_w )
+    reg( f'{oname}_wa', a_w )
+    reg( f'{oname}_ra', a_w )
+    wirea( f'{oname}_{pvld}', 1, f'{oname}_cnt != 0' )
+    for sig in sigs: muxa( f'{oname}_{sig}', sigs[sig], f'{oname}_ra', [ f'{oname}__{i}_{sig}' for i in range( credit_cnt ) ] )
+    wirea( f'{oname}_popping', 1, f'{oname}_{pvld} && {oname}_{prdy}' )
+    if do_decl:
+        wirea( f'{lname}_credit', 1, f'{oname}_popping' )
+    else:
+        P(f'assign {lname}_credit = {oname}_popping;' )
+    always_at_posedge()
+    P(f'    if ( !{g.reset_} ) begin' )
+    P(f'        {oname}_cnt <= 0;' )
+    P(f'        {oname}_wa <= 0;' )
+    P(f'        {oname}_ra <= 0;' )
+    P(f'    end else begin' )
+    P(f'        if ( {lname}_{pvld} != {oname}_popping ) begin' )
+    P(f'            // {vlint_off_width}' )
+    P(f'            {oname}_cnt <= {oname}_cnt + {lname}_{pvld} - {oname}_popping;' )
+    P(f'            // {vlint_on_width}' )
+    P(f'        end' )
+    P(f'        if ( {lname}_{pvld} ) {oname}_wa <= ({oname}_wa == {credit_cnt-1}) ? 0 : ({oname}_wa+1);' )
+    P(f'        if ( {oname}_popping ) {oname}_ra <= ({oname}_ra == {credit_cnt-1}) ? 0 : ({oname}_ra+1);' )
+    P(f'    end' )
+    P()
+    for i in range( credit_cnt ):
+        P(f'    if ( {lname}_{pvld} && {oname}_wa == {i} ) begin' )
+        iface_reg_assign( f'{oname}__{i}', lname, sigs )
+        P(f'    end' )
+    P(f'end' )
+    dassert( f'!{lname}_{pvld} || {oname}_cnt != {credit_cnt} || {oname}_popping', f'{lname} sent an entry without a credit' )
 
 def iface_dprint( name, sigs, pvld, prdy='', use_hex_w=16, with_clk=True, indent='' ):
     isigs = {}
@@ -531,6 +1286,77 @@ def iface_dprint( name, sigs, pvld, prdy='', use_hex_w=16, with_clk=True, indent
     if prdy != '': vld += f' && {prdy}'
     dprint( name, isigs, vld, use_hex_w=16, with_clk=with_clk, indent=indent )
 
+#---------------------------------------------------------
+# Performance counters for a buffer between iname and oname, such as a fifo or iface_stage().
+# They are generated only if VPY_PERF is defined (vsim.py -perf), so they cost nothing otherwise:
+#
+# {r}_push_cnt      - entries accepted from {iname}
+# {r}_pop_cnt       - entries taken by {oname}
+# {r}_full_cycles   - cycles when {iname}_{prdy} was 0 (full or back-pressuring)
+# {r}_stall_cycles  - cycles when {iname} was valid but {iname}_{prdy} was 0
+# {r}_empty_cycles  - cycles when {oname} lane 0 was ready but not valid
+# {r}_occ_max       - high-water mark of the occupancy
+#
+# The occupancy is the pushes minus the pops unless occ names a signal that holds it.
+# ilane_cnt and olane_cnt are the number of pvld bits on each side. 
+# The {oname} counters use _oclk and _oreset_ if given, which is the case for an asynchronous fifo.
+# iface_perf_display() displays the counters, e.g., from a testbench using hierarchical names.
+#---------------------------------------------------------
+def iface_perf( r, iname, oname, pvld='pvld', prdy='prdy', ilane_cnt=1, olane_cnt=1, occ='', _oclk='', _oreset_='' ):
+    g = tls.gen
+    if _oclk == '': _oclk = g.clk
+    if _oreset_ == '': _oreset_ = g.reset_
+    P()
+    P(f'`ifdef VPY_PERF' )
+    P(f'// PERF COUNTERS' )
+    P(f'//' )
+    for cnt in [ 'push_cnt', 'pop_cnt', 'full_cycles', 'stall_cycles', 'empty_cycles', 'occ_max' ]: P(f'reg [31:0] {r}_{cnt};' )
+    if olane_cnt > 1:
+        P(f'wire [{olane_cnt-1}:0] {r}_popping = {oname}_{pvld} & {oname}_{prdy};' )
+    else:
+        P(f'wire {r}_popping = {oname}_{pvld} && {oname}_{prdy};' )
+    if ilane_cnt > 1:
+        P(f'wire [{ilane_cnt-1}:0] {r}_pushing = {iname}_{prdy} ? {iname}_{pvld} : {ilane_cnt}\'d0;' )
+    else:
+        P(f'wire {r}_pushing = {iname}_{pvld} && {iname}_{prdy};' )
+    push_n = count_ones( f'{r}_pushing', ilane_cnt ) if ilane_cnt > 1 else f'{r}_pushing'
+    pop_n  = count_ones( f'{r}_popping', olane_cnt ) if olane_cnt > 1 else f'{r}_popping'
+    if occ == '':
+        occ = f'{r}_occ'
+        P(f'reg [31:0] {occ};' )
+    else:
+        P(f'wire [31:0] {r}_occ = {occ};' )
+    P(f'// {vlint_off_width}' )
+    always_at_posedge()
+    P(f'    if ( !{g.reset_} ) begin' )
+    for cnt in [ 'push_cnt', 'full_cycles', 'stall_cycles', 'occ_max' ]: P(f'        {r}_{cnt} <= 0;' )
+    if occ == f'{r}_occ': P(f'        {occ} <= 0;' )
+    P(f'    end else begin' )
+    P(f'        {r}_push_cnt <= {r}_push_cnt + {push_n};' )
+    P(f'        if ( !{iname}_{prdy} ) {r}_full_cycles <= {r}_full_cycles + 1;' )
+    P(f'        if ( {iname}_{pvld} != 0 && !{iname}_{prdy} ) {r}_stall_cycles <= {r}_stall_cycles + 1;' )
+    if occ == f'{r}_occ': P(f'        {occ} <= {occ} + {push_n} - {pop_n};' )
+    P(f'        if ( {r}_occ > {r}_occ_max ) {r}_occ_max <= {r}_occ;' )
+    P(f'    end' )
+    P(f'end' )
+    opvld = f'{oname}_{pvld}[0]' if olane_cnt > 1 else f'{oname}_{pvld}'
+    oprdy = f'{oname}_{prdy}[0]' if olane_cnt > 1 else f'{oname}_{prdy}'
+    always_at_posedge( _clk=_oclk )
+    P(f'    if ( !{_oreset_} ) begin' )
+    P(f'        {r}_pop_cnt <= 0;' )
+    P(f'        {r}_empty_cycles <= 0;' )
+    P(f'    end else begin' )
+    P(f'        {r}_pop_cnt <= {r}_pop_cnt + {pop_n};' )
+    P(f'        if ( {oprdy} && !{opvld} ) {r}_empty_cycles <= {r}_empty_cycles + 1;' )
+    P(f'    end' )
+    P(f'end' )
+    P(f'// {vlint_on_width}' )
+    P(f'`endif' )
+
+def iface_perf_display( r, label, indent='' ):
+    P(f'{indent}$display( "%0d: PERF {label}: pushes=%0d pops=%0d full_cycles=%0d stall_cycles=%0d empty_cycles=%0d occ_max=%0d", $stime, ' +
+      f'{r}_push_cnt, {r}_pop_cnt, {r}_full_cycles, {r}_stall_cycles, {r}_empty_cycles, {r}_occ_max );' )
+
 #---------------------------------------------------------
 # Wrapped add and sub (combinational)
 #
@@ -539,33 +1365,49 @@ def iface_dprint( name, sigs, pvld, prdy='', use_hex_w=16, with_clk=True, indent
 #
 # We assume that A and B are unsigned and already < 
 # C is a constant.
+#
+# By default, the sum or difference is left to synthesis.
+# kind and max_depth select a prefix adder through cla() instead 
+# (see prefix_adder_kind()).
 #---------------------------------------------------------
-def wrapped_add( r, w, a, b, c ):
+def wrapped_add( r, w, a, b, c, kind='', max_depth=0 ):
+    sw = w if is_pow2( c ) else w+1
+    if kind == '' and max_depth == 0:
+        sum = f'{a} + {b}'
+    else:
+        sum = cla( f'{r}_cla', sw, a, b, 0, kind, max_depth )
     if is_pow2( c ):
-        P(f'wire [{w-1}:0] {r} = {a} + {b};' )
+        wirea( r, w, sum )
     else:
-        P(f'wire [{w}:0] {r}_add = {a} + {b};' )
-        P(f'wire [{w-1}:0] {r} = (({r}_add >= {c}) ? ({r}_add - {c}) : {r}_add;' )
+        wirea( f'{r}_add', w+1, sum )
+        wirea( r, w, f'({r}_add >= {c}) ? ({r}_add - {c}) : {r}_add' )
     return r
 
-def wrapped_sub( r, w, a, b, c ):
+def wrapped_sub( r, w, a, b, c, kind='', max_depth=0 ):
+    sw = w if is_pow2( c ) else w+1
+    if kind == '' and max_depth == 0:
+        diff = f'{a} - {b}'
+    else:
+        # a + ~b + 1
+        wirea( f'{r}_b', sw, b )
+        diff = cla( f'{r}_cla', sw, a, f'~{r}_b', 1, kind, max_depth )
     if is_pow2( c ):
-        P(f'wire [{w-1}:0] {r} = {a} - {b};' )
+        wirea( r, w, diff )
     else:
-        P(f'wire [{w}:0] {r}_sub = {a} - {b};' )
-        P(f'wire [{w-1}:0] {r} = (({r}_sub >= {c}) ? ({r}_sub + {c}) : {r}_sub;' )
+        wirea( f'{r}_sub', w+1, diff )
+        wirea( r, w, f'({r}_sub >= {c}) ? ({r}_sub + {c}) : {r}_sub' )
     return r
 
 #---------------------------------------------------------
 # Adder and subtractor are register values that can wrap
 #---------------------------------------------------------
-def adder( r, c, do_incr, init=0, incr=1, _clk='', _reset_='' ):
-    if _clk == '': _clk = clk
-    if _reset_ == '': _reset_ = reset_
+def adder( r, c, do_incr, init=0, incr=1, _clk='', _reset_='', kind='', max_depth=0 ):
+    if _clk == '': _clk = tls.gen.clk
+    if _reset_ == '': _reset_ = tls.gen.reset_
     w = log2( c )
     reg( r, w )
-    wrapped_add( f'{r}_p', w, r, incr, c )
-    always_at_posedge( _clk )
+    wrapped_add( f'{r}_p', w, r, incr, c, kind, max_depth )
+    always_at_posedge( _clk=_clk )
     P(f'    if ( !{_reset_} ) begin' )
     P(f'        {r} <= {init};' )
     P(f'    end else if ( {do_incr} ) begin' )
@@ -573,25 +1415,171 @@ def adder( r, c, do_incr, init=0, incr=1, _clk='', _reset_='' ):
     P(f'    end' )
     P(f'end' )
 
-def subtractor( r, c, do_decr, init=0, decr=1, _clk='', _reset_='' ):
-    if _clk == '': _clk = clk
-    if _reset_ == '': _reset_ = reset_
+def subtractor( r, c, do_decr, init=0, decr=1, _clk='', _reset_='', kind='', max_depth=0 ):
+    if _clk == '': _clk = tls.gen.clk
+    if _reset_ == '': _reset_ = tls.gen.reset_
     w = log2( c )
     reg( r, w )
-    wrapped_sub( f'{r}_p', w, r, decr, c )
-    always_at_posedge( _clk )
+    wrapped_sub( f'{r}_p', w, r, decr, c, kind, max_depth )
+    always_at_posedge( _clk=_clk )
     P(f'    if ( !{_reset_} ) begin' )
-    P(f'        {r} <= {i};' )
+    P(f'        {r} <= {init};' )
     P(f'    end else if ( {do_decr} ) begin' )
     P(f'        {r} <= {r}_p;' )
     P(f'    end' )
     P(f'end' )
 
+#---------------------------------------------------------
+# Parallel-prefix adders
+#
+# Each bit i has generate g_i = a_i & b_i and propagate p_i = a_i ^ b_i,
+# with cin folded into bit 0 as g_0 | (p_0 & cin). A prefix network then 
+# combines (G,P) pairs using:
+#
+#     (G,P)_i o (G,P)_j = (G_i | (P_i & G_j), P_i & P_j)      
+#
+# until node i holds the group generate for bits i..0, which is the carry into bit i+1.
+# The sum is p ^ {carries, cin}.
+#
+# The networks differ only in which nodes are combined at each level:
+#
+#     kogge_stone    - log2(w) levels, every node at every level (fastest, most nodes and wires)
+#     sklansky       - log2(w) levels, divide and conquer with high fan-out
+#     brent_kung     - 2*log2(w)-1 levels, up-sweep then down-sweep (fewest nodes)
+#     han_carlson    - Kogge-Stone on odd bits plus one level to fix up even bits
+#     ladner_fischer - Sklansky on odd bits plus one level to fix up even bits
+#
+# prefix_adder_schedule() returns the list of levels, each a list of (i, j) combines.
+# prefix_adder_cost() returns (levels, nodes).
+#---------------------------------------------------------
+prefix_adder_kinds = [ 'kogge_stone', 'sklansky', 'brent_kung', 'han_carlson', 'ladner_fischer' ]
+
+def prefix_adder_schedule( w, kind ):
+    levels = []
+    if kind == 'kogge_stone':
+        d = 1
+        while d < w:
+            levels.append( [(i, i-d) for i in range( d, w )] )
+            d <<= 1
+    elif kind == 'sklansky':
+        l = 0
+        while (1 << l) < w:
+            levels.append( [(i, ((i >> l) << l) - 1) for i in range( w ) if (i >> l) & 1] )
+            l += 1
+    elif kind == 'brent_kung':
+        d = 1
+        while d < w:
+            levels.append( [(i, i-d) for i in range( 2*d-1, w, 2*d )] )
+            d <<= 1
+        d >>= 2
+        while d >= 1:
+            levels.append( [(i, i-d) for i in range( 3*d-1, w, 2*d )] )
+            d >>= 1
+    elif kind == 'han_carlson' or kind == 'ladner_fischer':
+        levels.append( [(i, i-1) for i in range( 1, w, 2 )] )
+        if kind == 'han_carlson':
+            d = 2
+            while d < w:
+                levels.append( [(i, i-d) for i in range( d+1, w, 2 )] )
+                d <<= 1
+        else:
+            # Sklansky on odd node k = (i-1)/2
+            l = 0
+            while (2 << l) < w:
+                levels.append( [(2*k+1, 2*(((k >> l) << l) - 1)+1) for k in range( w >> 1 ) if (k >> l) & 1] )
+                l += 1
+        levels.append( [(i, i-1) for i in range( 2, w, 2 )] )
+    else:
+        S.die( f'unknown prefix adder kind: {kind}' )
+    levels = [level for level in levels if len( level ) != 0]
+
+    # check that node i ends up covering bits i..0
+    lo = list( range( w ) )
+    for level in levels:
+        new_lo = lo.copy()
+        for i, j in level:
+            if j >= i or lo[i] > j+1: S.die( f'{kind}: bad prefix node ({i}, {j})' )
+            new_lo[i] = lo[j]
+        lo = new_lo
+    if any( lo[i] != 0 for i in range( w ) ): S.die( f'{kind}: prefix network is incomplete for w={w}' )
+    return levels
+
+def prefix_adder_cost( w, kind ):
+    levels = prefix_adder_schedule( w, kind )
+    return len( levels ), sum( len( level ) for level in levels )
+
+#---------------------------------------------------------
+# Picks a prefix adder kind for w bits:
+#
+#     kind in prefix_adder_kinds  - that one
+#     kind == 'min_depth'         - fewest levels, then fewest nodes
+#     kind == 'min_area'          - fewest nodes, then fewest levels
+#     max_depth > 0               - fewest nodes with at most max_depth levels, 
+#                                   else the same as 'min_depth'
+#---------------------------------------------------------
+def prefix_adder_kind( w, kind='', max_depth=0 ):
+    if kind in prefix_adder_kinds: return kind
+    costs = { k: prefix_adder_cost( w, k ) for k in prefix_adder_kinds }
+    if kind == 'min_area': return min( costs, key=lambda k: (costs[k][1], costs[k][0]) )
+    if kind == 'min_depth' or kind == '':
+        ok = [k for k in costs if max_depth > 0 and costs[k][0] <= max_depth]
+        if kind == '' and len( ok ) != 0: return min( ok, key=lambda k: (costs[k][1], costs[k][0]) )
+        return min( costs, key=lambda k: (costs[k][0], costs[k][1]) )
+    S.die( f'unknown prefix adder kind: {kind}' )
+
+def prefix_adder( r, w, a, b, cin, kind ):
+    levels = prefix_adder_schedule( w, kind )
+    node_cnt = sum( len( level ) for level in levels )
+    P(f'// {kind} adder {r}: {w} bits, {len(levels)} prefix levels, {node_cnt} prefix nodes' )
+    wirea( f'{r}_A', w, a )
+    wirea( f'{r}_B', w, b )
+    wirea( f'{r}_p', w, f'{r}_A ^ {r}_B' )
+    wirea( f'{r}_g', w, f'{r}_A & {r}_B' )
+    G = [f'{r}_g[{i}]' for i in range( w )] if w > 1 else [f'{r}_g']
+    Pr = [f'{r}_p[{i}]' for i in range( w )] if w > 1 else [f'{r}_p']
+    has_cin = str( cin ) not in [ '0', "1'b0", "1'd0" ]
+    if has_cin:
+        wirea( f'{r}_cin', 1, cin )
+        wirea( f'{r}_G0_0', 1, f'{G[0]} | ({Pr[0]} & {r}_cin)' )
+        G[0] = f'{r}_G0_0'
+
+    # a node's P is needed only if it is on the left side of a later combine
+    P_needed_after = []
+    later = set()
+    for level in reversed( levels ):
+        P_needed_after.insert( 0, later.copy() )
+        later |= { i for i, j in level }
+
+    P( f'// {vlint_off_unused}' )
+    for l, level in enumerate( levels ):
+        new_G = G.copy()
+        new_P = Pr.copy()
+        for i, j in level:
+            wirea( f'{r}_G{l+1}_{i}', 1, f'{G[i]} | ({Pr[i]} & {G[j]})' )
+            new_G[i] = f'{r}_G{l+1}_{i}'
+            if i in P_needed_after[l]:
+                wirea( f'{r}_P{l+1}_{i}', 1, f'{Pr[i]} & {Pr[j]}' )
+                new_P[i] = f'{r}_P{l+1}_{i}'
+        G = new_G
+        Pr = new_P
+    P( f'// {vlint_on_unused}' )
+
+    carries = [G[i] for i in range( w-2, -1, -1 )] + [f'{r}_cin' if has_cin else "1'b0"]
+    wirea( f'{r}_C', w, '{' + ', '.join( carries ) + '}' )
+    wirea( f'{r}_S', w, f'{r}_p ^ {r}_C' )
+    return f'{r}_S'
+
 #---------------------------------------------------------
 # Carry Lookahead Adder (CLA)
+#
+# If kind or max_depth is given, generates one of the prefix adders above 
+# chosen by prefix_adder_kind().
 #---------------------------------------------------------
-def cla( r, w, a, b, cin ):
-    if not custom_cla: 
+def cla( r, w, a, b, cin, kind='', max_depth=0 ):
+    if kind != '' or max_depth != 0:
+        return prefix_adder( r, w, a, b, cin, prefix_adder_kind( w, kind, max_depth ) )
+
+    if not tls.gen.custom_cla: 
         # Let Synopsys do it.
         #
         P(f'wire [{w-1}:0] {r}_S = {a} + {b} + {cin};' )
@@ -698,10 +1686,10 @@ def vmax( a, b, r_w, r='' ):
 #-------------------------------------------
 # Compute integer log2( x ) in hardware
 #-------------------------------------------
-def vlog2( x, x_w, r='' ):
+def vlog2( x, x_w, r='', impl='case' ):
     if r == '': r = f'{x}_lg2'
     cnt_w = value_bitwidth( x_w )
-    ldz = count_leading_zeroes( x, x_w )
+    ldz = count_leading_zeroes( x, x_w, impl=impl )
     wirea( r, cnt_w, f'{cnt_w}\'d{x_w-1} - {ldz}' )
     return r
     
@@ -808,14 +1796,17 @@ def muxa( r, w, sel, vals, add_reg=True ):
         if add_reg:
             wirea( r, w, vals[0] )
         else:
-            P( f'always @( * ) {r} = {vals[i]};' )
+            comb_begin( r )
+            P( f'always @( * ) {r} = {vals[0]};' )
+            comb_end()
     elif len(vals) == 2:
         expr = f'{sel} ? {vals[1]} : {vals[0]}'
         if add_reg:
             wirea( r, w, expr )
         else:
-            P( f'assign {r} = {expr};' )  
+            assign( r, w, expr )
     else:
+        comb_begin( r, w if add_reg else 0 )
         if add_reg: P(f'reg [{w-1}:0] {r};' )
         P(f'always @( * ) begin' )
         P(f'    case( {sel} )' )
@@ -824,6 +1815,7 @@ def muxa( r, w, sel, vals, add_reg=True ):
         P(f'        default: {r} = {w}\'d0;' )
         P(f'    endcase' )
         P(f'end' )
+        comb_end()
     return r
 
 def muxr( r, w, sel, add_reg, *vals ):
@@ -895,6 +1887,8 @@ def muxN( sigs, sel, vals, add_reg=True ):
 #-------------------------------------------
 def rotate_left( r, cnt, n, bits, w=1 ):
     tw = cnt*w
+    if cnt > 2 and tls.gen.memoize:
+        return memo_inst( 'rotl', f'vpy_rotl_{cnt}x{w}', { 'cnt': cnt, 'w': w }, r, tw, [ ('x', bits), ('n', n) ] )
     vals = []
     for i in range( cnt ):
         vals.append( bits if i == 0 else f'{{{bits}[{tw-i*w-1}:0], {bits}[{tw-1}:{tw-i*w}]}}' )
@@ -902,6 +1896,8 @@ def rotate_left( r, cnt, n, bits, w=1 ):
 
 def rotate_right( r, cnt, n, bits, w=1 ):
     tw = cnt*w
+    if cnt > 2 and tls.gen.memoize:
+        return memo_inst( 'rotr', f'vpy_rotr_{cnt}x{w}', { 'cnt': cnt, 'w': w }, r, tw, [ ('x', bits), ('n', n) ] )
     vals = []
     for i in range( cnt ):
         vals.append( bits if i == 0 else f'{{{bits}[{i*w-1}:0], {bits}[{tw-1}:{i*w}]}}' )
@@ -963,69 +1959,209 @@ def count_ones( x, x_w, r='' ):
     return f'({sum})'
 
 #-------------------------------------------
-# Count leading zeroes/ones using priority encoder
+# MEMOIZED HELPER MODULES
+#
+# Normally, count_leading_zeroes(), count_leading_ones() (and so the trailing 
+# variants), rotate_left() and rotate_right() inline a full case/casez block 
+# every time they are called. With Gen( memoize=True ), each (helper, width, options) 
+# combination is instead generated once as a standalone module such as vpy_clz_64,
+# and each call instantiates it. This applies only when the helper declares its 
+# own result (add_reg=True).
+#
+# A memoized module is generated by the module_footer() of the first module 
+# that uses it, like any other post module, and is wrapped in an `ifndef guard 
+# so that separately generated .v files that each contain it can be compiled together.
+#-------------------------------------------
+def memo_inst( kind, mn, p, r, r_w, ins ):
+    g = tls.gen
+    if mn not in g.memo_modules:
+        g.memo_modules.add( mn )
+        g.post_modules[mn] = { 'generator': memo_make, 'params': dict( p, kind=kind ) }
+    conns = ', '.join( f'.{port}( {expr} )' for port, expr in ins )
+    comb_begin( r, r_w )
+    P( decl_text( 'wire', r, r_w ) )
+    P(f'{mn} u_{r}( {conns}, .r( {r} ) );' )
+    comb_end()
+    return r
+
+def memo_make( p, mn, with_file_header=True ):
+    g = tls.gen
+    memoize = g.memoize
+    g.memoize = False
+    kind = p['kind']
+    w = p['w']
+    module_header_begin( mn, with_file_header )
+    P()
+    P(f'`ifndef {mn.upper()}' )
+    P(f'`define {mn.upper()}' )
+    if kind == 'clz' or kind == 'clo':
+        r_w = value_bitwidth( w )
+        input( 'x', w )
+        output( 'r', r_w )
+        module_header_end()
+        P()
+        if kind == 'clz':
+            count_leading_zeroes( 'x', w, suff='_r', impl=p['impl'] )
+        else:
+            count_leading_ones( 'x', w, suff='_r', impl=p['impl'] )
+    elif kind == 'rotl' or kind == 'rotr':
+        cnt = p['cnt']
+        r_w = cnt*w
+        input( 'x', r_w )
+        input( 'n', log2( cnt ) )
+        output( 'r', r_w )
+        module_header_end()
+        P()
+        if kind == 'rotl':
+            rotate_left( 'x_r', cnt, 'n', 'x', w )
+        else:
+            rotate_right( 'x_r', cnt, 'n', 'x', w )
+    else:
+        S.die( f'memo_make: unknown kind {kind}' )
+    assign( 'r', r_w, 'x_r' )
+    module_footer( mn )
+    P(f'`endif // {mn.upper()}' )
+    g.memoize = memoize
+
 #-------------------------------------------
-def count_leading_zeroes( x, x_w, add_reg=True, suff='_ldz' ):
-    cnt_w = value_bitwidth( x_w )
-    if add_reg: 
-        P( f'// {vlint_off_unused}' )
-        reg( f'{x}{suff}', cnt_w )
-        P( f'// {vlint_on_unused}' )
+# Count leading zeroes/ones.
+#
+# impl selects the implementation:
+#
+#     'case' - a casez with x_w+1 priority-encoded entries (the default)
+#     'tree' - split x into halves recursively; each pair of halves is combined using 
+#              an AND of their all-zero flags and a 2:1 mux of their counts, 
+#              giving a log2(x_w)-level network
+#     'auto' - whichever one clz_cost() estimates has less logic depth for x_w
+#
+# The result is the same for all of them.
+#-------------------------------------------
+def clz_cost( x_w, impl ):
+    # returns estimated (logic depth, node count)
+    if impl == 'case': return x_w, x_w*(x_w+1) // 2
+    n = pow2_ge( x_w )
+    levels = log2( n )
+    return levels + 1, n + sum( (n >> (l+1)) * (l+2) for l in range( 1, levels ) ) + 1
+
+def clz_impl( x_w, impl ):
+    if impl == 'auto': impl = 'tree' if clz_cost( x_w, 'tree' )[0] < clz_cost( x_w, 'case' )[0] else 'case'
+    if impl not in [ 'case', 'tree' ]: S.die( f'unknown count_leading_*() impl: {impl}' )
+    if x_w < 2: impl = 'case'
+    return impl
+
+def count_leading_case( x, x_w, r, ones ):
+    z = '1' if ones else '0'
+    o = '0' if ones else '1'
+    comb_begin( r )
     P(f'always @( * ) begin' )
     P(f'    casez( {x} )' )
     for i in range( x_w+1 ):
         case = f'{x_w}\'b'
-        for k in range( i ): case += '0'
-        if i != x_w: case += '1'
+        for k in range( i ): case += z
+        if i != x_w: case += o
         for k in range( i+1, x_w ): case += '?'
-        P(f'        {case}: {x}{suff} = {i};' )
-    P(f'        default: {x}{suff} = 0;' )
+        P(f'        {case}: {r} = {i};' )
+    P(f'        default: {r} = 0;' )
     P(f'    endcase' )        
     P(f'end' )
+    comb_end()
+
+def count_leading_tree( x, x_w, r, ones ):
+    n = pow2_ge( x_w )
+    cnt_w = value_bitwidth( x_w )
+    if n != x_w:
+        # pad on the right with a bit that ends the leading run, so the padded x is never all-leading
+        pad = ('0' if ones else '1') * (n - x_w)
+        wirea( f'{r}_x', n, f'{{{x}, {n-x_w}\'b{pad}}}' )
+        x = f'{r}_x'
+    lead = (lambda b: b) if ones else (lambda b: f'!{b}')
+    zs = []                         # all bits in the group are leading bits
+    cs = []                         # count of leading bits in the group when not all of them are
+    for i in range( n >> 1 ):
+        hi = f'{x}[{n-1-2*i}]'
+        lo = f'{x}[{n-2-2*i}]'
+        wirea( f'{r}_z0_{i}', 1, f'{lead( hi )} && {lead( lo )}' )
+        wirea( f'{r}_c0_{i}', 1, lead( hi ) )
+        zs.append( f'{r}_z0_{i}' )
+        cs.append( f'{r}_c0_{i}' )
+    l = 1
+    while len( zs ) > 1:
+        new_zs = []
+        new_cs = []
+        for j in range( len( zs ) >> 1 ):
+            zh, zl = zs[2*j], zs[2*j+1]
+            ch, cl = cs[2*j], cs[2*j+1]
+            if len( zs ) > 2 or n == x_w: wirea( f'{r}_z{l}_{j}', 1, f'{zh} && {zl}' )  # top z is unused when padded
+            wirea( f'{r}_c{l}_{j}', l+1, f'{zh} ? {{1\'b1, {cl}}} : {{1\'b0, {ch}}}' )
+            new_zs.append( f'{r}_z{l}_{j}' )
+            new_cs.append( f'{r}_c{l}_{j}' )
+        zs = new_zs
+        cs = new_cs
+        l += 1
+    expr = cs[0] if n != x_w else f'{zs[0]} ? {cnt_w}\'d{x_w} : {{1\'b0, {cs[0]}}}'
+    comb_begin( r )
+    P(f'always @( * ) {r} = {expr};' )
+    comb_end()
+
+def count_leading_zeroes( x, x_w, add_reg=True, suff='_ldz', impl='case' ):
+    cnt_w = value_bitwidth( x_w )
+    impl = clz_impl( x_w, impl )
+    if add_reg and tls.gen.memoize:
+        mn = f'vpy_clz_{x_w}' if impl == 'case' else f'vpy_clz_{impl}_{x_w}'
+        return memo_inst( 'clz', mn, { 'w': x_w, 'impl': impl }, f'{x}{suff}', cnt_w, [ ('x', x) ] )
+    if add_reg: 
+        P( f'// {vlint_off_unused}' )
+        reg( f'{x}{suff}', cnt_w )
+        P( f'// {vlint_on_unused}' )
+    if impl == 'case':
+        count_leading_case( x, x_w, f'{x}{suff}', False )
+    else:
+        count_leading_tree( x, x_w, f'{x}{suff}', False )
     return f'{x}{suff}' 
 
-def count_leading_ones( x, x_w, add_reg=True, suff='_ldo' ):
+def count_leading_ones( x, x_w, add_reg=True, suff='_ldo', impl='case' ):
     cnt_w = value_bitwidth( x_w )
+    impl = clz_impl( x_w, impl )
+    if add_reg and tls.gen.memoize:
+        mn = f'vpy_clo_{x_w}' if impl == 'case' else f'vpy_clo_{impl}_{x_w}'
+        return memo_inst( 'clo', mn, { 'w': x_w, 'impl': impl }, f'{x}{suff}', cnt_w, [ ('x', x) ] )
     if add_reg: 
         P( f'// {vlint_off_unused}' )
         reg( f'{x}{suff}', cnt_w )
         P( f'// {vlint_on_unused}' )
-    P(f'always @( * ) begin' )
-    P(f'    casez( {x} )' )
-    for i in range( x_w+1 ):
-        case = f'{x_w}\'b'
-        for k in range( i ): case += '1'
-        if i != x_w: case += '0'
-        for k in range( i+1, x_w ): case += '?'
-        P(f'        {case}: {x}{suff} = {i};' )
-    P(f'        default: {x}{suff} = 0;' )
-    P(f'    endcase' )        
-    P(f'end' )
+    if impl == 'case':
+        count_leading_case( x, x_w, f'{x}{suff}', True )
+    else:
+        count_leading_tree( x, x_w, f'{x}{suff}', True )
     return f'{x}{suff}' 
 
 #-------------------------------------------
 # Count trailing zeroes/ones using reverse() and previous 
 #-------------------------------------------
-def count_trailing_zeroes( x, x_w, add_reg=True, suff='_trz' ):
+def count_trailing_zeroes( x, x_w, add_reg=True, suff='_trz', impl='case' ):
     reverse( x, x_w, f'{x}_rev' )
-    count_leading_zeroes( f'{x}_rev', x_w )
+    count_leading_zeroes( f'{x}_rev', x_w, impl=impl )
     cnt_w = value_bitwidth( x_w )
     if add_reg: 
         P( f'// {vlint_off_unused}' )
         reg( f'{x}{suff}', cnt_w )
         P( f'// {vlint_on_unused}' )
+    comb_begin( f'{x}{suff}' )
     P(f'always @( * ) {x}{suff} = {x}_rev_ldz;' )
+    comb_end()
     return f'{x}{suff}' 
 
-def count_trailing_ones( x, x_w, add_reg=True, suff='_ldo' ):
+def count_trailing_ones( x, x_w, add_reg=True, suff='_ldo', impl='case' ):
     reverse( x, x_w, f'{x}_rev' )
-    count_leading_ones( f'{x}_rev', x_w )
+    count_leading_ones( f'{x}_rev', x_w, impl=impl )
     cnt_w = value_bitwidth( x_w )
     if add_reg: 
         P( f'// {vlint_off_unused}' )
         reg( f'{x}{suff}', cnt_w )
         P( f'// {vlint_on_unused}' )
-    P(f'always @( * ) {x}{suff} = {x}_rev_ldz;' )
+    comb_begin( f'{x}{suff}' )
+    P(f'always @( * ) {x}{suff} = {x}_rev_ldo;' )
+    comb_end()
     return f'{x}{suff}' 
 
 #-------------------------------------------
@@ -1034,20 +2170,20 @@ def count_trailing_ones( x, x_w, add_reg=True, suff='_ldo' ):
 # before: ROR by i+0, then use count_leading_zeroes()
 # currently x_w must be a power of 2
 #-------------------------------------------
-def first_one_after_i( x, x_w, i, r ):
-    if not is_pow2( x_w ): die( f'first_one_after_i: x_w must be a power-of-2 right now' )
+def first_one_after_i( x, x_w, i, r, impl='case' ):
+    if not is_pow2( x_w ): S.die( f'first_one_after_i: x_w must be a power-of-2 right now' )
     ror_w = log2( x_w )
     wirea( f'{i}_p1', ror_w, f'{i} + 1' )
     rotate_right( f'{x}_ror', x_w, f'{i}_p1', x )
-    count_trailing_zeroes( f'{x}_ror', x_w )
+    count_trailing_zeroes( f'{x}_ror', x_w, impl=impl )
     wirea( r, ror_w, f'{x}_ror_trz + {i}_p1' )
     return r
 
-def first_one_before_i( x, x_w, i, r ):
-    if not is_pow2( x_w ): die( f'first_one_before_i: x_w must be a power-of-2 right now' )
+def first_one_before_i( x, x_w, i, r, impl='case' ):
+    if not is_pow2( x_w ): S.die( f'first_one_before_i: x_w must be a power-of-2 right now' )
     ror_w = log2( x_w )
     rotate_right( f'{x}_ror', x_w, i, x )
-    count_leading_zeroes( f'{x}_ror', x_w )
+    count_leading_zeroes( f'{x}_ror', x_w, impl=impl )
     wirea( r, ror_w, f'{x}_ror_ldz + {i}' )
     return r
 
@@ -1120,7 +2256,7 @@ def collapse( mask, mask_w, r, vals={}, gen_indexes=True ):
         for i in range(mask_w):
             lsb = i*w
             msb = lsb + w - 1
-            v = s if mask_w == 1 else f'{mask}[{i}] ? {s}[{msb}:{lsb}] : {w}\'d0'
+            v = s if mask_w == 1 else f'({mask}[{i}] ? {s}[{msb}:{lsb}] : {w}\'d0)'
             _vals[val][1].append( v )
 
     if 'vlds' in vals: S.die( f':collapse: {r} vals may not have an entry called "vlds"' )
@@ -1133,7 +2269,7 @@ def collapse( mask, mask_w, r, vals={}, gen_indexes=True ):
         index_w = max( 1, log2( mask_w ) )
         _vals['indexes'] = [ index_w, [] ]
         for i in range(mask_w):
-            v = '1\'d0' if mask_w == 1 else f'{mask}[{i}] ? {index_w}\'d{i} : {index_w}\'d0'
+            v = '1\'d0' if mask_w == 1 else f'({mask}[{i}] ? {index_w}\'d{i} : {index_w}\'d0)'
             _vals['indexes'][1].append( v )
 
     vld_cnts = _vals['vlds'][1].copy()
@@ -1213,7 +2349,8 @@ def uncollapse( mask, indexes, index_cnt, vals, r ):
 #
 # note: elig_mask should be right-to-left order
 #-------------------------------------------
-def choose_eligible( r, elig_mask, cnt, preferred, gen_preferred=False, adv_preferred='' ):
+def choose_eligible( r, elig_mask, cnt, preferred, gen_preferred=False, adv_preferred='', impl='case' ):
+    g = tls.gen
     if cnt <= 0: S.die( f'choose_eligible: cnt is {cnt}' )
     if cnt == 1:
         # trivial case
@@ -1228,7 +2365,7 @@ def choose_eligible( r, elig_mask, cnt, preferred, gen_preferred=False, adv_pref
     if gen_preferred: reg( preferred, w )
     reverse( elig_mask, cnt, f'{elig_mask}_r' )
     prio_elig_mask = rotate_left( f'{r}_prio_elig_mask', cnt, preferred, f'{elig_mask}_r' )
-    choice = count_leading_zeroes( prio_elig_mask, cnt )
+    choice = count_leading_zeroes( prio_elig_mask, cnt, impl=impl )
     P( f'// {vlint_off_width}' )
     if is_pow2( cnt ):
         wirea( r, w, f'{preferred} + {choice}' )
@@ -1239,11 +2376,14 @@ def choose_eligible( r, elig_mask, cnt, preferred, gen_preferred=False, adv_pref
     wirea( f'{elig_mask}_any_vld', 1, f'|{elig_mask}' )
     if gen_preferred:
         always_at_posedge()
-        P(f'    if ( !{reset_} ) begin' )
+        P(f'    if ( !{g.reset_} ) begin' )
         P(f'        {preferred} <= 0;' )
         if adv_preferred: adv_preferred = f' && {adv_preferred}'
         P(f'    end else if ( {elig_mask}_any_vld{adv_preferred} ) begin' )
-        P(f'        {preferred} <= {r} + 1;' )
+        if is_pow2( cnt ):
+            P(f'        {preferred} <= {r} + 1;' )
+        else:
+            P(f'        {preferred} <= ({r} == {cnt-1}) ? 0 : ({r} + 1);' )
         P(f'    end' )
         P(f'end' )
     return r
@@ -1306,6 +2446,7 @@ def choose_eligible_with_highest_prio( r, vlds, prios, prio_w ):
 # We collapse the eligibles and collapse the requestors, then assign as much as we can.
 #-------------------------------------------
 def choose_eligibles( r, elig_mask, elig_cnt, preferred, req_mask, req_cnt, gen_preferred=False, adv_preferred='' ):
+    g = tls.gen
     if not is_pow2( elig_cnt ): S.die( f'choose_eligibles: elig_cnt={elig_cnt} must be a power-of-2 for now' )
     elig_index_w = max(1, log2(elig_cnt))
     req_index_w  = max(1, log2(req_cnt))
@@ -1334,7 +2475,7 @@ def choose_eligibles( r, elig_mask, elig_cnt, preferred, req_mask, req_cnt, gen_
     concata( elig_indexes, elig_index_w, f'{r}_req_elig_indexes' )
     if gen_preferred:
         always_at_posedge()
-        P(f'    if ( !{reset_} ) begin' )
+        P(f'    if ( !{g.reset_} ) begin' )
         P(f'        {preferred} <= 0;' )
         if adv_preferred: adv_preferred = f' && {adv_preferred}'
         P(f'    end else if ( |{r}_collapsed_used{adv_preferred} ) begin' )
@@ -1346,6 +2487,7 @@ def choose_eligibles( r, elig_mask, elig_cnt, preferred, req_mask, req_cnt, gen_
 # Resource accounting for <cnt> resource slots
 #-------------------------------------------
 def resource_accounting( name, cnt, add_free_cnt=False, set_i_is_free_i=False ):
+    g = tls.gen
     P()
     id_w = log2(cnt) if cnt > 1 else 1
     reg( f'{name}_in_use', cnt )
@@ -1362,7 +2504,7 @@ def resource_accounting( name, cnt, add_free_cnt=False, set_i_is_free_i=False ):
     wire( f'{name}_clr_pvld', 1 )
     wire( f'{name}_clr_i', id_w )
     always_at_posedge()
-    P(f'    if ( !{reset_} ) begin' )
+    P(f'    if ( !{g.reset_} ) begin' )
     P(f'        {name}_in_use <= 0;' )
     P(f'    end else if ( {name}_set_pvld || {name}_clr_pvld ) begin' )
     P(f'        // {vlint_off_width}' )
@@ -1495,23 +2637,24 @@ def ram( iname, oname, sigs, depth, wr_cnt=1, rd_cnt=1, rw_cnt=0, clks=[], m_nam
     if have_clks and len(clks) != port_cnt: S.die( f'ram(): if clks=[...] is given, the number of clocks must match the number of ports' )
     if port_cnt <= 0: S.die( f'ram(): 0-port ram is not allowed' )
     if (wr_cnt == 0) != (rd_cnt == 0): S.die( f'ram(): if you have a write port, you must have a read port, and vice-versa' )
-    if wr_cnt != 0 and rw_cnt != 0: S.dir( f'ram(): you may not have both wr(rd) ports and bi-directional rw ports at the same time' )
-    if wr_cnt > 1 or rw_cnt > 1 and iname == '': S.dir( f'ram(): iname must be supplied when wr_cnt > 1 or rw_cnt > 1' )
-    if rd_cnt > 1 or rw_cnt > 1 and oname == '': S.dir( f'ram(): oname must be supplied when rd_cnt > 1 or rw_cnt > 1' )
+    if wr_cnt != 0 and rw_cnt != 0: S.die( f'ram(): you may not have both wr(rd) ports and bi-directional rw ports at the same time' )
+    if (wr_cnt > 1 or rw_cnt > 1) and iname == '': S.die( f'ram(): iname must be supplied when wr_cnt > 1 or rw_cnt > 1' )
+    if (rd_cnt > 1 or rw_cnt > 1) and oname == '': S.die( f'ram(): oname must be supplied when rd_cnt > 1 or rw_cnt > 1' )
 
     w = 0
     for sig in sigs: w += sigs[sig]
 
-    if m_name == '': m_name = f'ram_{depth}x{w}_wr{wr_cnt}_rd{_rd_cnt}_rw{rw_cnt}'
+    if m_name == '': m_name = f'ram_{depth}x{w}_wr{wr_cnt}_rd{rd_cnt}_rw{rw_cnt}'
     if u_name == '': u_name = f'u_{m_name}'
-    rams[m_name] = {'depth': depth, 'w': w, 'wr_cnt': wr_cnt, 'rd_cnt': rd_cnt, 'rw_cnt': rw_cnt, 'ramgen_cmd': ramgen_cmd }
+    tls.gen.rams[m_name] = {'depth': depth, 'w': w, 'wr_cnt': wr_cnt, 'rd_cnt': rd_cnt, 'rw_cnt': rw_cnt, 'have_clks': have_clks, 
+                            'ramgen_cmd': tls.gen.ramgen_cmd }
 
     if add_blank_line: P()
     names = ', '.join( sigs.keys() )
     P(f'// {depth}x{w} {port_cnt}-port ram for: {names}' )
     P(f'//' )
 
-    inst_sigs = '' if have_clks else f'.clk( {clk} )'
+    inst_sigs = '' if have_clks else f'.clk( {tls.gen.clk} )'
     clk_i = 0
     for i in range(wr_cnt):
         wr_name = '' if iname == '' else f'{iname}_'
@@ -1526,7 +2669,7 @@ def ram( iname, oname, sigs, depth, wr_cnt=1, rd_cnt=1, rw_cnt=0, clks=[], m_nam
         for sig in sigs:
             if ins != '': ins += ', '
             ins += f'{wr_name}{sig}'
-        inst_sigs += f', .di{suff}( {ins} )'
+        inst_sigs += f', .di{suff}( {{{ins}}} )'
     
     for i in range(rd_cnt):
         rd_name = '' if oname == '' else f'{oname}_'
@@ -1541,15 +2684,15 @@ def ram( iname, oname, sigs, depth, wr_cnt=1, rd_cnt=1, rw_cnt=0, clks=[], m_nam
             wire( f'{rd_name}{sig}', sigs[sig] )
             if outs != '': outs += ', '
             outs += f'{rd_name}{sig}'
-        inst_sigs += f', .dout{suff}( {outs} )'
+        inst_sigs += f', .dout{suff}( {{{outs}}} )'
     
     for i in range(rw_cnt):
         wr_name = '' if iname == '' else f'{iname}_'
         rd_name = '' if oname == '' else f'{oname}_'
-        suff = '' if wr_cnt == 1 else f'{i}'
+        suff = '' if rw_cnt == 1 else f'{i}'
         if have_clks: 
             if inst_sigs != '': inst_sigs += ', '
-            inst_sigs += f', .clk{suff}( {clks[clk_i]} )' 
+            inst_sigs += f'.clk{suff}( {clks[clk_i]} )' 
             clk_i += 1
         inst_sigs += f', .we{suff}( {wr_name}we{suff} )'
         inst_sigs += f', .a{suff}( {wr_name}a{suff} )'
@@ -1562,64 +2705,136 @@ def ram( iname, oname, sigs, depth, wr_cnt=1, rd_cnt=1, rw_cnt=0, clks=[], m_nam
             if outs != '': outs += ', '
             ins  += f'{wr_name}{sig}'
             outs += f'{rd_name}{sig}'
-        inst_sigs += f', .di{suff}( {ins} )'
-        inst_sigs += f', .dout{suff}( {outs} )'
+        inst_sigs += f', .di{suff}( {{{ins}}} )'
+        inst_sigs += f', .dout{suff}( {{{outs}}} )'
     
-    P(f'{m_name} {u_name}( {inst_sigs}' )
+    P(f'{m_name} {u_name}( {inst_sigs} );' )
 
 #--------------------------------------------------------------------
 # MODULE FOOTER
 #--------------------------------------------------------------------
 def module_footer( mn ):
+    g = tls.gen
+    if g.netlist is not None: ir_end()
     P()
     P(f'endmodule // {mn}' )
-    global rams, post_modules
-    for ram  in rams:  make_ram( ram )
-    for post in post_modules: post['generator']( post['params'], post, with_file_header=False )
-    rams = {}
-    post_modules = {}
-
-def gen_ram( module_name ):
-    info = rams[module_name]
+    rams = g.rams
+    post_modules = g.post_modules
+    g.rams = {}
+    g.post_modules = {}
+    e = g.emitter
+    split = e.split_modules
+    for ram in rams:
+        if split: emit_begin( Emitter( e.module_file( ram ), e.use_mmap, True ) )
+        gen_ram( ram, rams[ram], with_file_header=split )
+        if split: emit_end()
+    for post in post_modules:
+        if split: emit_begin( Emitter( e.module_file( post ), e.use_mmap, True ) )
+        post_modules[post]['generator']( post_modules[post]['params'], post, with_file_header=split )
+        if split: emit_end()
+    if len( g.emitters ) == 0: e.flush()
+
+def gen_ram( module_name, info, with_file_header=False ):
+    ramgen_cmd = info['ramgen_cmd']
     if ramgen_cmd == '':
-        S.die( f'make_ram(): currently cannot generate rams without reinit( ramgen_cmd=... ) being set - restriction could be lifted' )
+        gen_ram_behavioral( module_name, info, with_file_header )
     else:
         P()
         P(f'// {module_name} generated externally using: {ramgen_cmd} {module_name}' )
         P(f'//' )
-        S.cmd( f'{ramgen_cmd} {module_name}', echo=False, echo_stdout=False )
+        P( S.cmd( f'{ramgen_cmd} {module_name}', echo=False, echo_stdout=False ).rstrip( '\n' ) )
+
+#--------------------------------------------------------------------
+# Generates a behavioral ram module when no ramgen_cmd was given.
+# Port names match what ram() instantiates. Writes and reads are synchronous
+# with one cycle of read latency. A read of an address being written in the 
+# same cycle returns the old data.
+#--------------------------------------------------------------------
+def gen_ram_behavioral( module_name, info, with_file_header ):
+    depth     = info['depth']
+    w         = info['w']
+    wr_cnt    = info['wr_cnt']
+    rd_cnt    = info['rd_cnt']
+    rw_cnt    = info['rw_cnt']
+    have_clks = info['have_clks']
+    a_w       = max( 1, log2( depth ) )
+
+    module_header_begin( module_name, with_file_header=with_file_header )
+    if not have_clks: input( 'clk', 1 )
+    for i in range(wr_cnt):
+        suff = '' if wr_cnt == 1 else f'{i}'
+        if have_clks: input( f'clk_w{suff}', 1 )
+        input( f'we{suff}', 1 )
+        input( f'wa{suff}', a_w )
+        input( f'di{suff}', w )
+    for i in range(rd_cnt):
+        suff = '' if rd_cnt == 1 else f'{i}'
+        if have_clks: input( f'clk_r{suff}', 1 )
+        input( f're{suff}', 1 )
+        input( f'ra{suff}', a_w )
+        output( f'dout{suff}', w )
+    for i in range(rw_cnt):
+        suff = '' if rw_cnt == 1 else f'{i}'
+        if have_clks: input( f'clk{suff}', 1 )
+        input( f'we{suff}', 1 )
+        input( f'a{suff}', a_w )
+        input( f're{suff}', 1 )
+        input( f'di{suff}', w )
+        output( f'dout{suff}', w )
+    module_header_end( no_warn_filename=True )
+
+    P()
+    P(f'reg [{w-1}:0] mem[0:{depth-1}];' )
+    for i in range(wr_cnt):
+        suff = '' if wr_cnt == 1 else f'{i}'
+        always_at_posedge( f'if ( we{suff} ) mem[wa{suff}] <= di{suff};', _clk=f'clk_w{suff}' if have_clks else 'clk' )
+    for i in range(rd_cnt):
+        suff = '' if rd_cnt == 1 else f'{i}'
+        reg( f'dout{suff}', w )
+        always_at_posedge( f'if ( re{suff} ) dout{suff} <= mem[ra{suff}];', _clk=f'clk_r{suff}' if have_clks else 'clk' )
+    for i in range(rw_cnt):
+        suff = '' if rw_cnt == 1 else f'{i}'
+        reg( f'dout{suff}', w )
+        always_at_posedge( _clk=f'clk{suff}' if have_clks else 'clk' )
+        P(f'    if ( we{suff} ) mem[a{suff}] <= di{suff};' )
+        P(f'    if ( re{suff} ) dout{suff} <= mem[a{suff}];' )
+        P(f'end' )
+    module_footer( module_name )
 
 #--------------------------------------------------------------------
 #--------------------------------------------------------------------
 # TESTBENCH COMPONENTS
 #--------------------------------------------------------------------
 #--------------------------------------------------------------------
-def tb_clk( decl_clk=True, default_cycles_max=2000, perf_op_first=100, perf_op_last=200 ):
+def tb_clk( decl_clk=True, default_cycles_max=2000, perf_op_first=100, perf_op_last=200, default_period=1.0, with_cycle_cnt=True ):
+    g = tls.gen
     P()
-    P(f'// {clk}' )
+    P(f'// {g.clk}' )
     P(f'//' )
     P(f'`ifndef VERILATOR' )
-    if decl_clk: P(f'reg  {clk};' )
-    P(f'real {clk}_phase; ' )
-    P(f'real {clk}_period; ' )
-    P(f'real {clk}_half_period; ' )
+    if decl_clk: P(f'reg  {g.clk};' )
+    P(f'real {g.clk}_phase; ' )
+    P(f'real {g.clk}_period; ' )
+    P(f'real {g.clk}_half_period; ' )
     P(f'' )
     P(f'initial begin ' )
-    P(f'    if ( !$value$plusargs( "{clk}_phase=%f", {clk}_phase ) ) begin ' )
-    P(f'        {clk}_phase = 0.0; ' )
+    P(f'    if ( !$value$plusargs( "{g.clk}_phase=%f", {g.clk}_phase ) ) begin ' )
+    P(f'        {g.clk}_phase = 0.0; ' )
     P(f'    end ' )
-    P(f'    if ( !$value$plusargs( "{clk}_period=%f", {clk}_period ) ) begin ' )
-    P(f'        {clk}_period = 1.0; ' )
+    P(f'    if ( !$value$plusargs( "{g.clk}_period=%f", {g.clk}_period ) ) begin ' )
+    P(f'        {g.clk}_period = {default_period}; ' )
     P(f'    end ' )
-    P(f'    {clk}_half_period = {clk}_period / 2.0; ' )
-    P(f'    {clk} = 0; ' )
-    P(f'    #({clk}_half_period); ' )
-    P(f'    #({clk}_phase); ' )
+    P(f'    {g.clk}_half_period = {g.clk}_period / 2.0; ' )
+    P(f'    {g.clk} = 0; ' )
+    P(f'    #({g.clk}_half_period); ' )
+    P(f'    #({g.clk}_phase); ' )
     P(f'    fork ' )
-    P(f'        forever {clk} = #({clk}_half_period) ~{clk}; ' )
+    P(f'        forever {g.clk} = #({g.clk}_half_period) ~{g.clk}; ' )
     P(f'    join ' )
     P(f'end ' )
     P(f'`endif' )
+    if not with_cycle_cnt: return
+    g.perf_op_last = perf_op_last
     P()
     P(f'reg [31:0] cycle_cnt;' )
     P(f'reg [31:0] cycles_max;' )
@@ -1642,19 +2857,20 @@ def tb_clk( decl_clk=True, default_cycles_max=2000, perf_op_first=100, perf_op_l
     P(f'end' )
 
 def tb_reset_( decl_reset_=True ):
+    g = tls.gen
     P()
-    P(f'// {reset_} ' )
+    P(f'// {g.reset_} ' )
     P(f'// ' )
-    if decl_reset_: P(f'reg {reset_};' )
-    P(f'reg [31:0] {reset_}_cycle_cnt;' )
+    if decl_reset_: P(f'reg {g.reset_};' )
+    P(f'reg [31:0] {g.reset_}_cycle_cnt;' )
     P(f'initial begin ' )
-    P(f'    {reset_} = 0; ' )
-    P(f'    {reset_}_cycle_cnt = 0;' )
+    P(f'    {g.reset_} = 0; ' )
+    P(f'    {g.reset_}_cycle_cnt = 0;' )
     P(f'end ' )
-    P(f'always @( posedge {clk} ) begin' )
-    P(f'    if ( !{reset_} ) begin' )
-    P(f'        {reset_} <= {reset_}_cycle_cnt >= 10;' )
-    P(f'        {reset_}_cycle_cnt <= {reset_}_cycle_cnt + 1;' )
+    P(f'always @( posedge {g.clk} ) begin' )
+    P(f'    if ( !{g.reset_} ) begin' )
+    P(f'        {g.reset_} <= {g.reset_}_cycle_cnt >= 10;' )
+    P(f'        {g.reset_}_cycle_cnt <= {g.reset_}_cycle_cnt + 1;' )
     P(f'    end ' )
     P(f'end ' )
 
@@ -1729,28 +2945,29 @@ def tb_dump( module_name, include_saif=True ):
 
 
 def tb_rand_init( default_rand_cycle_cnt=300 ):
+    g = tls.gen
     P()
-    P(f'// {clk}_rand_cycle_cnt' )
+    P(f'// {g.clk}_rand_cycle_cnt' )
     P(f'//' )
     P(f'// {vlint_off_unused}' ) 
-    P(f'reg [31:0] {clk}_rand_cycle_cnt;' )
-    P(f'reg [31:0] {clk}_rand_seed_z_init;' )
-    P(f'reg [31:0] {clk}_rand_seed_w_init;' )
+    P(f'reg [31:0] {g.clk}_rand_cycle_cnt;' )
+    P(f'reg [31:0] {g.clk}_rand_seed_z_init;' )
+    P(f'reg [31:0] {g.clk}_rand_seed_w_init;' )
     P(f'// {vlint_on_unused}' ) 
     P(f'initial begin' )
-    P(f'    if ( !$value$plusargs( "{clk}_rand_cycle_cnt=%f", {clk}_rand_cycle_cnt ) ) begin ' )
-    P(f'        {clk}_rand_cycle_cnt = {default_rand_cycle_cnt}; ' )
+    P(f'    if ( !$value$plusargs( "{g.clk}_rand_cycle_cnt=%f", {g.clk}_rand_cycle_cnt ) ) begin ' )
+    P(f'        {g.clk}_rand_cycle_cnt = {default_rand_cycle_cnt}; ' )
     P(f'    end ' )
-    P(f'    if ( !$value$plusargs( "{clk}_rand_seed0=%d", {clk}_rand_seed_z_init ) ) begin ' )
-    P(f'        {clk}_rand_seed_z_init = {default_rand_seed_z_init}; ' )
+    P(f'    if ( !$value$plusargs( "{g.clk}_rand_seed0=%d", {g.clk}_rand_seed_z_init ) ) begin ' )
+    P(f'        {g.clk}_rand_seed_z_init = {g.default_rand_seed_z_init}; ' )
     P(f'    end ' )
-    P(f'    if ( !$value$plusargs( "{clk}_rand_seed1=%d", {clk}_rand_seed_w_init ) ) begin ' )
-    P(f'        {clk}_rand_seed_w_init = {default_rand_seed_w_init}; ' )
+    P(f'    if ( !$value$plusargs( "{g.clk}_rand_seed1=%d", {g.clk}_rand_seed_w_init ) ) begin ' )
+    P(f'        {g.clk}_rand_seed_w_init = {g.default_rand_seed_w_init}; ' )
     P(f'    end ' )
     P(f'end' )
 
 def tb_randbits( sig, _bit_cnt ):
-    global rand_seed_z_init_addend, rand_seed_w_init_addend, seed_i
+    g = tls.gen
     bit_cnt = _bit_cnt
     P()
     P(f'// {sig}' )
@@ -1768,9 +2985,9 @@ def tb_randbits( sig, _bit_cnt ):
         P(f'reg [31:0] {sigi}_m_w;' )
         P(f'// {vlint_off_width}' )
         always_at_posedge()
-        P(f'    if ( !{reset_} ) begin' )
-        P(f'        {sigi}_m_z <= {clk}_rand_seed_z_init + {rand_seed_z_init_addend};' )
-        P(f'        {sigi}_m_w <= {clk}_rand_seed_w_init + {rand_seed_w_init_addend};' )
+        P(f'    if ( !{g.reset_} ) begin' )
+        P(f'        {sigi}_m_z <= {g.clk}_rand_seed_z_init + {g.rand_seed_z_init_addend};' )
+        P(f'        {sigi}_m_w <= {g.clk}_rand_seed_w_init + {g.rand_seed_w_init_addend};' )
         P(f'    end else begin' )
         P(f'        {sigi}_m_z <= 36969 * {sigi}_m_z[15:0] + {sigi}_m_z[31:16];' )
         P(f'        {sigi}_m_w <= 18000 * {sigi}_m_w[15:0] + {sigi}_m_w[31:16];' )
@@ -1778,18 +2995,19 @@ def tb_randbits( sig, _bit_cnt ):
         P(f'    {sig}[{msb}:{lsb}] <= (({sigi}_m_w << 16) + {sigi}_m_w){and_mask};' )
         P(f'end' )
         P(f'// {vlint_on_width}' )
-        rand_seed_z_init_addend += 13
-        rand_seed_w_init_addend += 57
+        g.rand_seed_z_init_addend += 13
+        g.rand_seed_w_init_addend += 57
         i += 1
-    seed_i += 1
+    g.seed_i += 1
 
 def tb_randomize_sigs( sigs, pvld, prdy='', cycle_cnt='', prefix='' ):
+    g = tls.gen
     P()
     P(f'// randomize signals' )
     P(f'// For now, we let 50% of bits change each cycle (worst-case).' )
     P(f'//' )
-    if cycle_cnt == '': cycle_cnt = f'{clk}_rand_cycle_cnt'
-    if prefix    == '': prefix = f'rand{seed_i}'
+    if cycle_cnt == '': cycle_cnt = f'{g.clk}_rand_cycle_cnt'
+    if prefix    == '': prefix = f'rand{g.seed_i}'
     if prdy      != '': prdy = f'({prdy}) && '
     bit_cnt = 0;
     reg( pvld, 1 )
@@ -1802,7 +3020,7 @@ def tb_randomize_sigs( sigs, pvld, prdy='', cycle_cnt='', prefix='' ):
 
     P(f'reg [31:0] {prefix}_cnt;' )
     always_at_posedge()
-    P(f'    if ( !{reset_} ) begin' )
+    P(f'    if ( !{g.reset_} ) begin' )
     P(f'        {pvld} <= 0;' )
     P(f'        {prefix}_cnt <= 0;' )
     P(f'    end else if ( {prdy}{prefix}_cnt <= {cycle_cnt} ) begin' )
@@ -1853,6 +3071,7 @@ def make_v( module_name ):
     pass
 
 def make_tb( name, module_name ):
+    g = tls.gen
     module_header_begin( f'tb_{module_name}' )
     module_header_end()
     P()
@@ -1869,7 +3088,7 @@ def make_tb( name, module_name ):
     reg( f'combo_pvld_p', 1 )
     reg( f'combo_pvld', 1 )
     always_at_posedge()
-    P(f'    if ( !{reset_} ) begin' )
+    P(f'    if ( !{g.reset_} ) begin' )
     P(f'        combo_pvld_p <= 1;' )
     P(f'        combo_pvld <= 0;' )
     P(f'    end else begin' )
@@ -1927,5 +3146,4 @@ def make_tb( name, module_name ):
     unconcata( 'arb_elig_req_indexes', 8, 2, 'arb_elig_req_index' )
     for i in range(8): muxa( f'alloc_addr{i}', 32, f'arb_elig_req_index{i}', addrs )
 
-    P()
-    P(f'endmodule // tb_{module_name}' )
+    module_footer( f'tb_{module_name}' )
@@ -23,7 +23,7 @@
 import S
 import V
 
-P = print
+P = V.P
 
 def reinit():
     global arb_req_id_cnt, arb_req_id_w, xx2arb, arb2xx
@@ -139,5 +139,4 @@ def make_tb_arb_rr( module_name, inst_name ):
     V.binary_to_one_hot( f'last_req_id', arb_req_id_cnt, 'last_mask', f'({V.reset_} && last_pvld)' )
     V.dassert( 'arb2xx_pvld === 0 || xx2arb_elig === chosen_mask || chosen_mask !== last_mask', f'arbiter did not choose fairly' )
 
-    P()
-    P(f'endmodule // tb_{module_name}' )
+    V.module_footer( f'tb_{module_name}' )
@@ -0,0 +1,94 @@
+# Copyright (c) 2017-2025 Robert A. Alfieri
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# bench_emit.py - compare old print()-per-line output against V.Emitter
+#
+# bench_emit.py [line_cnt]
+#
+# Generates the same synthetic design of roughly line_cnt lines (default: 100000)
+# once with V.P bound to print() and sys.stdout redirected to a file, which is
+# what gen.py x &> x.v used to do, then with an Emitter flushed to a file,
+# to a StringIO, and to an mmap-backed file. Prints the best of 5 wall times for each.
+#
+# The speedup is modest and varies from run to run: on one machine, repeated runs measured anywhere
+# from about 1x to 2x, for all three Emitter outputs. Most of the time goes to building the lines
+# in the V.py helpers rather than writing them, so run it a few times before reading much into it.
+#
+import sys
+import io
+import os
+import time
+import S
+import V
+
+line_cnt = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100000
+file_name = 'bench_emit.v'
+
+def make_design( iter_cnt ):
+    V.module_header_begin( 'bench_emit' )
+    V.input( V.clk, 1 )
+    V.input( V.reset_, 1 )
+    V.input( 'x', 32 )
+    V.module_header_end()
+    for i in range( iter_cnt ):
+        V.wirea( f'a{i}', 32, f'x + {i}' )
+        V.rega( f'b{i}', 32, f'a{i} ^ b{i}' )
+        V.dassert( f'a{i} !== 0 || x !== -{i}', f'a{i} wrapped' )
+    V.module_footer( 'bench_emit' )
+
+def run( what, iter_cnt ):
+    V.reinit()
+    t = time.perf_counter()
+    if what == 'print':
+        P = V.P
+        stdout = sys.stdout
+        with open( file_name, 'w' ) as f:
+            sys.stdout = f
+            V.P = print
+            try:
+                make_design( iter_cnt )
+            finally:
+                V.P = P
+                sys.stdout = stdout
+    else:
+        if what == 'file':     e = V.Emitter( file_name )
+        elif what == 'mmap':   e = V.Emitter( file_name, use_mmap=True )
+        else:                  e = V.Emitter( io.StringIO() )
+        V.emit_begin( e )
+        make_design( iter_cnt )
+        V.emit_end()
+    return time.perf_counter() - t
+
+# calibrate number of iterations to get line_cnt lines
+V.reinit()
+e = V.emit_begin( V.Emitter( io.StringIO() ) )
+make_design( 100 )
+lines_per_iter = e.getvalue().count( '\n' ) / 100
+V.emit_end()
+iter_cnt = max( 1, int( line_cnt / lines_per_iter ) )
+
+results = {}
+for what in [ 'print', 'file', 'stringio', 'mmap' ]:
+    results[what] = min( run( what, iter_cnt ) for i in range(5) )
+os.remove( file_name )
+
+print( f'bench_emit: ~{line_cnt} lines per run, best of 5' )
+for what in results:
+    print( f'    {what:10s} {results[what]:8.3f} sec   {results["print"]/results[what]:5.2f}x' )
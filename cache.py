@@ -24,7 +24,7 @@ import S
 import V
 import C # temporary
 
-P = print
+P = V.P
 
 def check( p ):
     # required:
@@ -32,7 +32,10 @@ def check( p ):
     if p['line_cnt'] < 1: S.die( f'cache: line_cnt must be >= 1' )
     if 'assoc' not in p:    S.die( f'cache: assoc must be specified' )
     if p['assoc'] < 1 or p['assoc'] > p['line_cnt']: S.die( f'cache: assoc must be >= 1 and <= line_cnt' )
-    if p['assoc'] != p['line_cnt']: S.die( f'cache: for now, cache must be fully-associative (assoc==line_cnt)')
+    if p['line_cnt'] % p['assoc'] != 0: S.die( f'cache: line_cnt must be a multiple of assoc' )
+    if p['assoc'] != p['line_cnt']:
+        if not V.is_pow2( p['assoc'] ): S.die( f'cache: assoc must be a power of 2 for a set-associative cache' )
+        if not V.is_pow2( p['line_cnt'] // p['assoc'] ): S.die( f'cache: line_cnt/assoc (the number of sets) must be a power of 2' )
     if 'line_w' not in p:   S.die( f'cache: line_w must be specified' )
     if p['line_w'] < 1: S.die( f'cache: line_w must be >= 1' )
     if 'req_id_w' not in p: S.die( f'cache: req_id_w must be specified' )
@@ -42,7 +45,12 @@ def check( p ):
 
     # optional
     if 'is_read_only' not in p: p['is_read_only'] = False
-    if not p['is_read_only']: S.die( f'cache: for now, is_read_only must be True' )
+    if not p['is_read_only']:
+        if p['line_w'] % 8 != 0: S.die( f'cache: line_w must be a multiple of 8 for a writable cache' )
+        if 'write_kind' not in p: p['write_kind'] = 'back'
+        if p['write_kind'] not in [ 'back', 'through' ]: S.die( f'cache: write_kind must be back or through' )
+        if 'wcb_cnt' not in p: p['wcb_cnt'] = 2
+        if p['wcb_cnt'] < 1: S.die( f'cache: wcb_cnt must be >= 1' )
     if 'cache_name' not in p: p['cache_name'] = 'cache'
     if 'unit_name' not in p: p['unit_name'] = 'unit'
     if 'mem_name' not in p: p['mem_name'] = 'mem'
@@ -53,10 +61,23 @@ def check( p ):
             p['tag_ram_kind'] = 'ff'
         else:
             p['tag_ram_kind'] = 'ra2'
-    if 'data_ram_kind' not in p: p['data_ram_kind'] = 'ra2'
-    if p['data_ram_kind'] != 'ff': S.die( f'cache: for now, data_ram_kind must be ff' )
+    if p['tag_ram_kind'] not in [ 'ff', 'ra2' ]: S.die( f'cache: tag_ram_kind must be ff or ra2' )
+    if p['tag_ram_kind'] == 'ra2' and p['assoc'] == p['line_cnt']: S.die( f'cache: a fully-associative cache must have tag_ram_kind=ff' )
+    if 'index_kind' not in p: p['index_kind'] = 'bits'
+    if p['index_kind'] not in [ 'bits', 'hash' ]: S.die( f'cache: index_kind must be bits or hash' )
+    if 'data_ram_kind' not in p: p['data_ram_kind'] = 'ra2' if p['is_read_only'] else 'ff'
+    if p['data_ram_kind'] not in [ 'ff', 'ra2' ]: S.die( f'cache: data_ram_kind must be ff or ra2' )
+    if p['data_ram_kind'] == 'ra2' and not p['is_read_only']: S.die( f'cache: for now, a writable cache must have data_ram_kind=ff' )
     if 'req_cnt' not in p: p['req_cnt'] = 1
-    if p['req_cnt'] != 1: S.die( f'cache: for now, req_cnt must be 1' )
+    if p['req_cnt'] < 1: S.die( f'cache: req_cnt must be >= 1' )
+    if p['req_cnt'] > 1:
+        if not p['is_read_only']: S.die( f'cache: for now, req_cnt > 1 requires a read-only cache' )
+        if p['assoc'] != p['line_cnt']: S.die( f'cache: for now, req_cnt > 1 requires a fully-associative cache' )
+        if not V.is_pow2( p['line_cnt'] ): S.die( f'cache: line_cnt must be a power of 2 when req_cnt > 1' )
+    if 'mshr_cnt' not in p: p['mshr_cnt'] = 0
+    if p['mshr_cnt'] < 0: S.die( f'cache: mshr_cnt must be >= 0' )
+    if p['mshr_cnt'] > 0 and p['req_cnt'] > 1 and not V.is_pow2( p['mshr_cnt'] ): S.die( f'cache: mshr_cnt must be a power of 2 when req_cnt > 1' )
+    if p['mshr_cnt'] > 0 and p['mshr_cnt'] < p['req_cnt']: S.die( f'cache: mshr_cnt must be >= req_cnt' )
     if 'mem_dat_w' not in p: p['mem_dat_w'] = p['line_w']
     if p['mem_dat_w'] < p['line_w']: S.die( f'cache: mem_dat_w must be >= line_w' )
     if p['mem_dat_w'] % p['line_w'] != 0: S.die( f'cache: mem_dat_w must be a multiple of line_w' )
@@ -64,16 +85,26 @@ def check( p ):
 
     # derived:
     p['line_id_w']            = V.log2( p['line_cnt'] )
+    p['set_cnt']              = p['line_cnt'] // p['assoc']
+    p['set_w']                = V.log2( p['set_cnt'] )
+    if p['index_kind'] == 'bits' and p['set_w'] >= p['req_addr_w']: S.die( f'cache: req_addr_w must be > log2(line_cnt/assoc) with index_kind=bits' )
     p['req_id_cnt']           = 1 << p['req_id_w'] 
     p['dat_w']                = p['line_w']                                # add req_subword_cnt at some point
     p['mem_subword_cnt']      = int( p['mem_dat_w'] / p['line_w'] )
     p['mem_subword_w']        = V.log2( p['mem_subword_cnt'] )
-    p['mem_tag_id_w']         = p['req_id_w'] + p['mem_subword_w'] + p['line_id_w'] 
+    p['req_i_w']              = V.log2( p['req_cnt'] )
+    p['mem_tag_id_w']         = p['req_i_w'] + p['req_id_w'] + p['mem_subword_w'] + p['line_id_w'] 
     p['mem_addr_w']           = p['req_addr_w'] - p['mem_subword_w']
     p['tb_addr_id_w']         = V.log2( p['tb_addr_cnt'] )
+    p['be_w']                 = p['dat_w'] // 8
+    p['mem_be_w']             = p['mem_dat_w'] // 8
 
     p['unit2cache']           = { 'id':                 p['req_id_w'],
                                   'addr':               p['req_addr_w'] }
+    if not p['is_read_only']:
+        p['unit2cache']['is_wr'] = 1                                            # write dat to addr using byte enables be
+        p['unit2cache']['be']    = p['be_w']
+        p['unit2cache']['dat']   = p['dat_w']
 
     p['cache2unit_status']    = { 'id':                 p['req_id_w'],
                                   'is_hit':             1,                      # returning data soon
@@ -84,10 +115,27 @@ def check( p ):
 
     p['cache2mem']            = { 'tag_id':             p['mem_tag_id_w'],
                                   'addr':               p['mem_addr_w'] }
+    if not p['is_read_only']:
+        p['cache2mem']['is_wr']  = 1                                            # write has no mem2cache response
+        p['cache2mem']['be']     = p['mem_be_w']
+        p['cache2mem']['dat']    = p['mem_dat_w']
 
     p['mem2cache']            = { 'tag_id':             p['mem_tag_id_w'],
                                   'dat':                p['mem_dat_w'] }
 
+#--------------------------------------------------------------------
+# Returns the suffix of each request lane's interfaces.
+# With req_cnt == 1, there is no suffix.
+#--------------------------------------------------------------------
+def lanes( p ):
+    return [''] if p['req_cnt'] == 1 else [f'{r}' for r in range(p['req_cnt'])]
+
+#--------------------------------------------------------------------
+# Returns an expression that expands byte enables be[be_w-1:0] into a bit mask.
+#--------------------------------------------------------------------
+def byte_mask( be, be_w ):
+    return V.concata( [V.repl( f'{be}[{b}]', 8 ) for b in range(be_w)], 8 )
+
 def inst( p, module_name, inst_name, do_decls ):
     check( p )
 
@@ -102,17 +150,19 @@ def inst( p, module_name, inst_name, do_decls ):
 
     if do_decls: 
         V.wire( f'{cache}_idle', 1 )
-        V.iface_wire( f'{u2c}', p['unit2cache'], True, True )
-        V.iface_wire( f'{c2u}_status', p['cache2unit_status'], True, False )
-        V.iface_wire( f'{c2u}_dat', p['cache2unit_dat'], True, False )
+        for l in lanes( p ):
+            V.iface_wire( f'{u2c}{l}', p['unit2cache'], True, True )
+            V.iface_wire( f'{c2u}{l}_status', p['cache2unit_status'], True, False )
+            V.iface_wire( f'{c2u}{l}_dat', p['cache2unit_dat'], True, False )
         V.iface_wire( f'{c2m}', p['cache2mem'], True, True )
         V.iface_wire( f'{m2c}', p['mem2cache'], True, False )
     P()
     P(f'{module_name} {inst_name}(' ) 
     P(f'      .{V.clk}({V.clk}), .{V.reset_}({V.reset_}), .{cache}_idle({cache}_idle)' )
-    V.iface_inst( f'{u2c}', f'{u2c}', p['unit2cache'], True, True )
-    V.iface_inst( f'{c2u}_status', f'{c2u}_status', p['cache2unit_status'], True, False )
-    V.iface_inst( f'{c2u}_dat', f'{c2u}_dat', p['cache2unit_dat'], True, False )
+    for l in lanes( p ):
+        V.iface_inst( f'{u2c}{l}', f'{u2c}{l}', p['unit2cache'], True, True )
+        V.iface_inst( f'{c2u}{l}_status', f'{c2u}{l}_status', p['cache2unit_status'], True, False )
+        V.iface_inst( f'{c2u}{l}_dat', f'{c2u}{l}_dat', p['cache2unit_dat'], True, False )
     V.iface_inst( f'{c2m}', f'{c2m}', p['cache2mem'], True, True )
     V.iface_inst( f'{m2c}', f'{m2c}', p['mem2cache'], True, False )
     P(f'    );' )
@@ -132,76 +182,293 @@ def make( p, module_name ):
 
     line_id_w = p['line_id_w']
     req_addr_w = p['req_addr_w']
+    req_cnt = p['req_cnt']
+    req_i_w = p['req_i_w']
     mem_tag_id_w = p['mem_tag_id_w']
     mem_subword_w = p['mem_subword_w']
+    is_tag_ra2 = p['tag_ram_kind'] == 'ra2'
+    is_data_ra2 = p['data_ram_kind'] == 'ra2'
+    has_mshrs = p['mshr_cnt'] > 0
+    is_writable = not p['is_read_only']
+    ls = lanes( p )
+
+    # reqs[r] is the request of lane r being looked up in the tags. With tag_ram_kind=ra2, the tag ram has one cycle 
+    # of read latency, so the set is read as the request leaves {u2c}_d and is looked up from {u2c}_d1.
+    # Each lane's misses go to {c2m}_p{l}, which is {c2m}_p itself when there is one lane.
+    reqs = [f'{u2c}{l}_d' for l in ls]
+    if is_tag_ra2:
+        reqs[0] = f'{u2c}_d1'
+        P()
+        P( f'// TAG RAM READ' )
+        P( f'//' )
+        V.wire( f'{reqs[0]}_prdy', 1 )
+        V.iface_stage( f'{u2c}_d', reqs[0], p['unit2cache'], 'pvld', 'prdy', mode='pipe', do_dprint=False )
+        V.wirea( f'tags_lookup_pvld', 1, f'{u2c}_d_pvld && {u2c}_d_prdy' )
+        V.wirea( f'tags_lookup_addr', p['req_addr_w'], f'{u2c}_d_addr' )
 
     P()
     P( f'// TAGS INPUTS' )
     P( f'//' )
-    P( f'assign {u2c}_d_prdy = {c2m}_p_prdy && !{m2c}_d_pvld;' )
-    V.wirea( f'tags_req0_pvld', 1, f'{u2c}_d_pvld && {u2c}_d_prdy' )
-    V.wirea( f'tags_req0_addr', p['req_addr_w'], f'{u2c}_d_addr' )
-    V.wire( f'tags_decr0_pvld', 1 )
-    V.wire( f'tags_decr0_tag_i', line_id_w )
+    for r, l in enumerate( ls ):
+        req = reqs[r]
+        stall = ''
+        if has_mshrs:
+            V.wire( f'mshrs_stall{r}', 1 )
+            stall = f' && !mshrs_stall{r}'
+        if is_writable:
+            V.wire( f'wcb_stall{r}', 1 )
+            stall += f' && !wcb_stall{r}'
+        P( f'assign {req}_prdy = {c2m}_p{l}_prdy && !{m2c}_d_pvld{stall};' )
+        V.wirea( f'tags_req{r}_pvld', 1, f'{req}_pvld && {req}_prdy' )
+        V.wirea( f'tags_req{r}_addr', p['req_addr_w'], f'{req}_addr' )
+        if is_writable: V.wirea( f'tags_req{r}_is_wr', 1, f'{req}_is_wr' )
+        V.wire( f'tags_decr{r}_pvld', 1 )
+        V.wire( f'tags_decr{r}_tag_i', line_id_w )
+    id_lsb = mem_subword_w + line_id_w
+    id_msb = id_lsb + p['req_id_w'] - 1
     V.wirea( f'tags_fill_pvld', 1, f'{m2c}_d_pvld' )
     V.wirea( f'tags_fill_tag_i', line_id_w, f'{m2c}_d_tag_id[{line_id_w-1}:0]' )
     V.wirea( f'tags_fill_subword_i', mem_subword_w, f'{m2c}_d_tag_id[{mem_subword_w+line_id_w-1}:{line_id_w}]' )
-    V.wirea( f'tags_fill_id', p['req_id_w'], f'{m2c}_d_tag_id[{mem_tag_id_w-1}:{mem_subword_w+line_id_w}]' )
+    V.wirea( f'tags_fill_id', p['req_id_w'], f'{m2c}_d_tag_id[{id_msb}:{id_lsb}]' )
+    if req_cnt > 1: V.wirea( f'tags_fill_req_i', req_i_w, f'{m2c}_d_tag_id[{mem_tag_id_w-1}:{id_msb+1}]' )
     V.mux_subword( f'tags_fill_dat', p['dat_w'], f'tags_fill_subword_i', f'{m2c}_d_dat', p['mem_dat_w'] )
 
-    tags( f'tags', p['req_addr_w'], p['line_cnt'], 1, p['ref_cnt_max'] )
+    if p['assoc'] == p['line_cnt']:
+        tags( f'tags', p['req_addr_w'], p['line_cnt'], req_cnt, p['ref_cnt_max'], has_wr=is_writable, has_addr_hit=has_mshrs )
+    else:
+        set_assoc_tags( f'tags', p['req_addr_w'], p['set_cnt'], p['assoc'], p['ref_cnt_max'], p['index_kind'], p['tag_ram_kind'], has_wr=is_writable, has_addr_hit=has_mshrs )
+
+    if has_mshrs:
+        # a miss allocates an MSHR and a hit of a line being filled waits on its MSHR, so neither is retried;
+        # a lane stalls while its data interface is used by a drain, and a request that might miss stalls
+        # while there is no MSHR left for it after the earlier lanes that might miss
+        P()
+        P( f'// MSHRS' )
+        P( f'//' )
+        for r in range(req_cnt):
+            V.wirea( f'mshrs_alloc{r}_pvld', 1, f'tags_req{r}_pvld && tags_req{r}_status == TAGS_MISS' )
+            V.wirea( f'mshrs_alloc{r}_tag_i', line_id_w, f'tags_req{r}_tag_i' )
+            is_rd = f' && !tags_req{r}_is_wr' if is_writable else ''
+            V.wirea( f'mshrs_wait{r}_pvld', 1, f'tags_req{r}_pvld && tags_req{r}_status == TAGS_HIT_BEING_FILLED{is_rd}' )
+            V.wirea( f'mshrs_wait{r}_tag_i', line_id_w, f'tags_req{r}_tag_i' )
+            V.wirea( f'mshrs_wait{r}_id', p['req_id_w'], f'{reqs[r]}_id' )
+        V.wirea( f'mshrs_fill_pvld', 1, f'tags_fill_pvld' )
+        V.wirea( f'mshrs_fill_tag_i', line_id_w, f'tags_fill_tag_i' )
+        V.wirea( f'mshrs_fill_dat', p['dat_w'], f'tags_fill_dat' )
+        mshrs( f'mshrs', p['mshr_cnt'], req_cnt, p['req_id_w'], line_id_w, p['dat_w'] )
+        for r in range(req_cnt):
+            is_rd = f' && !{reqs[r]}_is_wr' if is_writable else ''
+            V.wirea( f'mshrs_may_alloc{r}', 1, f'{reqs[r]}_pvld && !tags_req{r}_addr_hit{is_rd}' )
+            drain = f'mshrs_drain_pvld' if req_cnt == 1 else f'(mshrs_drain_pvld && mshrs_drain_req_i == {r})'
+            if r == 0:
+                P( f'assign mshrs_stall{r} = (mshrs_may_alloc{r} && mshrs_free_cnt == 0) || {drain};' )
+            else:
+                earlier = ' + '.join( [f'mshrs_may_alloc{q}' for q in range(r)] )
+                P( f'// {V.vlint_off_width}' )
+                P( f'assign mshrs_stall{r} = (mshrs_may_alloc{r} && mshrs_free_cnt <= ({earlier})) || {drain};' )
+                P( f'// {V.vlint_on_width}' )
+
+    if is_writable:
+        # a write that hits a filled line updates the line; a write that misses doesn't allocate a line
+        # and goes around the cache to memory; a write that hits a line being filled must be retried
+        P()
+        P( f'// WRITES' )
+        P( f'//' )
+        V.wirea( f'wr_hit_pvld', 1, f'tags_req0_pvld && tags_req0_is_wr && tags_req0_status == TAGS_HIT' )
+        V.wirea( f'wr_around_pvld', 1, f'tags_req0_pvld && tags_req0_is_wr && tags_req0_status == TAGS_MISS_CANT_ALLOC' )
+        if p['write_kind'] == 'back':
+            # a written line is dirty until it is replaced
+            V.reg( f'{cache}_dirtys', p['line_cnt'] )
+            V.always_at_posedge()
+            P( f'    if ( !{V.reset_} ) begin' )
+            P( f'        {cache}_dirtys <= 0;' )
+            P( f'    end else if ( wr_hit_pvld ) begin' )
+            P( f'        {cache}_dirtys[tags_req0_tag_i] <= 1\'b1;' )
+            P( f'    end else if ( tags_req0_pvld && tags_req0_status == TAGS_MISS ) begin' )
+            P( f'        {cache}_dirtys[tags_req0_tag_i] <= 1\'b0;' )
+            P( f'    end' )
+            P( f'end' )
 
     P()
     P( f'// TAGS STATUS' )
     P( f'//' )
-    V.iface_reg( f'{c2u}_status', p['cache2unit_status'], True, False )
-    V.always_at_posedge()
-    P( f'    {c2u}_status_pvld <= tags_req0_pvld;' )
-    P( f'    if ( tags_req0_pvld ) begin' )
-    P( f'        {c2u}_status_id <= {u2c}_d_id;' )
-    P( f'        {c2u}_status_is_hit <= tags_req0_status == TAGS_HIT;' )
-    P( f'        {c2u}_status_is_miss <= tags_req0_status == TAGS_MISS;' )
-    P( f'        {c2u}_status_must_retry <= tags_req0_status == TAGS_HIT_BEING_FILLED || tags_req0_status == TAGS_MISS_CANT_ALLOC;' )
-    P( f'    end' )
-    P( f'end' )
+    for r, l in enumerate( ls ):
+        V.iface_reg( f'{c2u}{l}_status', p['cache2unit_status'], True, False )
+        V.always_at_posedge()
+        P( f'    {c2u}{l}_status_pvld <= tags_req{r}_pvld;' )
+        P( f'    if ( tags_req{r}_pvld ) begin' )
+        P( f'        {c2u}{l}_status_id <= {reqs[r]}_id;' )
+        is_hit = f'tags_req{r}_status == TAGS_HIT'
+        if has_mshrs:
+            is_miss = f'tags_req{r}_status == TAGS_MISS || tags_req{r}_status == TAGS_HIT_BEING_FILLED'
+            must_retry = f'tags_req{r}_status == TAGS_MISS_CANT_ALLOC'
+        else:
+            is_miss = f'tags_req{r}_status == TAGS_MISS'
+            must_retry = f'tags_req{r}_status == TAGS_HIT_BEING_FILLED || tags_req{r}_status == TAGS_MISS_CANT_ALLOC'
+        if is_writable:
+            # a write gets no data: is_hit says that it is done, which includes a write around the cache
+            is_hit += f' || (tags_req{r}_is_wr && tags_req{r}_status == TAGS_MISS_CANT_ALLOC)'
+            is_miss = f'!tags_req{r}_is_wr && ({is_miss})'
+            must_retry = f'tags_req{r}_is_wr ? tags_req{r}_status == TAGS_HIT_BEING_FILLED : ({must_retry})'
+        P( f'        {c2u}{l}_status_is_hit <= {is_hit};' )
+        P( f'        {c2u}{l}_status_is_miss <= {is_miss};' )
+        P( f'        {c2u}{l}_status_must_retry <= {must_retry};' )
+        P( f'    end' )
+        P( f'end' )
 
     P()
     P( f'// CACHED DATA' )
     P( f'//' )
-    for i in range(p['line_cnt']): V.reg( f'{cache}_bits{i}', p['dat_w'] )
-    V.always_at_posedge()
-    for i in range(p['line_cnt']): P( f'    if ( tags_fill_pvld && tags_fill_tag_i == {i} ) {cache}_bits{i} <= tags_fill_dat;' )
-    P( f'end' )
+    if is_data_ra2:
+        # fills write the data ram and hits read it, so hit data shows up on the ram output 
+        # in the same cycle as {c2u}_dat_pvld. A line can't be hit until the cycle after its fill,
+        # so a hit always reads the filled data. Each lane reads its own copy of the data ram.
+        for r, l in enumerate( ls ):
+            dram = f'{cache}_dram{l}'
+            V.wirea( f'{dram}_we', 1, f'tags_fill_pvld' )
+            V.wirea( f'{dram}_wa', line_id_w, f'tags_fill_tag_i' )
+            V.wirea( f'{dram}_dat', p['dat_w'], f'tags_fill_dat' )
+            V.wirea( f'{dram}_rd_re', 1, f'tags_req{r}_pvld && tags_req{r}_status == TAGS_HIT' )
+            V.wirea( f'{dram}_rd_ra', line_id_w, f'tags_req{r}_tag_i' )
+            V.ram( dram, f'{dram}_rd', { 'dat': p['dat_w'] }, p['line_cnt'], m_name='' if V.ramgen_cmd != '' else f'{module_name}_dram', 
+                   u_name='' if req_cnt == 1 else f'u_{dram}' )
+            V.dassert( f'!{dram}_rd_re || !{dram}_we || {dram}_rd_ra != {dram}_wa', f'hit of line being filled' )
+    else:
+        for i in range(p['line_cnt']): V.reg( f'{cache}_bits{i}', p['dat_w'] )
+        if is_writable:
+            # a write hit merges its enabled bytes into the line
+            V.muxa( f'{cache}_hit_dat', p['dat_w'], f'tags_req0_tag_i', [f'{cache}_bits{i}' for i in range(p['line_cnt'])] )
+            V.wirea( f'{cache}_wr_mask', p['dat_w'], byte_mask( f'{reqs[0]}_be', p['be_w'] ) )
+            V.wirea( f'{cache}_wr_dat', p['dat_w'], f'({cache}_hit_dat & ~{cache}_wr_mask) | ({reqs[0]}_dat & {cache}_wr_mask)' )
+        V.always_at_posedge()
+        for i in range(p['line_cnt']): 
+            P( f'    if ( tags_fill_pvld && tags_fill_tag_i == {i} ) {cache}_bits{i} <= tags_fill_dat;' )
+            if is_writable: P( f'    else if ( wr_hit_pvld && tags_req0_tag_i == {i} ) {cache}_bits{i} <= {cache}_wr_dat;' )
+        P( f'end' )
+
+    if is_writable:
+        # the WCB takes write-around writes, write-through write hits, and write-back dirty lines being replaced;
+        # a read of a memory line held by the WCB waits until the WCB has written it to memory
+        P()
+        P( f'// WRITE-COMBINING BUFFER' )
+        P( f'//' )
+        req = reqs[0]
+        wr_pvld = f'wr_around_pvld' if p['write_kind'] == 'back' else f'wr_around_pvld || wr_hit_pvld'
+        if p['write_kind'] == 'back':
+            V.wirea( f'evict_pvld', 1, f'tags_req0_pvld && tags_req0_status == TAGS_MISS && tags_req0_victim_vld && {cache}_dirtys[tags_req0_tag_i]' )
+            V.wirea( f'wcb_in_pvld', 1, f'{wr_pvld} || evict_pvld' )
+            V.wirea( f'wcb_line_addr', req_addr_w, f'evict_pvld ? tags_req0_victim_addr : tags_req0_addr' )
+            V.wirea( f'wcb_line_be', p['be_w'], f'evict_pvld ? {V.all_ones( p["be_w"] )} : {req}_be' )
+            V.wirea( f'wcb_line_dat', p['dat_w'], f'evict_pvld ? {cache}_hit_dat : {req}_dat' )
+        else:
+            V.wirea( f'wcb_in_pvld', 1, wr_pvld )
+            V.wirea( f'wcb_line_addr', req_addr_w, f'tags_req0_addr' )
+            V.wirea( f'wcb_line_be', p['be_w'], f'{req}_be' )
+            V.wirea( f'wcb_line_dat', p['dat_w'], f'{req}_dat' )
+        V.wirea( f'wcb_in_addr', p['mem_addr_w'], f'wcb_line_addr[{req_addr_w-1}:{mem_subword_w}]' )
+        if mem_subword_w > 0:
+            V.wirea( f'wcb_line_subword_i', mem_subword_w, f'wcb_line_addr[{mem_subword_w-1}:0]' )
+            V.wirea( f'wcb_in_be', p['mem_be_w'], V.concata( [f'(wcb_line_subword_i == {s}) ? wcb_line_be : {p["be_w"]}\'d0' for s in range(p['mem_subword_cnt'])], p['be_w'] ) )
+        else:
+            V.wirea( f'wcb_in_be', p['mem_be_w'], f'wcb_line_be' )
+        V.wirea( f'wcb_in_dat', p['mem_dat_w'], V.repl( f'wcb_line_dat', p['mem_subword_cnt'] ) )
+        V.wirea( f'wcb_lookup_addr', p['mem_addr_w'], f'{req}_addr[{req_addr_w-1}:{mem_subword_w}]' )
+        V.wirea( f'{c2m}_rd_pvld', 1, f'tags_req0_pvld && tags_req0_status == TAGS_MISS' )
+        V.wirea( f'wcb_out_prdy', 1, f'{c2m}_p_prdy && !{c2m}_rd_pvld' )
+        wcb( f'wcb', p['wcb_cnt'], p['mem_addr_w'], p['mem_dat_w'] )
+        P( f'assign wcb_stall0 = !wcb_avail || (wcb_lookup_hit && !{req}_is_wr);' )
 
     P()
     P( f'// MEM REQ' )
     P( f'//' )
-    P( f'assign {c2m}_p_pvld = tags_req0_pvld && tags_req0_status == TAGS_MISS;' )
-    P( f'assign {c2m}_p_addr = tags_req0_addr[{req_addr_w-1}:{mem_subword_w}];' )
-    V.wirea( f'{c2m}_p_subword_i', mem_subword_w, f'tags_req0_addr[{mem_subword_w-1}:0]' )
-    P( f'assign {c2m}_p_tag_id = {{{u2c}_d_id, {c2m}_p_subword_i, tags__alloc_avail_chosen_i}};' )
+    for r, l in enumerate( ls ):
+        lane_i = '' if req_cnt == 1 else f'{req_i_w}\'d{r}, '
+        if is_writable:
+            # reads go first; the WCB writes to memory in other cycles
+            P( f'assign {c2m}_p_pvld = {c2m}_rd_pvld || wcb_out_pvld;' )
+            P( f'assign {c2m}_p_is_wr = !{c2m}_rd_pvld;' )
+            P( f'assign {c2m}_p_addr = {c2m}_rd_pvld ? tags_req0_addr[{req_addr_w-1}:{mem_subword_w}] : wcb_out_addr;' )
+            P( f'assign {c2m}_p_be = wcb_out_be;' )
+            P( f'assign {c2m}_p_dat = wcb_out_dat;' )
+        else:
+            P( f'assign {c2m}_p{l}_pvld = tags_req{r}_pvld && tags_req{r}_status == TAGS_MISS;' )
+            P( f'assign {c2m}_p{l}_addr = tags_req{r}_addr[{req_addr_w-1}:{mem_subword_w}];' )
+        V.wirea( f'{c2m}_p{l}_subword_i', mem_subword_w, f'tags_req{r}_addr[{mem_subword_w-1}:0]' )
+        P( f'assign {c2m}_p{l}_tag_id = {{{lane_i}{reqs[r]}_id, {c2m}_p{l}_subword_i, tags_req{r}_tag_i}};' )
+    if req_cnt > 1:
+        # each lane holds one miss in {c2m}_q{l} while the lanes take turns on {c2m}_p
+        for l in ls:
+            V.wire( f'{c2m}_q{l}_prdy', 1 )
+            V.iface_stage( f'{c2m}_p{l}', f'{c2m}_q{l}', p['cache2mem'], 'pvld', 'prdy', mode='pipe', do_dprint=False )
+        V.wirea( f'{c2m}_q_pvlds', req_cnt, V.concata( [f'{c2m}_q{l}_pvld' for l in ls], 1 ) )
+        V.choose_eligible( f'{c2m}_q_chosen_i', f'{c2m}_q_pvlds', req_cnt, f'{c2m}_q_preferred_i', gen_preferred=True, adv_preferred=f'{c2m}_p_prdy' )
+        P( f'assign {c2m}_p_pvld = {c2m}_q_pvlds_any_vld;' )
+        for sig in p['cache2mem']:
+            V.muxa( f'{c2m}_q_{sig}', p['cache2mem'][sig], f'{c2m}_q_chosen_i', [f'{c2m}_q{l}_{sig}' for l in ls] )
+            P( f'assign {c2m}_p_{sig} = {c2m}_q_{sig};' )
+        for r, l in enumerate( ls ): P( f'assign {c2m}_q{l}_prdy = {c2m}_p_prdy && {c2m}_q_chosen_i == {r};' )
 
     P()
     P( f'// RETURNED DATA' )
     P( f'//' )
-    V.iface_reg( f'{c2u}_dat', p['cache2unit_dat'], True, False )
-    V.wirea( f'{c2u}_dat_pvld_p', 1, f'tags_fill_pvld || (tags_req0_pvld && tags_req0_status == TAGS_HIT)' )
-    P( f'assign tags_decr0_pvld = {c2u}_dat_pvld_p || (tags_req0_pvld && tags_req0_status == TAGS_HIT_BEING_FILLED);' )
-    P( f'assign tags_decr0_tag_i = tags_fill_pvld ? tags_fill_tag_i : tags_req0__hit_i;' )
-    dats = [f'{cache}_bits{i}' for i in range(p['line_cnt'])]
-    V.muxa( f'{cache}_hit_dat', p['dat_w'], f'tags_req0__hit_i', dats )
-    V.always_at_posedge()
-    P( f'    {c2u}_dat_pvld <= {c2u}_dat_pvld_p;' )
-    P( f'    if ( {c2u}_dat_pvld_p ) begin' )
-    P( f'        {c2u}_dat_id <= tags_fill_pvld ? tags_fill_id : {u2c}_d_id;' )
-    P( f'        {c2u}_dat_dat <= tags_fill_pvld ? tags_fill_dat : {cache}_hit_dat;' )
-    P( f'    end' )
-    P( f'end' )
+    for r, l in enumerate( ls ):
+        req = reqs[r]
+        dat = f'{c2u}{l}_dat'
+        fill_pvld = f'tags_fill_pvld' if req_cnt == 1 else f'(tags_fill_pvld && tags_fill_req_i == {r})'
+        drain_pvld = f'mshrs_drain_pvld' if req_cnt == 1 else f'(mshrs_drain_pvld && mshrs_drain_req_i == {r})'
+        if is_data_ra2:
+            # fill data bypasses the data ram; hit data comes from the data ram output
+            V.iface_reg( dat, { 'id': p['req_id_w'] }, True, False )
+            V.reg( f'{dat}_is_fill', 1 )
+            V.reg( f'{dat}_fill_dat', p['dat_w'] )
+        else:
+            V.iface_reg( dat, p['cache2unit_dat'], True, False )
+        is_rd = f' && !tags_req{r}_is_wr' if is_writable else ''
+        if has_mshrs:
+            # a woken waiter doesn't hold a ref_cnt on the line
+            V.wirea( f'{dat}_pvld_p', 1, f'{fill_pvld} || {drain_pvld} || (tags_req{r}_pvld && tags_req{r}_status == TAGS_HIT{is_rd})' )
+        else:
+            V.wirea( f'{dat}_pvld_p', 1, f'{fill_pvld} || (tags_req{r}_pvld && tags_req{r}_status == TAGS_HIT{is_rd})' )
+        if has_mshrs or is_writable:
+            P( f'assign tags_decr{r}_pvld = {fill_pvld} || (tags_req{r}_pvld && (tags_req{r}_status == TAGS_HIT || tags_req{r}_status == TAGS_HIT_BEING_FILLED));' )
+        else:
+            P( f'assign tags_decr{r}_pvld = {dat}_pvld_p || (tags_req{r}_pvld && tags_req{r}_status == TAGS_HIT_BEING_FILLED);' )
+        P( f'assign tags_decr{r}_tag_i = tags_fill_pvld ? tags_fill_tag_i : tags_req{r}_tag_i;' )
+        if not is_data_ra2 and not is_writable:
+            dats = [f'{cache}_bits{i}' for i in range(p['line_cnt'])]
+            V.muxa( f'{cache}_hit_dat{l}', p['dat_w'], f'tags_req{r}_tag_i', dats )
+        V.always_at_posedge()
+        P( f'    {dat}_pvld <= {dat}_pvld_p;' )
+        P( f'    if ( {dat}_pvld_p ) begin' )
+        if has_mshrs:
+            P( f'        {dat}_id <= tags_fill_pvld ? tags_fill_id : {drain_pvld} ? mshrs_drain_id : {req}_id;' )
+        else:
+            P( f'        {dat}_id <= tags_fill_pvld ? tags_fill_id : {req}_id;' )
+        if is_data_ra2 and has_mshrs:
+            P( f'        {dat}_is_fill <= tags_fill_pvld || {drain_pvld};' )
+            P( f'        if ( tags_fill_pvld || {drain_pvld} ) {dat}_fill_dat <= tags_fill_pvld ? tags_fill_dat : mshrs_drain_dat;' )
+        elif is_data_ra2:
+            P( f'        {dat}_is_fill <= tags_fill_pvld;' )
+            P( f'        if ( tags_fill_pvld ) {dat}_fill_dat <= tags_fill_dat;' )
+        elif has_mshrs:
+            P( f'        {dat}_dat <= tags_fill_pvld ? tags_fill_dat : {drain_pvld} ? mshrs_drain_dat : {cache}_hit_dat{l};' )
+        else:
+            P( f'        {dat}_dat <= tags_fill_pvld ? tags_fill_dat : {cache}_hit_dat{l};' )
+        P( f'    end' )
+        P( f'end' )
+        if is_data_ra2: P( f'assign {dat}_dat = {dat}_is_fill ? {dat}_fill_dat : {cache}_dram{l}_rd_dat;' )
 
     P()
     P( f'// IDLE' )
     P( f'//' )
-    idle = f'!{u2c}_d_pvld && !{c2m}_p_pvld && !{m2c}_d_pvld && tags_idle'
+    idle = ''
+    for l in ls: idle += f'!{u2c}{l}_d_pvld && '
+    if req_cnt > 1:
+        for l in ls: idle += f'!{c2m}_q{l}_pvld && '
+    idle += f'!{c2m}_p_pvld && !{m2c}_d_pvld && tags_idle'
+    if has_mshrs: idle += ' && mshrs_idle'
+    if is_writable: idle += f' && wcb_idle && !{c2m}_pvld'   # a write leaves nothing else behind once it leaves the wcb
+    if is_tag_ra2: idle = f'!{reqs[0]}_pvld && {idle}'
     P( f'assign {cache}_idle = {idle};' )
 
     V.module_footer( module_name )
@@ -225,28 +492,42 @@ def header( p, module_name ):
     V.input( f'{V.clk}', 1 )
     V.input( f'{V.reset_}', 1 )
     V.output( f'{cache}_idle', 1 )
-    V.iface_input( f'{u2c}', p['unit2cache'], True )
-    V.iface_output( f'{c2u}_status', p['cache2unit_status'], False )
-    V.iface_output( f'{c2u}_dat', p['cache2unit_dat'], False )
+    for l in lanes( p ):
+        V.iface_input( f'{u2c}{l}', p['unit2cache'], True )
+        V.iface_output( f'{c2u}{l}_status', p['cache2unit_status'], False )
+        V.iface_output( f'{c2u}{l}_dat', p['cache2unit_dat'], False )
     V.iface_output( f'{c2m}', p['cache2mem'], True )
     V.iface_input( f'{m2c}', p['mem2cache'], False )
     V.module_header_end()
-    V.wire( f'{u2c}_d_prdy', 1 )
-    V.iface_stage( f'{u2c}', f'{u2c}_d', p['unit2cache'], 'pvld', 'prdy', full_handshake=True, do_dprint=False )
+    for l in lanes( p ):
+        V.wire( f'{u2c}{l}_d_prdy', 1 )
+        V.iface_stage( f'{u2c}{l}', f'{u2c}{l}_d', p['unit2cache'], 'pvld', 'prdy', full_handshake=True, do_dprint=False )
     P()
     V.iface_wire( f'{c2m}_p', p['cache2mem'], True )
+    if p['req_cnt'] > 1:
+        for l in lanes( p ): V.iface_wire( f'{c2m}_p{l}', p['cache2mem'], True )
     V.iface_stage( f'{c2m}_p', f'{c2m}', p['cache2mem'], 'pvld', 'prdy', full_handshake=True, do_dprint=False )
     V.iface_stage( f'{m2c}', f'{m2c}_d', p['mem2cache'], 'pvld', do_dprint=False )
-    V.iface_dprint( f'{u2c}', p['unit2cache'], f'{u2c}_pvld', f'{u2c}_prdy' )
-    V.iface_dprint( f'{c2u}_status', p['cache2unit_status'], f'{c2u}_status_pvld' )
-    V.iface_dprint( f'{c2u}_dat', p['cache2unit_dat'], f'{c2u}_dat_pvld' )
+    for l in lanes( p ):
+        V.iface_dprint( f'{u2c}{l}', p['unit2cache'], f'{u2c}{l}_pvld', f'{u2c}{l}_prdy' )
+        V.iface_dprint( f'{c2u}{l}_status', p['cache2unit_status'], f'{c2u}{l}_status_pvld' )
+        V.iface_dprint( f'{c2u}{l}_dat', p['cache2unit_dat'], f'{c2u}{l}_dat_pvld' )
     V.iface_dprint( f'{c2m}', p['cache2mem'], f'{c2m}_pvld', f'{c2m}_prdy' )
     V.iface_dprint( f'{m2c}', p['mem2cache'], f'{m2c}_pvld' )
   
 #--------------------------------------------------------------------
 # Generate cache tags handling.
+#
+# With has_wr=True, {name}_req{r}_is_wr marks a write, which never allocates a line, 
+# and {name}_req{r}_victim_vld/addr give the line that a MISS replaces.
+#
+# With has_addr_hit=True, {name}_req{r}_addr_hit says that {name}_req{r}_addr is in the tags. It doesn't depend
+# on {name}_req{r}_pvld, so it can be used to decide whether to take the request.
+#
+# A miss to the same addr as an earlier req's miss in the same cycle joins the line allocated for the earlier req
+# and gets HIT_BEING_FILLED.
 #--------------------------------------------------------------------
-def tags( name, addr_w, tag_cnt, req_cnt, ref_cnt_max, incr_ref_cnt_max=1, decr_req_cnt=0, can_always_alloc=False, custom_avails=False ):
+def tags( name, addr_w, tag_cnt, req_cnt, ref_cnt_max, incr_ref_cnt_max=1, decr_req_cnt=0, can_always_alloc=False, custom_avails=False, has_wr=False, has_addr_hit=False ):
     if incr_ref_cnt_max < 1: S.die( f'tags: incr_ref_cnt_max needs to be at least 1' )
     if decr_req_cnt == 0: decr_req_cnt = req_cnt
 
@@ -269,10 +550,15 @@ def tags( name, addr_w, tag_cnt, req_cnt, ref_cnt_max, incr_ref_cnt_max=1, decr_
     hits = ''
     needs_allocs = []
     for r in range(req_cnt):
-        V.wirea( f'{name}_req{r}__hit_one_hot', tag_cnt, V.concata( [f'{name}_req{r}_pvld && {name}__vlds[{i}] && {name}_req{r}_addr == {name}__addr{i}' for i in range(tag_cnt)], 1 ) )
+        V.wirea( f'{name}_req{r}__addr_hits', tag_cnt, V.concata( [f'{name}__vlds[{i}] && {name}_req{r}_addr == {name}__addr{i}' for i in range(tag_cnt)], 1 ) )
+        if has_addr_hit: V.wirea( f'{name}_req{r}_addr_hit', 1, f'|{name}_req{r}__addr_hits' )
+        V.wirea( f'{name}_req{r}__hit_one_hot', tag_cnt, f'{V.repl( f"{name}_req{r}_pvld", tag_cnt )} & {name}_req{r}__addr_hits' )
         V.one_hot_to_binary( f'{name}_req{r}__hit_one_hot', tag_cnt, f'{name}_req{r}__hit_i', f'{name}_req{r}__hit_vld' )
         V.wirea( f'{name}_req{r}_hit_and_filled', 1, f'{name}_req{r}__hit_vld && ({name}_req{r}__hit_one_hot & {name}__filleds) == {name}_req{r}__hit_one_hot' )
-        V.wirea( f'{name}_req{r}__needs_alloc', 1, f'{name}_req{r}_pvld && !{name}_req{r}__hit_vld' )
+        # a miss to the same addr as an earlier req's miss in the same cycle doesn't get its own line
+        same_earlier_miss = ''.join( [f' && !({name}_req{q}__needs_alloc && {name}_req{q}_addr == {name}_req{r}_addr)' for q in range(r)] )
+        is_rd = f' && !{name}_req{r}_is_wr' if has_wr else ''
+        V.wirea( f'{name}_req{r}__needs_alloc', 1, f'{name}_req{r}_pvld && !{name}_req{r}__hit_vld{same_earlier_miss}{is_rd}' )
         if r != 0: hits += ' | '
         hits += f'{name}_req{r}__hit_one_hot'
         needs_allocs.append( f'{name}_req{r}__needs_alloc' )
@@ -290,20 +576,50 @@ def tags( name, addr_w, tag_cnt, req_cnt, ref_cnt_max, incr_ref_cnt_max=1, decr_
         for i in range(tag_cnt):
             avails.append( f'{name}__need_alloc_pvld && !{name}__hits[{i}] && {name}__ref_cnt{i} == 0' )
         V.wirea( f'{name}__avails', tag_cnt, V.concata( avails, 1 ) )
-    V.choose_eligible( f'{name}__alloc_avail_chosen_i', f'{name}__avails', tag_cnt, f'{name}__avail_preferred_i', gen_preferred=True )
-    V.wirea( f'{name}__alloc_pvld', 1, f'{name}__avails_any_vld' )
-    V.choose_eligible( f'{name}__alloc_req_chosen_i',  f'{name}__needs_allocs', req_cnt, f'{name}__alloc_req_preferred_i', gen_preferred=True )
     addrs = [ f'{name}_req{i}_addr' for i in range(req_cnt) ]
-    V.muxa( f'{name}__alloc_addr', addr_w, f'{name}__alloc_req_chosen_i', addrs )
-    V.binary_to_one_hot( f'{name}__alloc_avail_chosen_i', tag_cnt, r=f'{name}__alloc_avail_chosen_one_hot', pvld=f'{name}__alloc_pvld' )
+    if req_cnt == 1:
+        V.choose_eligible( f'{name}__alloc_avail_chosen_i', f'{name}__avails', tag_cnt, f'{name}__avail_preferred_i', gen_preferred=True )
+        V.wirea( f'{name}__alloc_pvld', 1, f'{name}__avails_any_vld' )
+        V.choose_eligible( f'{name}__alloc_req_chosen_i',  f'{name}__needs_allocs', req_cnt, f'{name}__alloc_req_preferred_i', gen_preferred=True )
+        V.muxa( f'{name}__alloc_addr', addr_w, f'{name}__alloc_req_chosen_i', addrs )
+        V.binary_to_one_hot( f'{name}__alloc_avail_chosen_i', tag_cnt, r=f'{name}__alloc_avail_chosen_one_hot', pvld=f'{name}__alloc_pvld' )
+    else:
+        # allocate a line for each req that needs one, as far as the avails go
+        P(f'// {V.vlint_off_width}' )
+        P(f'// {V.vlint_off_unused}' )
+        V.choose_eligibles( f'{name}__alloc', f'{name}__avails', tag_cnt, f'{name}__avail_preferred_i', f'{name}__needs_allocs', req_cnt, gen_preferred=True )
+        V.wirea( f'{name}__alloc_avail_chosen_one_hot', tag_cnt, f'{name}__alloc_elig_vlds' )
+        V.wirea( f'{name}__alloc_pvld', 1, f'|{name}__alloc_elig_vlds' )
+        P(f'// {V.vlint_on_unused}' )
+        P(f'// {V.vlint_on_width}' )
+        V.unconcata( f'{name}__alloc_elig_req_indexes', tag_cnt, req_i_w, f'{name}__alloc_req_i' )
+        V.unconcata( f'{name}__alloc_req_elig_indexes', req_cnt, tag_i_w, f'{name}__alloc_tag_i' )
+        for i in range(tag_cnt): V.muxa( f'{name}__alloc_addr{i}', addr_w, f'{name}__alloc_req_i{i}', addrs )
+
+        # a miss to the same addr as an earlier req's allocated miss joins its line
+        for r in range(1, req_cnt):
+            joins = [f'{name}__alloc_req_vlds[{q}] && {name}_req{q}_addr == {name}_req{r}_addr' for q in range(r)]
+            V.wirea( f'{name}_req{r}__joins', r, V.concata( joins, 1 ) )
+            V.wirea( f'{name}_req{r}__join_vld', 1, f'{name}_req{r}_pvld && !{name}_req{r}__hit_vld && |{name}_req{r}__joins' )
+            if r == 1:
+                V.wirea( f'{name}_req{r}__join_tag_i', tag_i_w, f'{name}__alloc_tag_i0' )
+            else:
+                V.one_hot_to_binary( f'{name}_req{r}__joins', r, f'{name}_req{r}__join_q' )
+                V.muxa( f'{name}_req{r}__join_tag_i', tag_i_w, f'{name}_req{r}__join_q', [f'{name}__alloc_tag_i{q}' for q in range(r)] )
+            V.binary_to_one_hot( f'{name}_req{r}__join_tag_i', tag_cnt, f'{name}_req{r}__join_one_hot', f'{name}_req{r}__join_vld' )
     V.always_at_posedge()
     P(f'    if ( !{V.reset_} ) begin' )
     P(f'        {name}__vlds <= 0;' )
     P(f'    end else begin' )
     for i in range(tag_cnt):
-        P(f'        if ( {name}__alloc_pvld && {name}__alloc_avail_chosen_i == {i} ) begin' )
-        P(f'            {name}__vlds[{i}] <= 1\'b1;' )
-        P(f'            {name}__addr{i} <= {name}__alloc_addr;' )
+        if req_cnt == 1:
+            P(f'        if ( {name}__alloc_pvld && {name}__alloc_avail_chosen_i == {i} ) begin' )
+            P(f'            {name}__vlds[{i}] <= 1\'b1;' )
+            P(f'            {name}__addr{i} <= {name}__alloc_addr;' )
+        else:
+            P(f'        if ( {name}__alloc_avail_chosen_one_hot[{i}] ) begin' )
+            P(f'            {name}__vlds[{i}] <= 1\'b1;' )
+            P(f'            {name}__addr{i} <= {name}__alloc_addr{i};' )
         P(f'        end' )
     P(f'    end' )
     P(f'end' )
@@ -312,12 +628,21 @@ def tags( name, addr_w, tag_cnt, req_cnt, ref_cnt_max, incr_ref_cnt_max=1, decr_
     P(f'// {name} statuses' )
     P(f'//' )
     for r in range(req_cnt):
+        is_being_filled = f'{name}_req{r}__hit_vld' if r == 0 else f'({name}_req{r}__hit_vld || {name}_req{r}__join_vld)'
         if can_always_alloc:
-            V.wirea( f'{name}_req{r}_status', 2, f'{name}_req{r}_hit_and_filled ? {name_uc}_HIT : {name}_req{r}__hit_vld ? {name_uc}_HIT_BEING_FILLED : {name_uc}_MISS' )
+            V.wirea( f'{name}_req{r}_status', 2, f'{name}_req{r}_hit_and_filled ? {name_uc}_HIT : {is_being_filled} ? {name_uc}_HIT_BEING_FILLED : {name_uc}_MISS' )
             dassert( f'!{name}_req{r}__needs_alloc || ({name}__alloc_pvld && {name}__alloc_req_chosen_i == {i})', f'{name} has can_always_alloc=True but can\'t alloc for req{r}' )
         else:
-            V.wirea( f'{name}_req{r}_status', 2, f'{name}_req{r}_hit_and_filled ? {name_uc}_HIT : {name}_req{r}__hit_vld ? {name_uc}_HIT_BEING_FILLED : ({name}__alloc_pvld && {name}__alloc_req_chosen_i == {r}) ? {name_uc}_MISS : {name_uc}_MISS_CANT_ALLOC' )
-        V.wirea( f'{name}_req{r}_tag_i', tag_i_w, f'{name}_req{r}__hit_vld ? {name}_req{r}__hit_i : {name}__alloc_avail_chosen_i' )
+            is_alloced = f'({name}__alloc_pvld && {name}__alloc_req_chosen_i == {r})' if req_cnt == 1 else f'{name}__alloc_req_vlds[{r}]'
+            V.wirea( f'{name}_req{r}_status', 2, f'{name}_req{r}_hit_and_filled ? {name_uc}_HIT : {is_being_filled} ? {name_uc}_HIT_BEING_FILLED : {is_alloced} ? {name_uc}_MISS : {name_uc}_MISS_CANT_ALLOC' )
+        alloc_tag_i = f'{name}__alloc_avail_chosen_i' if req_cnt == 1 else f'{name}__alloc_tag_i{r}'
+        if r != 0: alloc_tag_i = f'{name}_req{r}__join_vld ? {name}_req{r}__join_tag_i : {alloc_tag_i}'
+        V.wirea( f'{name}_req{r}_tag_i', tag_i_w, f'{name}_req{r}__hit_vld ? {name}_req{r}__hit_i : {alloc_tag_i}' )
+        if has_wr:
+            P(f'// {V.vlint_off_unused}' )      # a write-through cache doesn't use the victim
+            V.wirea( f'{name}_req{r}_victim_vld', 1, f'{name}__vlds[{name}_req{r}_tag_i]' )
+            V.muxa( f'{name}_req{r}_victim_addr', addr_w, f'{name}_req{r}_tag_i', [f'{name}__addr{i}' for i in range(tag_cnt)] )
+            P(f'// {V.vlint_on_unused}' )
         sigs = { 'addr': addr_w, 
                  'tag_i': tag_i_w,
                  'status': 2 }
@@ -357,6 +682,9 @@ def tags( name, addr_w, tag_cnt, req_cnt, ref_cnt_max, incr_ref_cnt_max=1, decr_
         for r in range(req_cnt):
             bool_expr += f' || {name}_req{r}__hit_one_hot[{i}]'
             sum_expr  += f' + {name}_req{r}__hit_one_hot[{i}]'
+            if r != 0:
+                bool_expr += f' || {name}_req{r}__join_one_hot[{i}]'
+                sum_expr  += f' + {name}_req{r}__join_one_hot[{i}]'
         for r in range(decr_req_cnt):
             bool_expr += f' || {name}_decr{r}__one_hot[{i}]'
             sum_expr  += f' - {name}_decr{r}__one_hot[{i}]'
@@ -387,9 +715,10 @@ def tags( name, addr_w, tag_cnt, req_cnt, ref_cnt_max, incr_ref_cnt_max=1, decr_
     V.dassert_no_x( f'{name}__decrs' )
     V.dassert( f'({name}__hits & {name}__alloc_avail_chosen_one_hot) === {tag_cnt}\'d0', f'{name} has hit and alloc to the same slot' )
     V.dassert( f'({name}__fills & {name}__filleds) === {tag_cnt}\'d0', f'{name} has fill of already filled slot' )
-    V.dassert( f'({name}__decrs & {name}__vlds) === {name}__decrs', f'{name} has decr-ref-cnt of slot with ref_cnt==0' )
+    V.dassert( f'({name}__decrs & ({name}__vlds | {name}__alloc_avail_chosen_one_hot)) === {name}__decrs', f'{name} has decr-ref-cnt of slot with ref_cnt==0' )
     for i in range(tag_cnt):
-        V.dassert( f'{name}__ref_cnt{i} !== 0 || {name}_decr{r}__one_hot[{i}] === 0 || {name}_req{r}__hit_one_hot[{i}] == 1', f'{name}__ref_cnt{i} underflow' )
+        joined = f' || {name}_req{r}__join_one_hot[{i}] == 1' if r != 0 else ''
+        V.dassert( f'{name}__ref_cnt{i} !== 0 || {name}_decr{r}__one_hot[{i}] === 0 || {name}_req{r}__hit_one_hot[{i}] == 1{joined}', f'{name}__ref_cnt{i} underflow' )
         V.dassert( f'{name}__alloc_avail_chosen_one_hot[{i}] === 0 || {name}_req{r}__hit_one_hot[{i}] === 0', f'{name}__ref_cnt{i} alloc and hit at same time' )
         V.dassert( f'{name}__ref_cnt{i} !== {ref_cnt_max} || ({name}__alloc_avail_chosen_one_hot[{i}] === 0 && {name}_req{r}__hit_one_hot[{i}] === 0)', f'{name}__ref_cnt{i} overflow' )
     expr = ''
@@ -407,6 +736,409 @@ def tags( name, addr_w, tag_cnt, req_cnt, ref_cnt_max, incr_ref_cnt_max=1, decr_
     for r in range(req_cnt): idle += f' && !{name}_req{r}_pvld' 
     V.wirea( f'{name}_idle', 1, idle )
 
+#--------------------------------------------------------------------
+# Generate set-associative cache tags handling for one request per cycle.
+#
+# There are set_cnt sets of assoc ways each, and line (tag_i) {set_i, way_i} is way way_i of set set_i.
+# The set of an address is chosen by index_kind:
+#
+#     bits - the low log2(set_cnt) bits of the address; the rest of the address is the tag
+#     hash - V.hash() of the whole address, which spreads strided addresses across the sets;
+#            the tag is then the whole address
+#
+# Only the assoc ways of the request's set are compared. The vld and filled bits and the ref_cnts 
+# of the lines are kept in flops. The tags are kept in flops with tag_ram_kind=ff. With tag_ram_kind=ra2, 
+# each set's tags are one row of a V.ram() with one cycle of read latency, so {name}_lookup_pvld/addr 
+# must read the set of a request the cycle before it shows up on {name}_req0_pvld/addr (it may stay
+# there until it is taken). A tag written in the same cycle as a lookup of the same set is forwarded.
+#
+# On a miss, an invalid way of the set is preferred, else any way with a ref_cnt of 0.
+# The inputs and outputs are otherwise the same as for tags() with req_cnt=1, including has_wr and has_addr_hit.
+#--------------------------------------------------------------------
+def set_assoc_tags( name, addr_w, set_cnt, assoc, ref_cnt_max, index_kind='bits', tag_ram_kind='ff', has_wr=False, has_addr_hit=False ):
+    line_cnt  = set_cnt * assoc
+    set_w     = V.log2( set_cnt )
+    way_w     = V.log2( assoc )
+    line_w    = set_w + way_w
+    tag_w     = addr_w if index_kind == 'hash' else addr_w - set_w
+    ref_cnt_w = V.log2( ref_cnt_max+1 )
+    is_ra2    = tag_ram_kind == 'ra2'
+    name_uc   = name.upper()
+
+    def line_i( set_i, way_i ):
+        return set_i if assoc == 1 else f'{{{set_i}, {way_i}}}'
+
+    def index( r ):
+        if index_kind == 'hash':
+            V.hash( f'{r}_addr', addr_w, set_w, f'{r}_set' )
+            V.wirea( f'{r}_tag', tag_w, f'{r}_addr' )
+        else:
+            V.wirea( f'{r}_set', set_w, f'{r}_addr[{set_w-1}:0]' )
+            V.wirea( f'{r}_tag', tag_w, f'{r}_addr[{addr_w-1}:{set_w}]' )
+
+    P()
+    P(f'// {name} cache tags: addr_w={addr_w} set_cnt={set_cnt} assoc={assoc} ref_cnt_max={ref_cnt_max} index_kind={index_kind} tag_ram_kind={tag_ram_kind}' )
+    P(f'//' )
+    V.enum( f'{name_uc}_', ['MISS_CANT_ALLOC', 'MISS', 'HIT', 'HIT_BEING_FILLED'] )
+    V.reg( f'{name}__vlds', line_cnt )
+    V.reg( f'{name}__filleds', line_cnt )
+    P(f'reg [{ref_cnt_w-1}:0] {name}__ref_cnts [0:{line_cnt-1}];' )
+    V.reg( f'{name}__ref_total', V.log2( line_cnt*ref_cnt_max+1 ) )
+    if not is_ra2: P(f'reg [{tag_w-1}:0] {name}__tags [0:{line_cnt-1}];' )
+
+    P()
+    P(f'// {name} set lookup' )
+    P(f'//' )
+    index( f'{name}_req0' )
+    if is_ra2:
+        # one ram row holds all the tags of a set, way 0 in the lsbs; the lookup uses only its set
+        P(f'// {V.vlint_off_unused}' )
+        index( f'{name}_lookup' )
+        P(f'// {V.vlint_on_unused}' )
+        V.wire( f'{name}__tram_we', 1 )
+        V.wire( f'{name}__tram_wa', set_w )
+        V.wire( f'{name}__tram_tags', assoc*tag_w )
+        V.wirea( f'{name}__tram_rd_re', 1, f'{name}_lookup_pvld' )
+        V.wirea( f'{name}__tram_rd_ra', set_w, f'{name}_lookup_set' )
+        V.ram( f'{name}__tram', f'{name}__tram_rd', { 'tags': assoc*tag_w }, set_cnt, m_name='' if V.ramgen_cmd != '' else f'{V.module_name}_{name}_ram' )
+        V.reg( f'{name}__fwd_vld', 1 )
+        V.reg( f'{name}__fwd_set', set_w )
+        V.reg( f'{name}__fwd_tags', assoc*tag_w )
+        V.always_at_posedge()
+        P(f'    if ( !{V.reset_} ) begin' )
+        P(f'        {name}__fwd_vld <= 1\'b0;' )
+        P(f'    end else if ( {name}_lookup_pvld ) begin' )
+        P(f'        {name}__fwd_vld <= {name}__tram_we && {name}__tram_wa == {name}_lookup_set;' )
+        P(f'        {name}__fwd_set <= {name}__tram_wa;' )
+        P(f'        {name}__fwd_tags <= {name}__tram_tags;' )
+        P(f'    end' )
+        P(f'end' )
+        V.wirea( f'{name}_req0_set_tags', assoc*tag_w, f'({name}__fwd_vld && {name}__fwd_set == {name}_req0_set) ? {name}__fwd_tags : {name}__tram_rd_tags' )
+    addr_hits = []
+    avails = []
+    for w in range(assoc):
+        li = line_i( f'{name}_req0_set', f'{way_w}\'d{w}' )
+        if is_ra2:
+            V.wirea( f'{name}_req0_way{w}_tag', tag_w, f'{name}_req0_set_tags[{(w+1)*tag_w-1}:{w*tag_w}]' )
+        else:
+            V.wirea( f'{name}_req0_way{w}_tag', tag_w, f'{name}__tags[{li}]' )
+        V.wirea( f'{name}_req0_way{w}_vld', 1, f'{name}__vlds[{li}]' )
+        V.wirea( f'{name}_req0_way{w}_ref_cnt', ref_cnt_w, f'{name}__ref_cnts[{li}]' )
+        addr_hits.append( f'{name}_req0_way{w}_vld && {name}_req0_way{w}_tag == {name}_req0_tag' )
+        avails.append( f'{name}_req0__needs_alloc && (!{name}_req0_way{w}_vld || {name}_req0_way{w}_ref_cnt == 0)' )
+
+    P()
+    P(f'// {name} hit checks' )
+    P(f'//' )
+    V.wirea( f'{name}_req0__addr_hits', assoc, V.concata( addr_hits, 1 ) )
+    if has_addr_hit: V.wirea( f'{name}_req0_addr_hit', 1, f'|{name}_req0__addr_hits' )
+    V.wirea( f'{name}_req0__hit_one_hot', assoc, f'{V.repl( f"{name}_req0_pvld", assoc )} & {name}_req0__addr_hits' )
+    V.one_hot_to_binary( f'{name}_req0__hit_one_hot', assoc, f'{name}_req0__hit_way_i' )
+    V.wirea( f'{name}_req0__hit_vld', 1, f'|{name}_req0__hit_one_hot' )
+    V.wirea( f'{name}_req0__hit_i', line_w, line_i( f'{name}_req0_set', f'{name}_req0__hit_way_i' ) )
+    V.wirea( f'{name}_req0_hit_and_filled', 1, f'{name}_req0__hit_vld && {name}__filleds[{name}_req0__hit_i]' )
+    is_rd = f' && !{name}_req0_is_wr' if has_wr else ''
+    V.wirea( f'{name}_req0__needs_alloc', 1, f'{name}_req0_pvld && !{name}_req0__hit_vld{is_rd}' )
+
+    P()
+    P(f'// {name} alloc' )
+    P(f'//' )
+    V.wirea( f'{name}__avails', assoc, V.concata( avails, 1 ) )
+    V.wirea( f'{name}__invalids', assoc, f'{name}__avails & ~' + V.concata( [ f'{name}_req0_way{w}_vld' for w in range(assoc) ], 1 ) )
+    V.wirea( f'{name}__eligs', assoc, f'(|{name}__invalids) ? {name}__invalids : {name}__avails' )
+    V.choose_eligible( f'{name}__alloc_way_i', f'{name}__eligs', assoc, f'{name}__alloc_preferred_i', gen_preferred=True )
+    V.wirea( f'{name}__alloc_pvld', 1, f'{name}__eligs_any_vld' )
+    V.wirea( f'{name}__alloc_i', line_w, line_i( f'{name}_req0_set', f'{name}__alloc_way_i' ) )
+
+    P()
+    P(f'// {name} status' )
+    P(f'//' )
+    V.wirea( f'{name}_req0_status', 2, f'{name}_req0_hit_and_filled ? {name_uc}_HIT : {name}_req0__hit_vld ? {name_uc}_HIT_BEING_FILLED : {name}__alloc_pvld ? {name_uc}_MISS : {name_uc}_MISS_CANT_ALLOC' )
+    V.wirea( f'{name}_req0_tag_i', line_w, f'{name}_req0__hit_vld ? {name}_req0__hit_i : {name}__alloc_i' )
+    if has_wr:
+        P(f'// {V.vlint_off_unused}' )          # a write-through cache doesn't use the victim
+        V.muxa( f'{name}_req0_victim_vld', 1, f'{name}__alloc_way_i', [f'{name}_req0_way{w}_vld' for w in range(assoc)] )
+        V.muxa( f'{name}_req0_victim_tag', tag_w, f'{name}__alloc_way_i', [f'{name}_req0_way{w}_tag' for w in range(assoc)] )
+        V.wirea( f'{name}_req0_victim_addr', addr_w, f'{name}_req0_victim_tag' if index_kind == 'hash' else f'{{{name}_req0_victim_tag, {name}_req0_set}}' )
+        P(f'// {V.vlint_on_unused}' )
+    V.iface_dprint( f'{name}_req0', { 'addr': addr_w, 'tag_i': line_w, 'status': 2 }, f'{name}_req0_pvld' )
+    V.iface_dprint( f'{name}_decr0', { 'tag_i': line_w }, f'{name}_decr0_pvld' )
+    V.iface_dprint( f'{name}_fill', { 'tag_i': line_w }, f'{name}_fill_pvld' )
+
+    P()
+    P(f'// {name} updates' )
+    P(f'//' )
+    if is_ra2:
+        # rewrite the whole set with the new tag in the allocated way
+        P(f'assign {name}__tram_we = {name}__alloc_pvld;' )
+        P(f'assign {name}__tram_wa = {name}_req0_set;' )
+        P(f'assign {name}__tram_tags = ' + V.concata( [ f'({name}__alloc_way_i == {w}) ? {name}_req0_tag : {name}_req0_way{w}_tag' for w in range(assoc) ], tag_w ) + ';' )
+    V.wirea( f'{name}__incr_pvld', 1, f'{name}_req0__hit_vld || {name}__alloc_pvld' )
+    V.wirea( f'{name}__incr_ref_cnt', ref_cnt_w, f'{name}__alloc_pvld ? {ref_cnt_w}\'d0 : {name}__ref_cnts[{name}_req0_tag_i]' )
+    V.wirea( f'{name}__incr_decr_same', 1, f'{name}__incr_pvld && {name}_decr0_pvld && {name}_req0_tag_i == {name}_decr0_tag_i' )
+    P(f'// {V.vlint_off_width}' )
+    V.always_at_posedge()
+    P(f'    if ( !{V.reset_} ) begin' )
+    P(f'        {name}__vlds <= 0;' )
+    P(f'        {name}__filleds <= 0;' )
+    P(f'        {name}__ref_total <= 0;' )
+    P(f'    end else begin' )
+    P(f'        if ( {name}__alloc_pvld ) begin' )
+    P(f'            {name}__vlds[{name}__alloc_i] <= 1\'b1;' )
+    P(f'            {name}__filleds[{name}__alloc_i] <= 1\'b0;' )
+    if not is_ra2: P(f'            {name}__tags[{name}__alloc_i] <= {name}_req0_tag;' )
+    P(f'        end' )
+    P(f'        if ( {name}_fill_pvld ) {name}__filleds[{name}_fill_tag_i] <= 1\'b1;' )
+    P(f'        if ( {name}__incr_pvld && !{name}__incr_decr_same ) {name}__ref_cnts[{name}_req0_tag_i] <= {name}__incr_ref_cnt + 1;' )
+    P(f'        if ( {name}_decr0_pvld && !{name}__incr_decr_same ) {name}__ref_cnts[{name}_decr0_tag_i] <= {name}__ref_cnts[{name}_decr0_tag_i] - 1;' )
+    P(f'        if ( {name}__incr_pvld != {name}_decr0_pvld ) {name}__ref_total <= {name}__ref_total + {name}__incr_pvld - {name}_decr0_pvld;' )
+    P(f'    end' )
+    P(f'end' )
+    P(f'// {V.vlint_on_width}' )
+
+    P()
+    P(f'// {name} assertions' )
+    P(f'//' )
+    V.dassert_no_x( f'{name}__vlds' )
+    V.dassert_no_x( f'{name}_req0__hit_one_hot' )
+    V.dassert_no_x( f'{name}__eligs', f'{name}_req0__needs_alloc' )
+    V.dassert( f'!{name}_fill_pvld || !{name}__filleds[{name}_fill_tag_i]', f'{name} has fill of already filled line' )
+    V.dassert( f'!{name}_decr0_pvld || {name}__ref_cnts[{name}_decr0_tag_i] != 0 || {name}__incr_decr_same', f'{name} has decr-ref-cnt of line with ref_cnt==0' )
+    V.dassert( f'!{name}__incr_pvld || {name}__alloc_pvld || {name}__incr_ref_cnt != {ref_cnt_max} || {name}__incr_decr_same', f'{name} ref_cnt overflow' )
+    expr = ''
+    for i in range(assoc-1):
+        for j in range(i+1, assoc):
+            if expr != '': expr += ' && '
+            expr += f'(!{name}_req0_way{i}_vld || !{name}_req0_way{j}_vld || {name}_req0_way{i}_tag !== {name}_req0_way{j}_tag)'
+    if expr != '': V.dassert( expr, f'{name} has duplicate tags in a set', f'{name}_req0_pvld' )
+
+    P()
+    P(f'// {name} idle' )
+    P(f'//' )
+    V.wirea( f'{name}_idle', 1, f'!{name}_fill_pvld && {name}__ref_total == 0 && !{name}_req0_pvld' )
+
+#--------------------------------------------------------------------
+# Generate a file of mshr_cnt miss status holding registers (MSHRs) for req_cnt request lanes.
+#
+# An MSHR is allocated by {name}_alloc{r}_pvld/tag_i for each miss of lane r and holds the line (tag_i) until its fill.
+# A request of lane r that hits the same line before the fill joins the MSHR's waiter list using 
+# {name}_wait{r}_pvld/tag_i/id, which is a mask with one bit per lane and req id. It may also join an MSHR
+# that an earlier lane allocates in the same cycle. The fill of the line, 
+# {name}_fill_pvld/tag_i/dat, captures the line data in the MSHR. Then the waiters are woken one per cycle
+# on {name}_drain_pvld/req_i/id/dat, which is never in the same cycle as a fill. The MSHR is freed 
+# after its last waiter is woken.
+#
+# {name}_free_cnt is the number of MSHRs that can be allocated this cycle; no more lanes than that may miss.
+#--------------------------------------------------------------------
+def mshrs( name, mshr_cnt, req_cnt, req_id_w, tag_i_w, dat_w ):
+    if req_cnt > 1 and not V.is_pow2( mshr_cnt ): S.die( f'mshrs: mshr_cnt must be a power of 2 when req_cnt > 1' )
+    if mshr_cnt < req_cnt: S.die( f'mshrs: mshr_cnt must be >= req_cnt' )
+    req_i_w   = V.log2( req_cnt )
+    waiter_w  = req_cnt << req_id_w
+    waiter_i_w = req_i_w + req_id_w
+
+    # bit m of an mshr_cnt-wide mask, which is a scalar when mshr_cnt is 1
+    def bit( mask, m ):
+        return mask if mshr_cnt == 1 else f'{mask}[{m}]'
+
+    P()
+    P(f'// {name} MSHRs: mshr_cnt={mshr_cnt} req_cnt={req_cnt}' )
+    P(f'//' )
+    V.reg( f'{name}__vlds', mshr_cnt )
+    V.reg( f'{name}__filleds', mshr_cnt )
+    for m in range(mshr_cnt):
+        V.reg( f'{name}__tag_i{m}', tag_i_w )
+        V.reg( f'{name}__waiters{m}', waiter_w )
+        V.reg( f'{name}__dat{m}', dat_w )
+
+    P()
+    P(f'// {name} alloc' )
+    P(f'//' )
+    V.wirea( f'{name}__frees', mshr_cnt, f'~{name}__vlds' )
+    P(f'// {V.vlint_off_width}' )
+    V.wirea( f'{name}_free_cnt', V.log2( mshr_cnt+1 ), ' + '.join( [bit( f'{name}__frees', m ) for m in range(mshr_cnt)] ) )
+    P(f'// {V.vlint_on_width}' )
+    if req_cnt == 1:
+        V.choose_eligible( f'{name}__alloc_m', f'{name}__frees', mshr_cnt, f'{name}__alloc_preferred_i', gen_preferred=True, adv_preferred=f'{name}_alloc0_pvld' )
+        V.binary_to_one_hot( f'{name}__alloc_m', mshr_cnt, f'{name}__alloc_one_hot', f'{name}_alloc0_pvld' )
+        alloc_tag_is = [ f'{name}_alloc0_tag_i' for m in range(mshr_cnt) ]
+    else:
+        V.wirea( f'{name}__alloc_pvlds', req_cnt, V.concata( [f'{name}_alloc{r}_pvld' for r in range(req_cnt)], 1 ) )
+        V.choose_eligibles( f'{name}__alloc', f'{name}__frees', mshr_cnt, f'{name}__alloc_preferred_i', f'{name}__alloc_pvlds', req_cnt, gen_preferred=True )
+        V.wirea( f'{name}__alloc_one_hot', mshr_cnt, f'{name}__alloc_elig_vlds' )
+        V.unconcata( f'{name}__alloc_elig_req_indexes', mshr_cnt, max( 1, req_i_w ), f'{name}__alloc_req_i' )
+        alloc_tag_is = []
+        for m in range(mshr_cnt):
+            V.muxa( f'{name}__alloc_tag_i{m}', tag_i_w, f'{name}__alloc_req_i{m}', [f'{name}_alloc{r}_tag_i' for r in range(req_cnt)] )
+            alloc_tag_is.append( f'{name}__alloc_tag_i{m}' )
+
+    P()
+    P(f'// {name} waiters' )
+    P(f'//' )
+    P(f'// {V.vlint_off_width}' )
+    for r in range(req_cnt):
+        waits = []
+        for m in range(mshr_cnt):
+            is_waiting = f'{bit( f"{name}__vlds", m )} && !{bit( f"{name}__filleds", m )} && {name}__tag_i{m} == {name}_wait{r}_tag_i'
+            if r != 0: is_waiting = f'({is_waiting} || ({bit( f"{name}__alloc_one_hot", m )} && {alloc_tag_is[m]} == {name}_wait{r}_tag_i))'
+            waits.append( f'{name}_wait{r}_pvld && {is_waiting}' )
+        V.wirea( f'{name}__wait{r}_one_hot', mshr_cnt, V.concata( waits, 1 ) )
+        waiter_i = f'{name}_wait{r}_id' if req_cnt == 1 else f'{{{req_i_w}\'d{r}, {name}_wait{r}_id}}'
+        V.binary_to_one_hot( waiter_i, waiter_w, f'{name}__wait{r}_waiter' )
+    P(f'// {V.vlint_on_width}' )
+    for m in range(mshr_cnt):
+        joins = ' | '.join( [f'({bit( f"{name}__wait{r}_one_hot", m )} ? {name}__wait{r}_waiter : {waiter_w}\'d0)' for r in range(req_cnt)] )
+        V.wirea( f'{name}__joins{m}', waiter_w, joins )
+
+    P()
+    P(f'// {name} fill' )
+    P(f'//' )
+    V.wirea( f'{name}__fill_one_hot', mshr_cnt, V.concata( [f'{name}_fill_pvld && {bit( f"{name}__vlds", m )} && !{bit( f"{name}__filleds", m )} && {name}__tag_i{m} == {name}_fill_tag_i' for m in range(mshr_cnt)], 1 ) )
+
+    P()
+    P(f'// {name} drain' )
+    P(f'//' )
+    V.wirea( f'{name}__drains', mshr_cnt, V.concata( [f'{bit( f"{name}__vlds", m )} && {bit( f"{name}__filleds", m )}' for m in range(mshr_cnt)], 1 ) )
+    V.wirea( f'{name}_drain_pvld', 1, f'!{name}_fill_pvld && |{name}__drains' )
+    V.choose_eligible( f'{name}__drain_m', f'{name}__drains', mshr_cnt, f'{name}__drain_preferred_i', gen_preferred=True, adv_preferred=f'{name}_drain_pvld' )
+    V.muxa( f'{name}__drain_waiters', waiter_w, f'{name}__drain_m', [f'{name}__waiters{m}' for m in range(mshr_cnt)] )
+    V.choose_eligible( f'{name}__drain_waiter_i', f'{name}__drain_waiters', waiter_w, f'{name}__drain_waiter_preferred_i', gen_preferred=True, adv_preferred=f'{name}_drain_pvld' )
+    if req_cnt > 1: V.wirea( f'{name}_drain_req_i', req_i_w, f'{name}__drain_waiter_i[{waiter_i_w-1}:{req_id_w}]' )
+    V.wirea( f'{name}_drain_id', req_id_w, f'{name}__drain_waiter_i[{req_id_w-1}:0]' )
+    V.muxa( f'{name}_drain_dat', dat_w, f'{name}__drain_m', [f'{name}__dat{m}' for m in range(mshr_cnt)] )
+    V.binary_to_one_hot( f'{name}__drain_m', mshr_cnt, f'{name}__drain_one_hot', f'{name}_drain_pvld' )
+    V.binary_to_one_hot( f'{name}__drain_waiter_i', waiter_w, f'{name}__drain_waiter' )
+    V.wirea( f'{name}__drain_is_last', 1, f'({name}__drain_waiters & ~{name}__drain_waiter) == {waiter_w}\'d0' )
+
+    P()
+    P(f'// {name} updates' )
+    P(f'//' )
+    V.always_at_posedge()
+    P(f'    if ( !{V.reset_} ) begin' )
+    P(f'        {name}__vlds <= 0;' )
+    P(f'    end else begin' )
+    for m in range(mshr_cnt):
+        P(f'        if ( {bit( f"{name}__alloc_one_hot", m )} ) begin' )
+        P(f'            {bit( f"{name}__vlds", m )} <= 1\'b1;' )
+        P(f'            {bit( f"{name}__filleds", m )} <= 1\'b0;' )
+        P(f'            {name}__tag_i{m} <= {alloc_tag_is[m]};' )
+        waiters = f'{name}__joins{m}' if req_cnt > 1 else '0'
+        P(f'            {name}__waiters{m} <= {waiters};' )
+        P(f'        end else if ( {bit( f"{name}__fill_one_hot", m )} ) begin' )
+        P(f'            {bit( f"{name}__filleds", m )} <= 1\'b1;' )
+        P(f'            {name}__dat{m} <= {name}_fill_dat;' )
+        P(f'            if ( {name}__waiters{m} == {waiter_w}\'d0 ) {bit( f"{name}__vlds", m )} <= 1\'b0;' )
+        P(f'        end else if ( {bit( f"{name}__drain_one_hot", m )} ) begin' )
+        P(f'            {name}__waiters{m} <= {name}__waiters{m} & ~{name}__drain_waiter;' )
+        P(f'            if ( {name}__drain_is_last ) {bit( f"{name}__vlds", m )} <= 1\'b0;' )
+        P(f'        end else begin' )
+        P(f'            {name}__waiters{m} <= {name}__waiters{m} | {name}__joins{m};' )
+        P(f'        end' )
+    P(f'    end' )
+    P(f'end' )
+
+    P()
+    P(f'// {name} assertions' )
+    P(f'//' )
+    V.dassert_no_x( f'{name}__vlds' )
+    for r in range(req_cnt):
+        is_alloced = f'{name}__alloc_one_hot != 0' if req_cnt == 1 else f'{name}__alloc_req_vlds[{r}]'
+        V.dassert( f'!{name}_alloc{r}_pvld || {is_alloced}', f'{name} has no free MSHR for alloc{r}' )
+        V.dassert( f'!{name}_wait{r}_pvld || {name}__wait{r}_one_hot != 0', f'{name} has no MSHR for wait{r}' )
+    V.dassert( f'!{name}_fill_pvld || {name}__fill_one_hot != 0', f'{name} has no MSHR for fill' )
+    V.dassert( f'!{name}_drain_pvld || {name}__drain_waiters != 0', f'{name} has draining MSHR with no waiters' )
+
+    P()
+    P(f'// {name} idle' )
+    P(f'//' )
+    V.wirea( f'{name}_idle', 1, f'{name}__vlds == 0' )
+
+#--------------------------------------------------------------------
+# Generate a write-combining buffer (WCB) of wcb_cnt entries, each holding the byte-enabled data 
+# of one memory line on its way to memory.
+#
+# A write on {name}_in_pvld/addr/be/dat is merged into the entry that already holds its addr, 
+# else it takes a free entry. {name}_avail says that there is a free entry; writes must not be presented otherwise.
+# An entry goes to memory on {name}_out_pvld/addr/be/dat and is freed when {name}_out_prdy.
+# Entries go out only in cycles without an incoming write, so back-to-back writes to the same line coalesce.
+# {name}_lookup_hit says that some entry holds {name}_lookup_addr, so memory does not yet have its data.
+#--------------------------------------------------------------------
+def wcb( name, wcb_cnt, addr_w, dat_w ):
+    be_w = dat_w // 8
+
+    # bit e of a wcb_cnt-wide mask, which is a scalar when wcb_cnt is 1
+    def bit( mask, e ):
+        return mask if wcb_cnt == 1 else f'{mask}[{e}]'
+
+    P()
+    P(f'// {name} write-combining buffer: wcb_cnt={wcb_cnt} addr_w={addr_w} dat_w={dat_w}' )
+    P(f'//' )
+    V.reg( f'{name}__vlds', wcb_cnt )
+    for e in range(wcb_cnt):
+        V.reg( f'{name}__addr{e}', addr_w )
+        V.reg( f'{name}__be{e}', be_w )
+        V.reg( f'{name}__dat{e}', dat_w )
+
+    P()
+    P(f'// {name} in' )
+    P(f'//' )
+    V.wirea( f'{name}__in_merges', wcb_cnt, V.concata( [f'{name}_in_pvld && {bit( f"{name}__vlds", e )} && {name}__addr{e} == {name}_in_addr' for e in range(wcb_cnt)], 1 ) )
+    V.wirea( f'{name}__in_alloc_pvld', 1, f'{name}_in_pvld && {name}__in_merges == {wcb_cnt}\'d0' )
+    V.wirea( f'{name}__frees', wcb_cnt, f'~{name}__vlds' )
+    V.choose_eligible( f'{name}__in_e', f'{name}__frees', wcb_cnt, f'{name}__in_preferred_i', gen_preferred=True, adv_preferred=f'{name}__in_alloc_pvld' )
+    V.wirea( f'{name}_avail', 1, f'{name}__frees_any_vld' )
+    V.binary_to_one_hot( f'{name}__in_e', wcb_cnt, f'{name}__in_allocs', f'{name}__in_alloc_pvld' )
+    V.wirea( f'{name}__in_mask', dat_w, byte_mask( f'{name}_in_be', be_w ) )
+
+    P()
+    P(f'// {name} out' )
+    P(f'//' )
+    V.wirea( f'{name}_out_pvld', 1, f'!{name}_in_pvld && |{name}__vlds' )
+    V.choose_eligible( f'{name}__out_e', f'{name}__vlds', wcb_cnt, f'{name}__out_preferred_i', gen_preferred=True, adv_preferred=f'{name}_out_pvld && {name}_out_prdy' )
+    V.muxa( f'{name}_out_addr', addr_w, f'{name}__out_e', [f'{name}__addr{e}' for e in range(wcb_cnt)] )
+    V.muxa( f'{name}_out_be', be_w, f'{name}__out_e', [f'{name}__be{e}' for e in range(wcb_cnt)] )
+    V.muxa( f'{name}_out_dat', dat_w, f'{name}__out_e', [f'{name}__dat{e}' for e in range(wcb_cnt)] )
+    V.binary_to_one_hot( f'{name}__out_e', wcb_cnt, f'{name}__outs', f'{name}_out_pvld && {name}_out_prdy' )
+
+    P()
+    P(f'// {name} lookup' )
+    P(f'//' )
+    V.wirea( f'{name}_lookup_hit', 1, '|' + V.concata( [f'{bit( f"{name}__vlds", e )} && {name}__addr{e} == {name}_lookup_addr' for e in range(wcb_cnt)], 1 ) )
+
+    P()
+    P(f'// {name} updates' )
+    P(f'//' )
+    V.always_at_posedge()
+    P(f'    if ( !{V.reset_} ) begin' )
+    P(f'        {name}__vlds <= 0;' )
+    P(f'    end else begin' )
+    for e in range(wcb_cnt):
+        P(f'        if ( {bit( f"{name}__in_allocs", e )} ) begin' )
+        P(f'            {bit( f"{name}__vlds", e )} <= 1\'b1;' )
+        P(f'            {name}__addr{e} <= {name}_in_addr;' )
+        P(f'            {name}__be{e} <= {name}_in_be;' )
+        P(f'            {name}__dat{e} <= {name}_in_dat;' )
+        P(f'        end else if ( {bit( f"{name}__in_merges", e )} ) begin' )
+        P(f'            {name}__be{e} <= {name}__be{e} | {name}_in_be;' )
+        P(f'            {name}__dat{e} <= ({name}__dat{e} & ~{name}__in_mask) | ({name}_in_dat & {name}__in_mask);' )
+        P(f'        end else if ( {bit( f"{name}__outs", e )} ) begin' )
+        P(f'            {bit( f"{name}__vlds", e )} <= 1\'b0;' )
+        P(f'        end' )
+    P(f'    end' )
+    P(f'end' )
+
+    P()
+    P(f'// {name} assertions' )
+    P(f'//' )
+    V.dassert_no_x( f'{name}__vlds' )
+    V.dassert( f'!{name}__in_alloc_pvld || {name}_avail', f'{name} has no free entry for write' )
+    V.dassert( f'({name}__in_merges & ({name}__in_merges - {wcb_cnt}\'d1)) == {wcb_cnt}\'d0', f'{name} has duplicate entries for write' )
+
+    P()
+    P(f'// {name} idle' )
+    P(f'//' )
+    V.wirea( f'{name}_idle', 1, f'{name}__vlds == 0' )
+
 #--------------------------------------------------------------------
 # Generate cache testbench
 #--------------------------------------------------------------------
@@ -430,11 +1162,15 @@ def make_tb( p, module_name, inst_name ):
     mem_subword_w = p['mem_subword_w']
     tb_addr_cnt = p['tb_addr_cnt']
     tb_addr_id_w = p['tb_addr_id_w']
+    is_writable = not p['is_read_only']
 
     P(f'// Testbench for {module_name}.v with the following properties beyond those of the cache:' )
     P(f'// - issues a plusarg-selectable number of requests (default: 100)' )
     P(f'// - randomly selects an address from {tb_addr_cnt} possible random addresses (to induce hits)' )
     P(f'// - supplies a memory model that returns data that includes the memory address and line subword index for each line data' )
+    if is_writable:
+        P(f'// - randomly makes some requests writes with random byte enables, which the memory model and the expected data follow' )
+        P(f'// - never has a write outstanding with another request to the same address' )
     P(f'// - checks that returned data from cache matches the expected data for the line' )
     P(f'// - randomly adds bubbles in the request stream' )
     P(f'// - randomly stalls the memory requests out of the cache' )
@@ -461,86 +1197,167 @@ def make_tb( p, module_name, inst_name ):
     P() 
     P( f'// REQUESTS' )
     P( f'//' )
-    V.reg( 'req_in_use_mask', req_id_cnt )
-    V.reg( 'req_got_status_mask', req_id_cnt )
+    ls = lanes( p )
+    ts = [ '' if p['req_cnt'] == 1 else f'lane{r}_' for r in range(p['req_cnt']) ]      # prefix of each lane's tb signals
+    for t in ts:
+        V.reg( f'{t}req_in_use_mask', req_id_cnt )
+        V.reg( f'{t}req_got_status_mask', req_id_cnt )
     addrs = []
     dats_expected = []
+    addr_vals = []
     for i in range(tb_addr_cnt):
-        addr = S.rand_bits( req_addr_w )
+        if not is_writable:
+            addr = S.rand_bits( req_addr_w )
+        else:
+            # addresses are unique and come in groups that share a memory line, so their writes can combine
+            if i % mem_subword_cnt == 0: 
+                line = S.rand_bits( mem_addr_w )
+                while (line << mem_subword_w) in addr_vals: line = S.rand_bits( mem_addr_w )
+            addr = (line << mem_subword_w) | (i % mem_subword_cnt)
         V.wirea( f'addr{i}', req_addr_w, f'{req_addr_w}\'h{addr:01x}' )
-        V.wirea( f'dat_expected{i}', dat_w, f'{dat_w}\'h{addr:01x}' )
+        if is_writable:
+            V.reg( f'dat_expected{i}', dat_w )
+        else:
+            V.wirea( f'dat_expected{i}', dat_w, f'{dat_w}\'h{addr:01x}' )
         addrs.append( f'addr{i}' )
         dats_expected.append( f'dat_expected{i}' )
-    req_addr_is = []
-    for i in range(req_id_cnt):
-        V.reg( f'req{i}_addr_i', tb_addr_id_w )
-        req_addr_is.append( f'req{i}_addr_i' )
-    P()
-    V.iface_reg( f'{u2c}_p', p['unit2cache'], True, False )
-    P( f'wire   {u2c}_p_prdy = {u2c}_prdy;' )
-    P( f'assign {u2c}_pvld = {u2c}_p_pvld;' )
-    P( f'assign {u2c}_id = {u2c}_p_id;' )
-    P( f'assign {u2c}_addr = {u2c}_p_addr;' )
-    V.reg( 'req_cnt', 32 )
-    V.wirea( 'req_elig', req_id_cnt, f'~req_in_use_mask' )
-    V.tb_randbits( 'should_delay_req_rand', 2 )
-    V.wirea( 'should_delay_req', 1, f'should_delay_req_rand == 0' )
-    V.wirea( 'can_issue_req', 1, f'req_cnt < req_cnt_max && !should_delay_req && (!{u2c}_p_pvld || {u2c}_p_prdy)' )
-    V.choose_eligible( 'req_id_chosen', f'req_elig', req_id_cnt, f'req_preferred', gen_preferred=True, adv_preferred='can_issue_req' )
-    P( f'// {V.vlint_off_width}' )
-    V.binary_to_one_hot( f'req_id_chosen',   req_id_cnt, 'req_issued_mask',            f'({V.reset_} && can_issue_req && req_elig_any_vld)' )
-    V.binary_to_one_hot( f'{c2u}_status_id', req_id_cnt, 'req_status_mask',            f'{c2u}_status_pvld' )
-    V.binary_to_one_hot( f'{c2u}_status_id', req_id_cnt, 'req_status_is_hit_mask',     f'{c2u}_status_pvld && {c2u}_status_is_hit' )
-    V.binary_to_one_hot( f'{c2u}_status_id', req_id_cnt, 'req_status_is_miss_mask',    f'{c2u}_status_pvld && {c2u}_status_is_miss' )
-    V.binary_to_one_hot( f'{c2u}_status_id', req_id_cnt, 'req_status_must_retry_mask', f'{c2u}_status_pvld && {c2u}_status_must_retry' )
-    V.binary_to_one_hot( f'{c2u}_dat_id',    req_id_cnt, 'rdat_mask',                  f'{c2u}_dat_pvld' )
-    P( f'// {V.vlint_on_width}' )
-    V.tb_randbits( 'req_addr_i', tb_addr_id_w )
-    V.muxa( 'req_addr', req_addr_w, 'req_addr_i', addrs )
-    P()
-    V.always_at_posedge();
-    P( f'    if ( !{V.reset_} ) begin' )
-    P( f'        req_in_use_mask <= 0;' )
-    P( f'        {u2c}_p_pvld <= 0;' )
-    P( f'        req_cnt <= 0;' )
-    P( f'    end else begin' )
-    P( f'        if ( can_issue_req && req_elig_any_vld ) begin' )
-    P( f'            {u2c}_p_pvld <= 1;' )
-    P( f'            {u2c}_p_id <= req_id_chosen;' )
-    P( f'            {u2c}_p_addr <= req_addr;' )
-    P( f'            req_cnt <= req_cnt + 1;' )
-    for i in range(req_id_cnt):
-        P( f'            if ( req_id_chosen == {i} ) req{i}_addr_i <= req_addr_i;' )
-    P( f'        end else if ( {u2c}_p_pvld && {u2c}_p_prdy ) begin' )
-    P( f'            {u2c}_p_pvld <= 0;' )
-    P( f'        end' ) 
-    P( f'        req_got_status_mask <= (req_got_status_mask & ~req_issued_mask) | req_status_mask;' )
-    P( f'        req_in_use_mask     <= (req_in_use_mask & ~(rdat_mask | req_status_must_retry_mask)) | req_issued_mask;' )
-    P( f'        if ( {cache}_idle && req_cnt === req_cnt_max && req_in_use_mask === 0 ) begin' )
-    P( f'            $display( "PASS" );' )
-    P( f'            $finish;' )
-    P( f'        end' )
-    P( f'    end' )
-    P( f'end' )
-    V.dassert( f'{cache}_idle === 1 || (|req_in_use_mask) === 1', 'should be non-idle only if requests outstanding' )
-    V.rega( f'{u2c}_d_pvld', 1, f'{u2c}_pvld' )
-    V.rega( f'{m2c}_d_pvld', 1, f'{m2c}_pvld' )
-    V.dassert( f'{cache}_idle === 0 || ({u2c}_d_pvld == 0 && {c2m}_pvld === 0 && {m2c}_d_pvld === 0)', 'should be non-idle when interfaces are busy' )
-    V.dassert( f'(req_status_mask & req_in_use_mask) === req_status_mask', 'status for req not outstanding' )
-    V.dassert( f'(req_status_mask & req_got_status_mask) === 0', 'status received twice' )
-    V.dassert( f'(req_status_is_hit_mask & rdat_mask) === req_status_is_hit_mask', 'is_hit with no data' )
-    V.dassert( f'(req_status_is_miss_mask & rdat_mask) === 0', 'is_miss with data at same time' )
-    V.dassert( f'(rdat_mask & req_in_use_mask) === rdat_mask', 'dat returned for req not outstanding' )
-    V.muxa( f'rdat_req_addr_i', tb_addr_id_w, f'{c2u}_dat_id', req_addr_is )
-    V.muxa( f'rdat_dat_expected', dat_w, f'rdat_req_addr_i', dats_expected )
-    V.dassert( f'!{c2u}_dat_pvld || ({c2u}_dat_dat === rdat_dat_expected)', 'unexpected dat returned' )
+        addr_vals.append( addr )
+    in_use_any = ' | '.join( [f'(|{t}req_in_use_mask)' for t in ts] )
+    if p['req_cnt'] > 1: in_use_any = f'({in_use_any})'
+    all_done = ' && '.join( [f'{t}req_cnt === req_cnt_max && {t}req_in_use_mask === 0' for t in ts] )
+    for r, l in enumerate( ls ):
+        t = ts[r]
+        req_addr_is = []
+        for i in range(req_id_cnt):
+            V.reg( f'{t}req{i}_addr_i', tb_addr_id_w )
+            req_addr_is.append( f'{t}req{i}_addr_i' )
+        if is_writable:
+            for i in range(req_id_cnt):
+                V.reg( f'{t}req{i}_be', p['be_w'] )
+                V.reg( f'{t}req{i}_dat', dat_w )
+            V.reg( f'{t}req_is_wr_mask', req_id_cnt )
+        P()
+        V.iface_reg( f'{u2c}{l}_p', p['unit2cache'], True, False )
+        P( f'wire   {u2c}{l}_p_prdy = {u2c}{l}_prdy;' )
+        P( f'assign {u2c}{l}_pvld = {u2c}{l}_p_pvld;' )
+        P( f'assign {u2c}{l}_id = {u2c}{l}_p_id;' )
+        P( f'assign {u2c}{l}_addr = {u2c}{l}_p_addr;' )
+        if is_writable:
+            P( f'assign {u2c}{l}_is_wr = {u2c}{l}_p_is_wr;' )
+            P( f'assign {u2c}{l}_be = {u2c}{l}_p_be;' )
+            P( f'assign {u2c}{l}_dat = {u2c}{l}_p_dat;' )
+        V.reg( f'{t}req_cnt', 32 )
+        V.wirea( f'{t}req_elig', req_id_cnt, f'~{t}req_in_use_mask' )
+        V.tb_randbits( f'{t}should_delay_req_rand', 2 )
+        V.wirea( f'{t}should_delay_req', 1, f'{t}should_delay_req_rand == 0' )
+        can_issue_wr = ''
+        if is_writable:
+            # a write waits for all requests to its address, and a read waits for a write to its address
+            V.tb_randbits( f'{t}req_addr_i', tb_addr_id_w )
+            V.tb_randbits( f'{t}req_is_wr_rand', 2 )
+            V.tb_randbits( f'{t}req_be', p['be_w'] )
+            V.tb_randbits( f'{t}req_wr_dat', dat_w )
+            for i in range(tb_addr_cnt):
+                V.wirea( f'{t}addr{i}_reqs', req_id_cnt, V.concata( [f'{t}req{j}_addr_i == {i}' for j in range(req_id_cnt)], 1 ) )
+            V.wirea( f'{t}addrs_busy', tb_addr_cnt, V.concata( [f'|({t}addr{i}_reqs & {t}req_in_use_mask)' for i in range(tb_addr_cnt)], 1 ) )
+            V.wirea( f'{t}addrs_wr_busy', tb_addr_cnt, V.concata( [f'|({t}addr{i}_reqs & {t}req_in_use_mask & {t}req_is_wr_mask)' for i in range(tb_addr_cnt)], 1 ) )
+            V.wirea( f'{t}req_is_wr', 1, f'{t}req_is_wr_rand == 0 && !{t}addrs_busy[{t}req_addr_i]' )
+            can_issue_wr = f' && ({t}req_is_wr || !{t}addrs_wr_busy[{t}req_addr_i])'
+        V.wirea( f'{t}can_issue_req', 1, f'{t}req_cnt < req_cnt_max && !{t}should_delay_req && (!{u2c}{l}_p_pvld || {u2c}{l}_p_prdy){can_issue_wr}' )
+        V.choose_eligible( f'{t}req_id_chosen', f'{t}req_elig', req_id_cnt, f'{t}req_preferred', gen_preferred=True, adv_preferred=f'{t}can_issue_req' )
+        P( f'// {V.vlint_off_width}' )
+        V.binary_to_one_hot( f'{t}req_id_chosen',    req_id_cnt, f'{t}req_issued_mask',            f'({V.reset_} && {t}can_issue_req && {t}req_elig_any_vld)' )
+        V.binary_to_one_hot( f'{c2u}{l}_status_id', req_id_cnt, f'{t}req_status_mask',            f'{c2u}{l}_status_pvld' )
+        V.binary_to_one_hot( f'{c2u}{l}_status_id', req_id_cnt, f'{t}req_status_is_hit_mask',     f'{c2u}{l}_status_pvld && {c2u}{l}_status_is_hit' )
+        V.binary_to_one_hot( f'{c2u}{l}_status_id', req_id_cnt, f'{t}req_status_is_miss_mask',    f'{c2u}{l}_status_pvld && {c2u}{l}_status_is_miss' )
+        V.binary_to_one_hot( f'{c2u}{l}_status_id', req_id_cnt, f'{t}req_status_must_retry_mask', f'{c2u}{l}_status_pvld && {c2u}{l}_status_must_retry' )
+        V.binary_to_one_hot( f'{c2u}{l}_dat_id',    req_id_cnt, f'{t}rdat_mask',                  f'{c2u}{l}_dat_pvld' )
+        P( f'// {V.vlint_on_width}' )
+        if is_writable: 
+            V.wirea( f'{t}req_wr_done_mask', req_id_cnt, f'{t}req_status_is_hit_mask & {t}req_is_wr_mask' )
+        else:
+            V.tb_randbits( f'{t}req_addr_i', tb_addr_id_w )
+        V.muxa( f'{t}req_addr', req_addr_w, f'{t}req_addr_i', addrs )
+        P()
+        V.always_at_posedge();
+        P( f'    if ( !{V.reset_} ) begin' )
+        P( f'        {t}req_in_use_mask <= 0;' )
+        if is_writable: P( f'        {t}req_is_wr_mask <= 0;' )
+        P( f'        {u2c}{l}_p_pvld <= 0;' )
+        P( f'        {t}req_cnt <= 0;' )
+        P( f'    end else begin' )
+        P( f'        if ( {t}can_issue_req && {t}req_elig_any_vld ) begin' )
+        P( f'            {u2c}{l}_p_pvld <= 1;' )
+        P( f'            {u2c}{l}_p_id <= {t}req_id_chosen;' )
+        P( f'            {u2c}{l}_p_addr <= {t}req_addr;' )
+        if is_writable:
+            P( f'            {u2c}{l}_p_is_wr <= {t}req_is_wr;' )
+            P( f'            {u2c}{l}_p_be <= {t}req_be;' )
+            P( f'            {u2c}{l}_p_dat <= {t}req_wr_dat;' )
+        P( f'            {t}req_cnt <= {t}req_cnt + 1;' )
+        for i in range(req_id_cnt):
+            P( f'            if ( {t}req_id_chosen == {i} ) {t}req{i}_addr_i <= {t}req_addr_i;' )
+            if is_writable:
+                P( f'            if ( {t}req_id_chosen == {i} ) {t}req{i}_be <= {t}req_be;' )
+                P( f'            if ( {t}req_id_chosen == {i} ) {t}req{i}_dat <= {t}req_wr_dat;' )
+        P( f'        end else if ( {u2c}{l}_p_pvld && {u2c}{l}_p_prdy ) begin' )
+        P( f'            {u2c}{l}_p_pvld <= 0;' )
+        P( f'        end' ) 
+        P( f'        {t}req_got_status_mask <= ({t}req_got_status_mask & ~{t}req_issued_mask) | {t}req_status_mask;' )
+        if is_writable:
+            P( f'        {t}req_is_wr_mask      <= ({t}req_is_wr_mask & ~{t}req_issued_mask) | ({t}req_is_wr ? {t}req_issued_mask : {req_id_cnt}\'d0);' )
+            P( f'        {t}req_in_use_mask     <= ({t}req_in_use_mask & ~({t}rdat_mask | {t}req_status_must_retry_mask | {t}req_wr_done_mask)) | {t}req_issued_mask;' )
+        else:
+            P( f'        {t}req_in_use_mask     <= ({t}req_in_use_mask & ~({t}rdat_mask | {t}req_status_must_retry_mask)) | {t}req_issued_mask;' )
+        if r == len( ls )-1:
+            P( f'        if ( {cache}_idle && {all_done} ) begin' )
+            P( f'            $display( "PASS" );' )
+            P( f'            $finish;' )
+            P( f'        end' )
+        P( f'    end' )
+        P( f'end' )
+        if is_writable:
+            # a done write updates the expected data of its address
+            V.muxa( f'{t}wr_done_addr_i', tb_addr_id_w, f'{c2u}{l}_status_id', req_addr_is )
+            V.muxa( f'{t}wr_done_be', p['be_w'], f'{c2u}{l}_status_id', [f'{t}req{i}_be' for i in range(req_id_cnt)] )
+            V.muxa( f'{t}wr_done_dat', dat_w, f'{c2u}{l}_status_id', [f'{t}req{i}_dat' for i in range(req_id_cnt)] )
+            V.wirea( f'{t}wr_done_bits', dat_w, byte_mask( f'{t}wr_done_be', p['be_w'] ) )
+            V.always_at_posedge()
+            P( f'    if ( !{V.reset_} ) begin' )
+            for i in range(tb_addr_cnt): P( f'        dat_expected{i} <= {dat_w}\'h{addr_vals[i]:01x};' )
+            P( f'    end else if ( |{t}req_wr_done_mask ) begin' )
+            for i in range(tb_addr_cnt): 
+                P( f'        if ( {t}wr_done_addr_i == {i} ) dat_expected{i} <= (dat_expected{i} & ~{t}wr_done_bits) | ({t}wr_done_dat & {t}wr_done_bits);' )
+            P( f'    end' )
+            P( f'end' )
+        # a writable cache may still be writing to memory after its last request is done
+        if r == 0 and not is_writable: V.dassert( f'{cache}_idle === 1 || {in_use_any} === 1', 'should be non-idle only if requests outstanding' )
+        V.rega( f'{u2c}{l}_d_pvld', 1, f'{u2c}{l}_pvld' )
+        if r == 0: V.rega( f'{m2c}_d_pvld', 1, f'{m2c}_pvld' )
+        V.dassert( f'{cache}_idle === 0 || ({u2c}{l}_d_pvld == 0 && {c2m}_pvld === 0 && {m2c}_d_pvld === 0)', 'should be non-idle when interfaces are busy' )
+        V.dassert( f'({t}req_status_mask & {t}req_in_use_mask) === {t}req_status_mask', 'status for req not outstanding' )
+        V.dassert( f'({t}req_status_mask & {t}req_got_status_mask) === 0', 'status received twice' )
+        if is_writable:
+            V.dassert( f'({t}req_status_is_hit_mask & ~{t}req_is_wr_mask & {t}rdat_mask) === ({t}req_status_is_hit_mask & ~{t}req_is_wr_mask)', 'is_hit with no data' )
+            V.dassert( f'({t}req_status_is_miss_mask & {t}req_is_wr_mask) === 0', 'is_miss for write' )
+            V.dassert( f'({t}rdat_mask & {t}req_is_wr_mask) === 0', 'dat returned for write' )
+        else:
+            V.dassert( f'({t}req_status_is_hit_mask & {t}rdat_mask) === {t}req_status_is_hit_mask', 'is_hit with no data' )
+        V.dassert( f'({t}req_status_is_miss_mask & {t}rdat_mask) === 0', 'is_miss with data at same time' )
+        V.dassert( f'({t}rdat_mask & {t}req_in_use_mask) === {t}rdat_mask', 'dat returned for req not outstanding' )
+        V.muxa( f'{t}rdat_req_addr_i', tb_addr_id_w, f'{c2u}{l}_dat_id', req_addr_is )
+        V.muxa( f'{t}rdat_dat_expected', dat_w, f'{t}rdat_req_addr_i', dats_expected )
+        V.dassert( f'!{c2u}{l}_dat_pvld || ({c2u}{l}_dat_dat === {t}rdat_dat_expected)', 'unexpected dat returned' )
 
     P()
     P( f'// MEM RETURNS - just use addr to construct unique data for now' )
     P( f'//' )
     V.tb_randbits( f'{c2m}_prdy_p', 1 )
     P( f'assign {c2m}_prdy = !{V.reset_} || {c2m}_prdy_p;' )
-    P( f'assign {m2c}_pvld = {c2m}_pvld && {c2m}_prdy;' )
+    if is_writable:
+        P( f'assign {m2c}_pvld = {c2m}_pvld && {c2m}_prdy && !{c2m}_is_wr;' )
+    else:
+        P( f'assign {m2c}_pvld = {c2m}_pvld && {c2m}_prdy;' )
     P( f'assign {m2c}_tag_id = {c2m}_tag_id;' )
     dat_s = ''
     extra_w = dat_w - mem_addr_w - mem_subword_w
@@ -548,7 +1365,34 @@ def make_tb( p, module_name, inst_name ):
         comma = ',' if dat_s != '' else ''
         extra = f'{extra_w}\'d0,' if extra_w > 0 else ''
         dat_s = f'{extra}{c2m}_addr,{mem_subword_w}\'d{i}{comma}{dat_s}'
-    P( f'assign {m2c}_dat = {{{dat_s}}};' )
+    if not is_writable:
+        P( f'assign {m2c}_dat = {{{dat_s}}};' )
+    else:
+        # memory holds the written data of each address; other data is still made from the address
+        be_w = p['be_w']
+        V.wirea( f'{m2c}_init_dat', p['mem_dat_w'], f'{{{dat_s}}}' )
+        for i in range(tb_addr_cnt):
+            V.reg( f'mem_dat{i}', dat_w )
+            s_i = addr_vals[i] % mem_subword_cnt
+            V.wirea( f'mem_dat{i}_is_wr', 1, f'{c2m}_pvld && {c2m}_prdy && {c2m}_is_wr && {c2m}_addr == {mem_addr_w}\'h{addr_vals[i] >> mem_subword_w:01x}' )
+            V.wirea( f'mem_dat{i}_wr_be', be_w, f'{c2m}_be[{(s_i+1)*be_w-1}:{s_i*be_w}]' )
+            V.wirea( f'mem_dat{i}_wr_bits', dat_w, byte_mask( f'mem_dat{i}_wr_be', be_w ) )
+        V.always_at_posedge()
+        P( f'    if ( !{V.reset_} ) begin' )
+        for i in range(tb_addr_cnt): P( f'        mem_dat{i} <= {dat_w}\'h{addr_vals[i]:01x};' )
+        P( f'    end else begin' )
+        for i in range(tb_addr_cnt):
+            s_i = addr_vals[i] % mem_subword_cnt
+            P( f'        if ( mem_dat{i}_is_wr ) mem_dat{i} <= (mem_dat{i} & ~mem_dat{i}_wr_bits) | ({c2m}_dat[{(s_i+1)*dat_w-1}:{s_i*dat_w}] & mem_dat{i}_wr_bits);' )
+        P( f'    end' )
+        P( f'end' )
+        subwords = []
+        for s in range(mem_subword_cnt):
+            expr = f'{m2c}_init_dat[{(s+1)*dat_w-1}:{s*dat_w}]'
+            for i in range(tb_addr_cnt):
+                if addr_vals[i] % mem_subword_cnt == s:
+                    expr = f'({c2m}_addr == {mem_addr_w}\'h{addr_vals[i] >> mem_subword_w:01x}) ? mem_dat{i} : {expr}'
+            subwords.append( expr )
+        P( f'assign {m2c}_dat = {V.concata( subwords, dat_w )};' )
 
-    P()
-    P(f'endmodule // tb_{module_name}' )
+    V.module_footer( f'tb_{module_name}' )
@@ -24,7 +24,7 @@ import S
 import V
 import cache
 
-P = print
+P = V.P
 
 def reinit():
     global params;
@@ -23,47 +23,95 @@
 import S
 import V
 
-P = print
+P = V.P
 
 #--------------------------------------------------------------------
 # Check p and fill in defaults
 #--------------------------------------------------------------------
 def check( p ):
     if 'd' not in p: S.die( 'fifo.make: d not specified' )
-    if p['d'] < 1: S.die( 'fifo.make: d must be >= 1' )
+    if p['d'] < 0: S.die( 'fifo.make: d must be >= 0' )
     if 'w' not in p: S.die( 'fifo.make: w not specified' )
     if p['w'] < 1: S.die( 'fifo.make: w must be >= 1' )
 
-    if 'is_async' in p and p['is_async']: S.die( f'fifo.check: is_async=True is not currently allowed' )
-    p['is_async'] = False
+    if 'is_async' not in p: p['is_async'] = False
+    is_async = p['is_async']
     if 'wr_clk' not in p: p['wr_clk'] = V.clk
-    if 'rd_clk' not in p: p['rd_clk'] = V.clk
+    if 'rd_clk' not in p: p['rd_clk'] = 'rd_clk' if is_async else V.clk
     if 'wr_reset_' not in p: p['wr_reset_'] = V.reset_
-    if 'rd_reset_' not in p: p['rd_reset_'] = V.reset_
+    if 'rd_reset_' not in p: p['rd_reset_'] = 'rd_reset_' if is_async else V.reset_
+    if is_async:
+        if p['rd_clk'] == p['wr_clk']: S.die( f'fifo.check: is_async=True requires rd_clk to differ from wr_clk' )
+        if p['rd_reset_'] == p['wr_reset_']: S.die( f'fifo.check: is_async=True requires rd_reset_ to differ from wr_reset_' )
+        if p['d'] < 2 or not V.is_pow2( p['d'] ): S.die( f'fifo.check: is_async=True requires d to be a power of 2 >= 2' )
+    elif p['rd_clk'] != p['wr_clk']:
+        S.die( f'fifo.check: rd_clk may differ from wr_clk only if is_async=True' )
+    if 'sync_cnt' not in p: p['sync_cnt'] = 2
+    if p['sync_cnt'] < 2: S.die( f'fifo.check: sync_cnt must be >= 2' )
+    if 'afull_thresh' not in p: p['afull_thresh'] = 0
+    if 'aempty_thresh' not in p: p['aempty_thresh'] = 0
+    if (p['afull_thresh'] != 0 or p['aempty_thresh'] != 0) and not is_async: 
+        S.die( f'fifo.check: afull_thresh and aempty_thresh currently require is_async=True' )
+    if is_async and (p['afull_thresh'] < 0 or p['afull_thresh'] > p['d']): S.die( f'fifo.check: afull_thresh must be between 0 and d' )
+    if is_async and (p['aempty_thresh'] < 0 or p['aempty_thresh'] >= p['d']): S.die( f'fifo.check: aempty_thresh must be between 0 and d-1' )
 
     if 'wr' not in p: p['wr'] = 'wr'
     if 'rd' not in p: p['rd'] = 'rd'
 
+    if 'ram_kind' not in p: p['ram_kind'] = 'ff'
+    if p['ram_kind'] not in [ 'ff', 'ra2' ]: S.die( f'fifo.check: ram_kind must be ff or ra2' )
+    if p['ram_kind'] == 'ra2' and p['d'] < 2: S.die( f'fifo.check: ram_kind=ra2 requires d >= 2' )
+
+    if 'wr_lane_cnt' not in p: p['wr_lane_cnt'] = 1
+    if 'rd_lane_cnt' not in p: p['rd_lane_cnt'] = 1
+    if p['wr_lane_cnt'] < 1 or p['rd_lane_cnt'] < 1: S.die( f'fifo.check: wr_lane_cnt and rd_lane_cnt must be >= 1' )
+    if p['wr_lane_cnt'] > 1 or p['rd_lane_cnt'] > 1:
+        if is_async or p['ram_kind'] != 'ff': S.die( f'fifo.check: wr_lane_cnt > 1 or rd_lane_cnt > 1 currently requires is_async=False and ram_kind=ff' )
+        if p['d'] < max( p['wr_lane_cnt'], p['rd_lane_cnt'] ): S.die( f'fifo.check: d must be >= wr_lane_cnt and rd_lane_cnt' )
+
+    if 'mode' not in p: p['mode'] = 'fifo'
+    mode = p['mode']
+    if mode not in [ 'fifo', 'bypass', 'skid', 'pipe' ]: S.die( f'fifo.check: mode must be fifo, bypass, skid, or pipe' )
+    if mode != 'fifo' or p['d'] == 0:
+        if is_async or p['ram_kind'] != 'ff' or p['wr_lane_cnt'] != 1 or p['rd_lane_cnt'] != 1: 
+            S.die( f'fifo.check: mode={mode} with d={p["d"]} requires is_async=False, ram_kind=ff, and one lane on each side' )
+    if mode == 'bypass' and p['d'] < 1: S.die( f'fifo.check: mode=bypass requires d >= 1' )
+    if mode == 'skid' and p['d'] != 2: S.die( f'fifo.check: mode=skid requires d=2' )
+    if mode == 'pipe' and p['d'] != 1: S.die( f'fifo.check: mode=pipe requires d=1' )
+
+    if 'with_perf' not in p: p['with_perf'] = False
+
 #--------------------------------------------------------------------
 # Instantiates a fifo inline and arranges with V.py to have it generated during module_footer().
+#
+# p is not modified. The default module name is {V.module_name}_fifo_{d}x{w} plus a suffix for 
+# each of mode, ram_kind, is_async, and the lane counts that is not the default, and stages 
+# with the same params share one module. The default inst_name is u_{oname}_fifo.
 #--------------------------------------------------------------------
 def stage( p, iname, oname, sigs, pvld='pvld', prdy='prdy', module_name='', inst_name='', with_wr_prdy=True, do_decl=True ):
+    p = p.copy()
     w = V.iface_width( sigs )
     if 'w' in p and p['w'] != w: S.die( f'fifo.stage: width w does not match expected sigs width of {w}' )
     p['w'] = w
 
-    if 'module_name' == '': module_name = f'{V.module_name}_fifo_{d}x{w}'
-    if 'wr' not in p and iname != '': p['wr'] = iname
-    if 'rd' not in p and oname != '': p['rd'] = oname
-
     check( p )
 
-    if inst_name == '': inst_name = 'u_' + module_name
+    if module_name == '': 
+        module_name = f'{V.module_name}_fifo_{p["d"]}x{w}'
+        if p['mode'] != 'fifo':   module_name += f'_{p["mode"]}'
+        if p['ram_kind'] != 'ff': module_name += f'_{p["ram_kind"]}'
+        if p['is_async']:         module_name += f'_async'
+        if p['wr_lane_cnt'] != 1 or p['rd_lane_cnt'] != 1: module_name += f'_{p["wr_lane_cnt"]}to{p["rd_lane_cnt"]}'
+    post_modules = V.post_modules
+    if module_name in post_modules and post_modules[module_name]['params'] != p: 
+        S.die( f'fifo.stage: {module_name} is already used by a fifo with different params, so please supply a module_name' )
+
+    if inst_name == '': inst_name = f'u_{oname}_fifo'
 
-    inst( p, inst_name, iname, oname, sigs, pvld, prdy, with_wr_prdy=with_wr_prdy, do_decl=do_decl )
+    inst( p, module_name, inst_name, iname, oname, sigs, pvld, prdy, with_wr_prdy=with_wr_prdy, do_decl=do_decl )
 
-    # add a callback to make() below to get the fifo generated during module_footer()
-    V.post_modules[module_name] = { 'generator': make, 'p': p.copy() }
+    # add a callback to make() below to get the fifo generated once during module_footer()
+    post_modules[module_name] = { 'generator': make, 'params': p }
 
 #--------------------------------------------------------------------
 # Instantiates a fifo that is known to exist
@@ -76,8 +124,6 @@ def inst( p, module_name, inst_name, iname, oname, sigs, pvld='pvld', prdy='prdy
     P(f'// {d}x{w} fifo for: {names}' )
     P(f'//' )
 
-    ins = ''
-    outs = ''
     iname_pvld = f'{iname}_{pvld}'
     iname_prdy = f'{iname}_{prdy}'
     oname_pvld = f'{oname}_{pvld}'
@@ -86,14 +132,21 @@ def inst( p, module_name, inst_name, iname, oname, sigs, pvld='pvld', prdy='prdy
         if do_decl: V.wire( iname_prdy, 1 )
     else:
         iname_prdy = ''
-    if do_decl: V.wire( oname_pvld, 1 )
-    if do_decl: V.wire( oname_prdy, 1 )
+    wr_afull = ''
+    rd_aempty = ''
+    if p['afull_thresh'] != 0:
+        if do_decl: V.wire( f'{iname}_afull', 1 )
+        wr_afull = f', .{p["wr"]}_afull({iname}_afull)'
+    if p['aempty_thresh'] != 0:
+        if do_decl: V.wire( f'{oname}_aempty', 1 )
+        rd_aempty = f', .{p["rd"]}_aempty({oname}_aempty)'
+    rd_lane_cnt = p['rd_lane_cnt']
+    if do_decl: V.wire( oname_pvld, rd_lane_cnt )
+    if do_decl: V.wire( oname_prdy, rd_lane_cnt )
     for sig in sigs:
-        if do_decl: V.wire( f'{oname}_{sig}', sigs[sig] )
-        if ins  != '': ins  += ', '
-        if outs != '': outs += ', '
-        ins  += f'{iname}_{sig}'
-        outs += f'{oname}_{sig}'
+        if do_decl: V.wire( f'{oname}_{sig}', sigs[sig]*rd_lane_cnt )
+    ins  = pd_sigs( iname, sigs, p['wr_lane_cnt'] )
+    outs = pd_sigs( oname, sigs, rd_lane_cnt )
     
     wr_clk    = p['wr_clk']
     wr_reset_ = p['wr_reset_']
@@ -101,14 +154,29 @@ def inst( p, module_name, inst_name, iname, oname, sigs, pvld='pvld', prdy='prdy
     if p['is_async']:
         rd_clk    = p['rd_clk']
         rd_reset_ = p['rd_reset_']
-        P(f'                        .{rd_clk}({rd_clk}), .{rd_reset_}({rd_reset_},' )
+        P(f'                        .{rd_clk}({rd_clk}), .{rd_reset_}({rd_reset_}),' )
     wr = p['wr']
     rd = p['rd']
-    P(f'                        .{wr}_pvld({iname_pvld}), .{wr}_prdy({iname_prdy}), .{wr}_pd('+'{'+f'{ins}'+'}),' )
-    P(f'                        .{rd}_pvld({oname_pvld}), .{rd}_prdy({oname_prdy}), .{rd}_pd('+'{'+f'{outs}'+'}) );' )
+    P(f'                        .{wr}_pvld({iname_pvld}), .{wr}_prdy({iname_prdy}), .{wr}_pd('+'{'+f'{ins}'+'})'+f'{wr_afull},' )
+    P(f'                        .{rd}_pvld({oname_pvld}), .{rd}_prdy({oname_prdy}), .{rd}_pd('+'{'+f'{outs}'+'})'+f'{rd_aempty} );' )
     if do_dprint:
         V.iface_dprint( iname, sigs, f'{wr_reset_} && {iname_pvld} && {iname_prdy}' )
-        V.iface_dprint( oname, sigs, f'{wr_reset_} && {oname_pvld} && {iname_prdy}' )
+        with V.ClockDomain( p['rd_clk'], p['rd_reset_'] ):
+            V.iface_dprint( oname, sigs, f'{p["rd_reset_"]} && {oname_pvld} && {oname_prdy}' )
+
+#--------------------------------------------------------------------
+# Returns the comma-separated {name}_{sig} signals that make up a fifo pd.
+# With lane_cnt > 1, each {name}_{sig} holds lane_cnt lanes (lane 0 in the LSBs),
+# and the pd is ordered lane by lane so that each lane of the pd is a full entry.
+#--------------------------------------------------------------------
+def pd_sigs( name, sigs, lane_cnt ):
+    if lane_cnt == 1: return ', '.join( f'{name}_{sig}' for sig in sigs )
+    lanes = []
+    for i in range( lane_cnt-1, -1, -1 ):
+        for sig in sigs:
+            w = sigs[sig]
+            lanes.append( f'{name}_{sig}[{i*w+w-1}:{i*w}]' )
+    return ', '.join( lanes )
 
 #--------------------------------------------------------------------
 # Generates a full fifo module.
@@ -132,29 +200,276 @@ def make( p, module_name, with_file_header=True ):
         V.input( rd_clk,      1 )
         V.input( rd_reset_,   1 )
    
-    V.input(  f'{wr}_pvld',   1 )
+    wr_lane_cnt = p['wr_lane_cnt']
+    rd_lane_cnt = p['rd_lane_cnt']
+    V.input(  f'{wr}_pvld',   wr_lane_cnt )
     V.output( f'{wr}_prdy',   1 )
-    V.input(  f'{wr}_pd',     p['w'] )
+    V.input(  f'{wr}_pd',     p['w']*wr_lane_cnt )
+    if p['afull_thresh'] != 0: V.output( f'{wr}_afull', 1 )
     
-    V.output( f'{rd}_pvld',   1 )
-    V.input(  f'{rd}_prdy',   1 )
-    V.output( f'{rd}_pd',     p['w'] )
+    V.output( f'{rd}_pvld',   rd_lane_cnt )
+    V.input(  f'{rd}_prdy',   rd_lane_cnt )
+    V.output( f'{rd}_pd',     p['w']*rd_lane_cnt )
+    if p['aempty_thresh'] != 0: V.output( f'{rd}_aempty', 1 )
     
     V.module_header_end( no_warn_filename=True )
 
     d = p['d']
+    mode = p['mode']
     if d == 0:
         P(f'assign {{{wr}_prdy,{rd}_pvld,{rd}_pd}} = {{{rd}_prdy,{wr}_pvld,{wr}_pd}};' )
+    elif mode in [ 'skid', 'pipe' ] or (mode == 'bypass' and d == 1):
+        P()
+        P(f'// {mode} stage' )
+        P(f'//' )
+        with V.ClockDomain( wr_clk, wr_reset_ ):
+            V.iface_stage( wr, rd, { 'pd': p['w'] }, 'pvld', 'prdy', do_dprint=False, mode=mode )
     elif d == 1:
         P()
-        P(f'// simple flop' )
+        P(f'// simple flop (not stallable, use mode=pipe for that)' )
         P(f'//' )
+        P(f'assign {wr}_prdy = 1\'b1;' )
         V.reg( f'{rd}_pvld', 1 )
         V.reg( f'{rd}_pd', p['w'] )
         V.always_at_posedge( _clk=wr_clk )
         P(f'    {rd}_pvld <= {wr}_pvld;' )
         P(f'    if ( {wr}_pvld ) {rd}_pd <= {wr}_pd;' )
         P(f'end' )
+    elif wr_lane_cnt > 1 or rd_lane_cnt > 1:
+        # Entry e lives in bank e % B, where B = max( wr_lane_cnt, rd_lane_cnt ), so the entries written 
+        # in a cycle and the entries read in a cycle each touch distinct banks. Each side keeps a rotating 
+        # (bank, row) pointer. The valid write lanes are compacted with collapse() and rotated left so that
+        # lane 0 lands in {wr}_bank. The read lanes are the banks rotated right by {rd}_bank.
+        # The write side takes all valid lanes at once when there is room for wr_lane_cnt entries.
+        # The read side presents the oldest entries on the low rd lanes, and the reader must take
+        # them in order (i.e., {rd}_pvld & {rd}_prdy must be all 1's from lane 0 up).
+        w        = p['w']
+        bank_cnt = max( wr_lane_cnt, rd_lane_cnt )
+        row_cnt  = (d + bank_cnt - 1) // bank_cnt
+        bank_w   = V.log2( bank_cnt )
+        row_w    = max( 1, V.log2( row_cnt ) )
+        cnt_w    = V.value_bitwidth( d )
+        wr_cnt_w = V.value_bitwidth( wr_lane_cnt )
+        P()
+        P(f'// flop ram banks' )
+        P(f'//' )
+        for b in range( bank_cnt ):
+            for r in range( row_cnt ): V.reg( f'ram_ff{b}_{r}', w )
+        P()
+        P(f'// PUSH/POP' )
+        P(f'//' ) 
+        V.reg( f'cnt', cnt_w )
+        P(f'assign {wr}_prdy = cnt <= {d-wr_lane_cnt};' )
+        P(f'// {V.vlint_off_width}' )
+        if wr_lane_cnt > 1:
+            V.count_ones( f'{wr}_pvld', wr_lane_cnt, f'{wr}_pvld_cnt' )
+        else:
+            V.wirea( f'{wr}_pvld_cnt', 1, f'{wr}_pvld' )
+        V.wirea( f'{wr}_pushing_cnt', wr_cnt_w, f'{wr}_prdy ? {wr}_pvld_cnt : 0' )
+        V.wirea( f'{rd}_popping', rd_lane_cnt, f'{rd}_pvld & {rd}_prdy' )
+        if rd_lane_cnt > 1:
+            V.count_ones( f'{rd}_popping', rd_lane_cnt, f'{rd}_popping_cnt' )
+        else:
+            V.wirea( f'{rd}_popping_cnt', 1, f'{rd}_popping' )
+        V.always_at_posedge( _clk=wr_clk )
+        P(f'    if ( !{wr_reset_} ) begin' )
+        P(f'        cnt <= 0;' )
+        P(f'    end else if ( {wr}_pushing_cnt != {rd}_popping_cnt ) begin' )
+        P(f'        cnt <= cnt + {wr}_pushing_cnt - {rd}_popping_cnt;' )
+        P(f'    end' )
+        P(f'end' )
+        P(f'// {V.vlint_on_width}' )
+        if rd_lane_cnt > 1:
+            V.dassert( f'({rd}_popping & ({rd}_popping + 1)) == 0', f'{rd} lanes must be popped in order from lane 0' )
+
+        for side, rw_clk, rw_reset_ in [ (wr, wr_clk, wr_reset_), (rd, rd_clk, rd_reset_) ]:
+            n = f'{side}_pushing_cnt' if side == wr else f'{side}_popping_cnt'
+            P()
+            P(f'// {"WRITE" if side == wr else "READ"} SIDE' )
+            P(f'//' ) 
+            V.reg( f'{side}_bank', bank_w )
+            V.reg( f'{side}_row', row_w )
+            V.wirea( f'{side}_row_next', row_w, f'({side}_row == {row_cnt-1}) ? 0 : ({side}_row+1)' )
+            V.wirea( f'{side}_bank_sum', bank_w+1, f'{side}_bank + {n}' )
+            for b in range( bank_cnt ):
+                V.wirea( f'{side}_row{b}', row_w, f'({b} < {side}_bank) ? {side}_row_next : {side}_row' )
+            if side == wr:
+                P(f'// {V.vlint_off_width}' )
+                P(f'// {V.vlint_off_unused}' )
+                V.collapse( f'{wr}_pvld', wr_lane_cnt, f'{wr}_c', { 'pd': [ w, f'{wr}_pd' ] }, gen_indexes=False )
+                P(f'// {V.vlint_on_unused}' )
+                P(f'// {V.vlint_on_width}' )
+                pad = bank_cnt - wr_lane_cnt
+                if pad != 0:
+                    V.wirea( f'{wr}_c_bank_pd', bank_cnt*w, f'{{{pad*w}\'d0, {wr}_c_pd}}' )
+                    V.wirea( f'{wr}_c_we', bank_cnt, f'{wr}_prdy ? {{{pad}\'d0, {wr}_c_vlds}} : {bank_cnt}\'d0' )
+                else:
+                    V.wirea( f'{wr}_c_bank_pd', bank_cnt*w, f'{wr}_c_pd' )
+                    V.wirea( f'{wr}_c_we', bank_cnt, f'{wr}_prdy ? {wr}_c_vlds : {bank_cnt}\'d0' )
+                V.rotate_left( f'{wr}_bank_we', bank_cnt, f'{wr}_bank', f'{wr}_c_we' )
+                V.rotate_left( f'{wr}_bank_pd', bank_cnt, f'{wr}_bank', f'{wr}_c_bank_pd', w )
+            V.always_at_posedge( _clk=rw_clk )
+            P(f'    if ( !{rw_reset_} ) begin' )
+            P(f'        {side}_bank <= 0;' )
+            P(f'        {side}_row <= 0;' )
+            P(f'    end else begin' )
+            P(f'        // {V.vlint_off_width}' )
+            P(f'        if ( {side}_bank_sum >= {bank_cnt} ) begin' )
+            P(f'            {side}_bank <= {side}_bank_sum - {bank_cnt};' )
+            P(f'            {side}_row <= {side}_row_next;' )
+            P(f'        end else begin' )
+            P(f'            {side}_bank <= {side}_bank_sum;' )
+            P(f'        end' )
+            P(f'        // {V.vlint_on_width}' )
+            if side == wr:
+                for b in range( bank_cnt ):
+                    P(f'        if ( {wr}_bank_we[{b}] ) begin' )
+                    P(f'            // {V.vlint_off_caseincomplete}' )
+                    P(f'            case( {wr}_row{b} )' )
+                    for r in range( row_cnt ): P(f'                {row_w}\'d{r}: ram_ff{b}_{r} <= {wr}_bank_pd[{b*w+w-1}:{b*w}];' )
+                    P(f'            endcase' )
+                    P(f'            // {V.vlint_on_caseincomplete}' )
+                    P(f'        end' )
+            P(f'    end' )
+            P(f'end' )
+
+        for b in range( bank_cnt ):
+            V.muxa( f'{rd}_bank{b}_pd', w, f'{rd}_row{b}', [ f'ram_ff{b}_{r}' for r in range( row_cnt ) ] )
+        V.concata( [ f'{rd}_bank{b}_pd' for b in range( bank_cnt ) ], w, f'{rd}_bank_pd' )
+        if rd_lane_cnt < bank_cnt: P(f'// {V.vlint_off_unused}' )      # only the low rd_lane_cnt lanes are read
+        V.rotate_right( f'{rd}_lane_pd', bank_cnt, f'{rd}_bank', f'{rd}_bank_pd', w )
+        if rd_lane_cnt < bank_cnt: P(f'// {V.vlint_on_unused}' )
+        P(f'assign {rd}_pd = {rd}_lane_pd[{rd_lane_cnt*w-1}:0];' )
+        P(f'assign {rd}_pvld = ' + V.concata( [ f'cnt > {j}' for j in range( rd_lane_cnt ) ], 1 ) + ';' )
+    elif is_async:
+        # Each side keeps a binary pointer with one extra wrap bit plus a gray-coded copy.
+        # Only the gray pointers cross between the clock domains, each through sync_cnt flops,
+        # so the write side sees the fifo as at least as full as it really is and the read side 
+        # sees it as at least as empty. afull and aempty are computed from those same views.
+        # With ram_kind=ra2, the read side prefetches from the ram as described below, but there is no bypass.
+        w        = p['w']
+        a_w      = V.log2( d )
+        sync_cnt = p['sync_cnt']
+        is_ra2   = p['ram_kind'] == 'ra2'
+        rd_adv   = f'{rd}_ram_re' if is_ra2 else f'{rd}_popping'
+        wr_adr   = f'{wr}_wa' if is_ra2 else f'{wr}_adr'
+        rd_adr   = f'{rd}_ram_ra' if is_ra2 else f'{rd}_adr'
+        P()
+        P(f'// PUSH/POP' )
+        P(f'//' ) 
+        P(f'wire {wr}_pushing = {wr}_pvld && {wr}_prdy;' )
+        P(f'wire {rd}_popping = {rd}_pvld && {rd}_prdy;' )
+        V.reg( f'{wr}_ptr', a_w+1 )
+        V.reg( f'{wr}_ptr_gray', a_w+1 )
+        V.reg( f'{rd}_ptr', a_w+1 )
+        V.reg( f'{rd}_ptr_gray', a_w+1 )
+        V.wirea( wr_adr, a_w, f'{wr}_ptr[{a_w-1}:0]' )
+        V.wirea( rd_adr, a_w, f'{rd}_ptr[{a_w-1}:0]' )
+        if not is_ra2:
+            P()
+            P(f'// flop ram' )
+            P(f'//' )
+            for i in range( d ): V.reg( f'ram_ff{i}', w )
+        P()
+        P(f'// WRITE SIDE' )
+        P(f'//' ) 
+        rd_ptr_gray_s = V.synchronizer( f'{rd}_ptr_gray_sync', a_w+1, f'{rd}_ptr_gray', sync_cnt, wr_clk, wr_reset_ )
+        full_gray = f'~{rd_ptr_gray_s}[{a_w}:{a_w-1}]'
+        if a_w > 1: full_gray = f'{{{full_gray}, {rd_ptr_gray_s}[{a_w-2}:0]}}'
+        P(f'assign {wr}_prdy = {wr}_ptr_gray != {full_gray};' )
+        if p['afull_thresh'] != 0 or p['with_perf']:
+            V.wirea( f'{wr}_cnt', a_w+1, f'{wr}_ptr - {V.gray_to_binary( rd_ptr_gray_s, a_w+1 )}' )
+        if p['afull_thresh'] != 0:
+            P(f'assign {wr}_afull = {wr}_cnt >= {p["afull_thresh"]};' )
+        V.wirea( f'{wr}_ptr_next', a_w+1, f'{wr}_ptr + 1' )
+        V.always_at_posedge( _clk=wr_clk )
+        P(f'    if ( !{wr_reset_} ) begin' )
+        P(f'        {wr}_ptr <= 0;' )
+        P(f'        {wr}_ptr_gray <= 0;' )
+        P(f'    end else if ( {wr}_pushing ) begin' )
+        P(f'        {wr}_ptr <= {wr}_ptr_next;' )
+        P(f'        {wr}_ptr_gray <= {V.binary_to_gray( f"{wr}_ptr_next" )};' )
+        if not is_ra2:
+            P(f'        // {V.vlint_off_caseincomplete}' )
+            P(f'        case( {wr}_adr )' )
+            for i in range( d ): P(f'            {a_w}\'d{i}: ram_ff{i} <= {wr}_pd;' )
+            P(f'        endcase' )
+            P(f'        // {V.vlint_on_caseincomplete}' )
+        P(f'    end' )
+        P(f'end' )
+        P()
+        P(f'// READ SIDE' )
+        P(f'//' )
+        wr_ptr_gray_s = V.synchronizer( f'{wr}_ptr_gray_sync', a_w+1, f'{wr}_ptr_gray', sync_cnt, rd_clk, rd_reset_ )
+        if is_ra2:
+            prefetch_begin( p )
+            V.wirea( f'{rd}_ram_re', 1, f'{rd}_ptr_gray != {wr_ptr_gray_s} && ld_room' )
+        else:
+            P(f'assign {rd}_pvld = {rd}_ptr_gray != {wr_ptr_gray_s};' )
+        if p['aempty_thresh'] != 0:
+            V.wirea( f'{rd}_cnt', a_w+1, f'{V.gray_to_binary( wr_ptr_gray_s, a_w+1 )} - {rd}_ptr' )
+            pf = ' + pf_cnt + ld_vld' if is_ra2 else ''
+            P(f'assign {rd}_aempty = ({rd}_cnt{pf}) <= {p["aempty_thresh"]};' )
+        V.wirea( f'{rd}_ptr_next', a_w+1, f'{rd}_ptr + 1' )
+        V.always_at_posedge( _clk=rd_clk )
+        P(f'    if ( !{rd_reset_} ) begin' )
+        P(f'        {rd}_ptr <= 0;' )
+        P(f'        {rd}_ptr_gray <= 0;' )
+        P(f'    end else if ( {rd_adv} ) begin' )
+        P(f'        {rd}_ptr <= {rd}_ptr_next;' )
+        P(f'        {rd}_ptr_gray <= {V.binary_to_gray( f"{rd}_ptr_next" )};' )
+        P(f'    end' )
+        P(f'end' )
+        if is_ra2:
+            V.wirea( f'{wr}_we', 1, f'{wr}_pushing' )
+            V.ram( wr, f'{rd}_ram', { 'pd': w }, d, clks=[wr_clk, rd_clk], m_name='' if V.ramgen_cmd != '' else f'{module_name}_ram' )
+            prefetch_end( p, f'{rd}_ram_re', f'{rd}_ram_pd' )
+        else:
+            read_mux( p, a_w )
+    elif p['ram_kind'] == 'ra2':
+        # The entries live in a 2-port V.ram() with one cycle of read latency.
+        # To hide that latency, entries are prefetched into a 2-entry output queue (see prefetch_end()).
+        # The entry arriving this cycle (ld_*) is either the ram read data or a write that bypassed
+        # the empty ram. 
+        w     = p['w']
+        a_w   = V.log2( d )
+        cnt_w = V.value_bitwidth( d )
+        P()
+        P(f'// PUSH/POP' )
+        P(f'//' ) 
+        P(f'wire {wr}_pushing = {wr}_pvld && {wr}_prdy;' )
+        P(f'wire {rd}_popping = {rd}_pvld && {rd}_prdy;' )
+        V.reg( f'ram_cnt', cnt_w )
+        prefetch_begin( p )
+        V.wirea( f'{rd}_ram_re', 1, f'ram_cnt != 0 && ld_room' )
+        V.wirea( f'{wr}_bypass', 1, f'{wr}_pushing && ram_cnt == 0 && ld_room' )
+        V.wirea( f'{wr}_we', 1, f'{wr}_pushing && !{wr}_bypass' )
+        P(f'assign {wr}_prdy = ram_cnt != {d};' )
+        V.reg( f'{wr}_wa', a_w )
+        V.reg( f'{rd}_ram_ra', a_w )
+        V.reg( f'ld_from_ram', 1 )
+        V.reg( f'{wr}_bypass_pd', w )
+        V.always_at_posedge( _clk=wr_clk )
+        P(f'    if ( !{wr_reset_} ) begin' )
+        P(f'        ram_cnt <= 0;' )
+        P(f'        {wr}_wa <= 0;' )
+        P(f'        {rd}_ram_ra <= 0;' )
+        P(f'    end else begin' )
+        P(f'        if ( {wr}_we != {rd}_ram_re ) begin' )
+        P(f'            // {V.vlint_off_width}' )
+        P(f'            ram_cnt <= ram_cnt + {wr}_we - {rd}_ram_re;' )
+        P(f'            // {V.vlint_on_width}' )
+        P(f'        end' )
+        P(f'        if ( {wr}_we ) {wr}_wa <= ({wr}_wa == {d-1}) ? 0 : ({wr}_wa+1);' )
+        P(f'        if ( {rd}_ram_re ) {rd}_ram_ra <= ({rd}_ram_ra == {d-1}) ? 0 : ({rd}_ram_ra+1);' )
+        P(f'        ld_from_ram <= {rd}_ram_re;' )
+        P(f'        if ( {wr}_bypass ) {wr}_bypass_pd <= {wr}_pd;' )
+        P(f'    end' )
+        P(f'end' )
+
+        V.ram( wr, f'{rd}_ram', { 'pd': w }, d, clks=[] if wr_clk == V.clk else [wr_clk, wr_clk], 
+               m_name='' if V.ramgen_cmd != '' else f'{module_name}_ram' )
+        prefetch_end( p, f'{rd}_ram_re || {wr}_bypass', f'ld_from_ram ? {rd}_ram_pd : {wr}_bypass_pd' )
     else:
         w     = p['w']
         a_w   = V.log2( d )
@@ -169,6 +484,14 @@ def make( p, module_name, with_file_header=True ):
         V.reg( f'cnt', cnt_w )
         P(f'wire {wr}_pushing = {wr}_pvld && {wr}_prdy;' )
         P(f'wire {rd}_popping = {rd}_pvld && {rd}_prdy;' )
+        wr_storing = f'{wr}_pushing'
+        rd_unloading = f'{rd}_popping'
+        if mode == 'bypass':
+            # when the fifo is empty, a write that is popped in the same cycle never touches the ram
+            wr_storing = f'{wr}_storing'
+            rd_unloading = f'{rd}_unloading'
+            P(f'wire {wr}_storing = {wr}_pushing && (cnt != 0 || !{rd}_prdy);' )
+            P(f'wire {rd}_unloading = {rd}_popping && cnt != 0;' )
         V.always_at_posedge( _clk=wr_clk )
         P(f'    if ( !{wr_reset_} ) begin' )
         P(f'        cnt <= 0;' )
@@ -186,7 +509,7 @@ def make( p, module_name, with_file_header=True ):
         V.always_at_posedge( _clk=wr_clk )
         P(f'    if ( !{wr_reset_} ) begin' )
         P(f'        {wr}_adr <= 0;' )
-        P(f'    end else if ( {wr}_pushing ) begin' )
+        P(f'    end else if ( {wr_storing} ) begin' )
         P(f'        // {V.vlint_off_caseincomplete}' )
         P(f'        case( {wr}_adr )' )
         for i in range( d ): P(f'            {a_w}\'d{i}: ram_ff{i} <= {wr}_pd;' )
@@ -203,46 +526,128 @@ def make( p, module_name, with_file_header=True ):
         V.always_at_posedge( _clk=rd_clk )
         P(f'    if ( !{rd_reset_} ) begin' )
         P(f'        {rd}_adr <= 0;' )
-        P(f'    end else if ( {rd}_popping ) begin' )
+        P(f'    end else if ( {rd_unloading} ) begin' )
         P(f'        {rd}_adr <= ({rd}_adr == {d-1}) ? 0 : ({rd}_adr+1);' )
         P(f'    end' )
         P(f'end' )
         P()
-        P(f'assign {rd}_pvld = cnt != 0;' )
-        P(f'reg [{w-1}:0] {rd}_pd_p;' )
+        if mode == 'bypass':
+            P(f'assign {rd}_pvld = cnt != 0 || {wr}_pvld;' )
+        else:
+            P(f'assign {rd}_pvld = cnt != 0;' )
+        read_mux( p, a_w, with_bypass=mode == 'bypass' )
+
+    if p['with_perf']:
+        # for an asynchronous fifo, the occupancy is the write side's view
+        with V.ClockDomain( wr_clk, wr_reset_ ):
+            V.iface_perf( 'perf', wr, rd, ilane_cnt=wr_lane_cnt, olane_cnt=rd_lane_cnt, occ=f'{wr}_cnt' if is_async else '', _oclk=rd_clk, _oreset_=rd_reset_ )
+    V.module_footer( module_name )
+
+#--------------------------------------------------------------------
+# Read mux for flop rams, indexed by {rd}_adr.
+#--------------------------------------------------------------------
+def read_mux( p, a_w, with_bypass=False ):
+    rd = p['rd']
+    d  = p['d']
+    w  = p['w']
+    P(f'reg [{w-1}:0] {rd}_pd_p;' )
+    if with_bypass:
+        P(f'assign {rd}_pd = (cnt == 0) ? {p["wr"]}_pd : {rd}_pd_p;' )
+    else:
         P(f'assign {rd}_pd = {rd}_pd_p;' )
-        P(f'always @( * ) begin' )
-        P(f'    // {V.vlint_off_caseincomplete}' )
-        P(f'    case( {rd}_adr )' )
-        for i in range( d ): P(f'        {a_w}\'d{i}: {rd}_pd_p = ram_ff{i};' )
-        P(f'        // VCS coverage off' )
-        P(f'        default: begin' )
-        P(f'            {rd}_pd_p = {w}\'d0;' )
-        P(f'            // synopsys translate_off' )
-        P(f'            {rd}_pd_p = {{{w}{{1\'bx}}}};' )
-        P(f'            // synopsys translate_on' )
-        P(f'            end' )
-        P(f'        // VCS coverage on' )
-        P(f'    endcase' )
-        P(f'    // {V.vlint_on_caseincomplete}' )
-        P(f'end' )
+    P(f'always @( * ) begin' )
+    P(f'    // {V.vlint_off_caseincomplete}' )
+    P(f'    case( {rd}_adr )' )
+    for i in range( d ): P(f'        {a_w}\'d{i}: {rd}_pd_p = ram_ff{i};' )
+    P(f'        // VCS coverage off' )
+    P(f'        default: begin' )
+    P(f'            {rd}_pd_p = {w}\'d0;' )
+    P(f'            // synopsys translate_off' )
+    P(f'            {rd}_pd_p = {{{w}{{1\'bx}}}};' )
+    P(f'            // synopsys translate_on' )
+    P(f'            end' )
+    P(f'        // VCS coverage on' )
+    P(f'    endcase' )
+    P(f'    // {V.vlint_on_caseincomplete}' )
+    P(f'end' )
+
+#--------------------------------------------------------------------
+# Read prefetch queue for ram_kind=ra2.
+#
+# The ram has one cycle of read latency, so entries are prefetched into a 2-entry output queue
+# (pf0 is the head). ld_vld/ld_pd is the entry arriving this cycle, which is visible on {rd}_pd 
+# when the queue is empty. A new entry is loaded (ld_next) only if ld_room says that it will fit, 
+# so the queue plus the arriving entry never holds more than 2 entries, and a back-to-back 
+# stream flows through at full rate.
+#
+# prefetch_begin() declares pf_cnt, ld_vld, and ld_room and must come after {rd}_popping.
+# prefetch_end() generates the rest.
+#--------------------------------------------------------------------
+def prefetch_begin( p ):
+    rd = p['rd']
+    V.reg( f'pf_cnt', 2 )
+    V.reg( f'ld_vld', 1 )
+    V.wirea( f'ld_room', 1, f'(pf_cnt + {{1\'b0, ld_vld}}) != 2\'d2 || {rd}_popping' )
+
+def prefetch_end( p, ld_next, ld_pd ):
+    rd        = p['rd']
+    rd_clk    = p['rd_clk']
+    rd_reset_ = p['rd_reset_']
+    w         = p['w']
     P()
-    P(f'endmodule // {module_name}' )
+    P(f'// READ PREFETCH' )
+    P(f'//' )
+    V.wirea( f'ld_pd', w, ld_pd )
+    V.reg( f'pf0', w )
+    V.reg( f'pf1', w )
+    V.always_at_posedge( _clk=rd_clk )
+    P(f'    if ( !{rd_reset_} ) begin' )
+    P(f'        ld_vld <= 0;' )
+    P(f'        pf_cnt <= 0;' )
+    P(f'    end else begin' )
+    P(f'        ld_vld <= {ld_next};' )
+    P(f'        if ( {rd}_popping ) begin' )
+    P(f'            if ( pf_cnt == 2 ) begin' )
+    P(f'                pf0 <= pf1;' )
+    P(f'                if ( ld_vld ) pf1 <= ld_pd;' )
+    P(f'            end else if ( pf_cnt == 1 && ld_vld ) begin' )
+    P(f'                pf0 <= ld_pd;' )
+    P(f'            end' )
+    P(f'            if ( pf_cnt != 0 && !ld_vld ) pf_cnt <= pf_cnt - 1;' )
+    P(f'        end else if ( ld_vld ) begin' )
+    P(f'            if ( pf_cnt == 0 ) pf0 <= ld_pd;' )
+    P(f'            else               pf1 <= ld_pd;' )
+    P(f'            pf_cnt <= pf_cnt + 1;' )
+    P(f'        end' )
+    P(f'    end' )
+    P(f'end' )
+    P(f'assign {rd}_pvld = pf_cnt != 0 || ld_vld;' )
+    P(f'assign {rd}_pd = (pf_cnt != 0) ? pf0 : ld_pd;' )
 
 #--------------------------------------------------------------------
 # Generates a testbench module for a fifo module.
 #--------------------------------------------------------------------
-def make_tb( p, module_name, inst_name, sigs, do_dprint=True ):
+def make_tb( p, module_name, inst_name, sigs, do_dprint=True, rd_clk_period=1.7 ):
     check( p )
 
     wr_reset_   = p['wr_reset_']
     wr          = p['wr']
     rd          = p['rd']
+    is_async    = p['is_async']
+    rd_clk      = p['rd_clk']
+    rd_reset_   = p['rd_reset_']
+    wr_lane_cnt = p['wr_lane_cnt']
+    rd_lane_cnt = p['rd_lane_cnt']
+    is_wide     = wr_lane_cnt > 1 or rd_lane_cnt > 1
 
     P(f'// Testbench for {module_name}.v with the following properties beyond those of the fifo:' )
     P(f'// - incrementing input data' )
     P(f'// - randomly adds bubbles to write-side input' )
     P(f'// - randomly stalls the read-side output' )
+    if is_async:
+        P(f'// - {V.clk} and {rd_clk} run independently; use +{V.clk}_period=<ns> and +{rd_clk}_period=<ns> to change them' )
+    if is_wide:
+        P(f'// - each cycle, a random subset of the {wr_lane_cnt} write lanes is valid and a random number of the {rd_lane_cnt} read lanes is ready' )
     P(f'// - makes some assumptions that will need to be generalized later' )
     P(f'//' )
     V.module_header_begin( f'tb_{module_name}' )
@@ -250,11 +655,23 @@ def make_tb( p, module_name, inst_name, sigs, do_dprint=True ):
     P()
     V.tb_clk()
     V.tb_reset_()
+    if is_async:
+        with V.ClockDomain( rd_clk, rd_reset_ ):
+            V.tb_clk( default_period=rd_clk_period, with_cycle_cnt=False )
+            V.tb_reset_()
     V.tb_dump( f'tb_{module_name}', include_saif=False )
     P()
     V.tb_rand_init()
+    if is_async:
+        with V.ClockDomain( rd_clk, rd_reset_ ):
+            V.tb_rand_init()
 
-    V.iface_wire( wr, sigs, True, False )
+    if is_wide:
+        P()
+        V.wire( f'{wr}_pvld', wr_lane_cnt )
+        for sig in sigs: V.wire( f'{wr}_{sig}', sigs[sig]*wr_lane_cnt )
+    else:
+        V.iface_wire( wr, sigs, True, False )
     inst( p, module_name, f'u_{inst_name}', wr, rd, sigs, do_dprint=do_dprint )
 
     P() 
@@ -265,42 +682,188 @@ def make_tb( p, module_name, inst_name, sigs, do_dprint=True ):
     P( f'    if ( !$value$plusargs( "wr_cnt_max=%d", wr_cnt_max ) ) wr_cnt_max = 100;' )
     P( f'end' )
 
+    if is_wide:
+        make_tb_lanes( p )
+        make_tb_perf( p, f'u_{inst_name}' )
+        V.module_footer( f'tb_{module_name}' )
+        return
+
     P() 
     P( f'// REQUESTS' )
     P( f'//' )
     V.reg( 'wr_cnt', 32 )
     V.reg( 'rd_cnt', 32 )
     V.tb_randbits( 'can_wr', 1 )
-    V.tb_randbits( 'can_rd', 1 )
+    with V.ClockDomain( rd_clk, rd_reset_ ):
+        V.tb_randbits( 'can_rd', 1 )
     V.reg( f'wr_dat', p['w'] )
     V.reg( f'rd_dat', p['w'] ) # expected
     P( f'assign {wr}_pvld = can_wr && wr_cnt < wr_cnt_max;' )
     P( f'assign {wr}_dat  = wr_dat;' )
     P( f'assign {rd}_prdy = can_rd;' )
     P( f'wire fifo_idle = !{wr}_pvld && !{rd}_pvld;' )
+    if not is_async:
+        V.always_at_posedge()
+        P( f'    if ( !{wr_reset_} ) begin' )
+        P( f'        wr_cnt <= 0;' )
+        P( f'        rd_cnt <= 0;' )
+        P( f'        wr_dat <= 0;' )
+        P( f'        rd_dat <= 0;' )
+        P( f'    end else begin' )
+        P( f'        if ( {wr}_pvld && {wr}_prdy ) begin' )
+        P( f'            wr_dat <= wr_dat + 1;' )
+        P( f'            wr_cnt <= wr_cnt + 1;' )
+        P( f'        end' )
+        P( f'        if ( {rd}_pvld && {rd}_prdy ) begin' )
+        P( f'            rd_dat <= rd_dat + 1;' )
+        P( f'            rd_cnt <= rd_cnt + 1;' )
+        P( f'        end' )
+        P( f'        if ( fifo_idle && rd_cnt === wr_cnt_max ) begin' )
+        P( f'            $display( "PASS" );' )
+        P( f'            $finish;' )
+        P( f'        end' )
+        P( f'    end' )
+        P( f'end' )
+    else:
+        V.always_at_posedge()
+        P( f'    if ( !{wr_reset_} ) begin' )
+        P( f'        wr_cnt <= 0;' )
+        P( f'        wr_dat <= 0;' )
+        P( f'    end else if ( {wr}_pvld && {wr}_prdy ) begin' )
+        P( f'        wr_dat <= wr_dat + 1;' )
+        P( f'        wr_cnt <= wr_cnt + 1;' )
+        P( f'    end' )
+        P( f'end' )
+        V.always_at_posedge( _clk=rd_clk )
+        P( f'    if ( !{rd_reset_} ) begin' )
+        P( f'        rd_cnt <= 0;' )
+        P( f'        rd_dat <= 0;' )
+        P( f'    end else begin' )
+        P( f'        if ( {rd}_pvld && {rd}_prdy ) begin' )
+        P( f'            rd_dat <= rd_dat + 1;' )
+        P( f'            rd_cnt <= rd_cnt + 1;' )
+        P( f'        end' )
+        P( f'        if ( fifo_idle && rd_cnt === wr_cnt_max ) begin' )
+        P( f'            $display( "PASS" );' )
+        P( f'            $finish;' )
+        P( f'        end' )
+        P( f'    end' )
+        P( f'end' )
+    with V.ClockDomain( rd_clk, rd_reset_ ):
+        V.dassert( f'{rd}_pvld === 0 || {rd}_dat === rd_dat', f'unexpected read data' )
+
+    if not is_async: make_tb_trace( p, module_name, sigs )
+    make_tb_perf( p, f'u_{inst_name}' )
+    V.module_footer( f'tb_{module_name}' )
+
+#--------------------------------------------------------------------
+# With +trace, the testbench of a synchronous fifo writes one line per cycle after reset to 
+# tb_{module_name}.trace, which fifo_model.py can check offline:
+#
+#     wr_pvld wr_prdy wr_pd rd_pvld rd_prdy rd_pd
+#
+# in decimal, with each pd 0 when its pvld is 0.
+#--------------------------------------------------------------------
+def make_tb_trace( p, module_name, sigs ):
+    wr = p['wr']
+    rd = p['rd']
+    P()
+    P(f'// TRACE' )
+    P(f'//' )
+    P(f'integer trace_fd;' )
+    P(f'initial begin' )
+    P(f'    trace_fd = 0;' )
+    P(f'    if ( $test$plusargs( "trace" ) ) trace_fd = $fopen( "tb_{module_name}.trace", "w" );' )
+    P(f'end' )
     V.always_at_posedge()
-    P( f'    if ( !{wr_reset_} ) begin' )
+    P(f'    if ( trace_fd != 0 && {V.reset_} ) begin' )
+    P(f'        $fwrite( trace_fd, "%0d %0d %0d %0d %0d %0d\\n", {wr}_pvld, {wr}_prdy, {wr}_pvld ? {{{pd_sigs( wr, sigs, 1 )}}} : 0, ' +
+      f'{rd}_pvld, {rd}_prdy, {rd}_pvld ? {{{pd_sigs( rd, sigs, 1 )}}} : 0 );' )
+    P(f'    end' )
+    P(f'end' )
+    P(f'final begin' )
+    P(f'    if ( trace_fd != 0 ) $fclose( trace_fd );' )
+    P(f'end' )
+
+#--------------------------------------------------------------------
+# With with_perf=True, the testbench displays the fifo's perf counters at the 
+# tb_clk() PERF END marker and again when the simulation finishes.
+#--------------------------------------------------------------------
+def make_tb_perf( p, inst_name ):
+    if not p['with_perf']: return
+    P()
+    P(f'`ifdef VPY_PERF' )
+    P(f'// PERF' )
+    P(f'//' )
+    V.always_at_posedge()
+    P(f'    if ( cycle_cnt === {V.perf_op_last} ) begin' )
+    V.iface_perf_display( f'{inst_name}.perf', f'END {inst_name}', indent='        ' )
+    P(f'    end' )
+    P(f'end' )
+    P(f'final begin' )
+    V.iface_perf_display( f'{inst_name}.perf', f'FINAL {inst_name}', indent='    ' )
+    P(f'end' )
+    P(f'`endif' )
+
+
+#--------------------------------------------------------------------
+# Requests for make_tb() when the fifo has more than one write or read lane.
+# Write lane i carries wr_dat plus the number of valid lanes below it.
+# The read lanes are made ready from lane 0 up, as the fifo requires.
+#--------------------------------------------------------------------
+def make_tb_lanes( p ):
+    wr          = p['wr']
+    rd          = p['rd']
+    w           = p['w']
+    wr_lane_cnt = p['wr_lane_cnt']
+    rd_lane_cnt = p['rd_lane_cnt']
+    lane        = lambda sig, lane_cnt, i, w=1: sig if lane_cnt == 1 else f'{sig}[{i}]' if w == 1 else f'{sig}[{i*w+w-1}:{i*w}]'
+
+    P() 
+    P( f'// REQUESTS' )
+    P( f'//' )
+    V.reg( 'wr_cnt', 32 )
+    V.reg( 'rd_cnt', 32 )
+    V.tb_randbits( 'can_wr', wr_lane_cnt )
+    V.tb_randbits( 'can_rd', rd_lane_cnt )
+    V.reg( f'wr_dat', w )
+    V.reg( f'rd_dat', w ) # expected for read lane 0
+    for i in range( wr_lane_cnt ):
+        before = V.count_ones( 'can_wr', i ) if i != 0 else '0'
+        V.wirea( f'wr_before{i}', 32, before )
+        P( f'assign {lane( f"{wr}_pvld", wr_lane_cnt, i )} = can_wr[{i}] && (wr_cnt + wr_before{i}) < wr_cnt_max;' )
+        P( f'// {V.vlint_off_width}' )
+        P( f'assign {lane( f"{wr}_dat", wr_lane_cnt, i, w )} = wr_dat + wr_before{i};' )
+        P( f'// {V.vlint_on_width}' )
+    for j in range( rd_lane_cnt ):
+        P( f'assign {lane( f"{rd}_prdy", rd_lane_cnt, j )} = &can_rd[{j}:0];' )
+    V.wirea( 'wr_pvld_cnt', V.log2( wr_lane_cnt+1 ), V.count_ones( f'{wr}_pvld', wr_lane_cnt ) if wr_lane_cnt > 1 else f'{wr}_pvld' )
+    V.wirea( 'rd_popping', rd_lane_cnt, f'{rd}_pvld & {rd}_prdy' )
+    V.wirea( 'rd_popping_cnt', V.log2( rd_lane_cnt+1 ), V.count_ones( 'rd_popping', rd_lane_cnt ) if rd_lane_cnt > 1 else 'rd_popping' )
+    P( f'wire fifo_idle = {wr}_pvld == 0 && {rd}_pvld == 0;' )
+    V.always_at_posedge()
+    P( f'    if ( !{p["wr_reset_"]} ) begin' )
     P( f'        wr_cnt <= 0;' )
     P( f'        rd_cnt <= 0;' )
     P( f'        wr_dat <= 0;' )
     P( f'        rd_dat <= 0;' )
     P( f'    end else begin' )
-    P( f'        if ( {wr}_pvld && {wr}_prdy ) begin' )
-    P( f'            wr_dat <= wr_dat + 1;' )
-    P( f'            wr_cnt <= wr_cnt + 1;' )
+    P( f'        // {V.vlint_off_width}' )
+    P( f'        if ( {wr}_pvld != 0 && {wr}_prdy ) begin' )
+    P( f'            wr_dat <= wr_dat + wr_pvld_cnt;' )
+    P( f'            wr_cnt <= wr_cnt + wr_pvld_cnt;' )
     P( f'        end' )
-    P( f'        if ( {rd}_pvld && {rd}_prdy ) begin' )
-    P( f'            rd_dat <= rd_dat + 1;' )
-    P( f'            rd_cnt <= rd_cnt + 1;' )
+    P( f'        if ( rd_popping != 0 ) begin' )
+    P( f'            rd_dat <= rd_dat + rd_popping_cnt;' )
+    P( f'            rd_cnt <= rd_cnt + rd_popping_cnt;' )
     P( f'        end' )
+    P( f'        // {V.vlint_on_width}' )
     P( f'        if ( fifo_idle && rd_cnt === wr_cnt_max ) begin' )
     P( f'            $display( "PASS" );' )
     P( f'            $finish;' )
     P( f'        end' )
     P( f'    end' )
     P( f'end' )
-    V.dassert( f'{rd}_pvld === 0 || {rd}_dat === rd_dat', f'unexpected read data' )
-
-    P()
-    P(f'endmodule // tb_{module_name}' )
-
+    for j in range( rd_lane_cnt ):
+        V.wirea( f'rd_dat{j}', w, f'rd_dat + {j}' )
+        V.dassert( f'{lane( f"{rd}_pvld", rd_lane_cnt, j )} === 0 || {lane( f"{rd}_dat", rd_lane_cnt, j, w )} === rd_dat{j}', f'unexpected read data on lane {j}' )
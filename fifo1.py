@@ -24,7 +24,7 @@ import S
 import V
 import fifo
 
-P = print
+P = V.P
 
 def reinit():
     global params, xx2fifo, fifo2xx
@@ -36,7 +36,8 @@ def reinit():
     params = { 'd':             3, 
                'w':             V.iface_width( xx2fifo ),
                'wr':            'xx2fifo',
-               'rd':            'fifo2xx' }
+               'rd':            'fifo2xx',
+               'with_perf':     True }
 
 def inst_fifo1( module_name, inst_name, do_decls=True ):
     fifo.inst( params, module_name, inst_name, 'xx2fifo', 'fifo2xx', xx2fifo, with_wr_prdy=True, do_decl=do_decls )
@@ -0,0 +1,273 @@
+# Copyright (c) 2017-2025 Robert A. Alfieri
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# fifo_model.py - reference model of fifo.make() and an offline checker for simulation traces
+#
+# fifo_model.py <design> [<trace>] [-slow]
+#
+# <design> is one of gen.py's designs whose builder has a fifo params dict, such as fifo1.
+# <trace> is the file written by running its testbench with +trace (default: tb_<design>.trace), e.g.:
+#
+#     vsim.py tb_fifo1 +trace +wr_cnt_max=1000000
+#     fifo_model.py fifo1
+#
+# Each line of the trace is one cycle after reset (see fifo.make_tb_trace()):
+#
+#     wr_pvld wr_prdy wr_pd rd_pvld rd_prdy rd_pd
+#
+# The checker loads the whole trace into NumPy arrays and computes every cycle's occupancy
+# with one cumulative sum of pushes minus pops. From that, it computes the wr_prdy and rd_pvld
+# that fifo.make() should have produced in every cycle, and it compares rd_pd in every cycle with
+# rd_pvld against the head entry, i.e., the pushed pd's in order. It reports the first divergence 
+# (if any) and the throughput statistics.
+# The handshakes are checked only for ram_kind=ff; with ram_kind=ra2, rd_pvld depends on the
+# ram's read latency, so only the data order and occupancy are checked.
+#
+# With -slow, the trace is instead replayed one cycle at a time through FifoModel.step(),
+# which is the same semantics written as a plain cycle-based model. It is much slower
+# but is a useful cross-check of the vectorized checker.
+#
+# Asynchronous and multi-lane fifos are not supported.
+#
+import sys
+import collections
+import numpy as np
+import S
+import V
+import C
+import fifo
+import gen
+
+cols = [ 'wr_pvld', 'wr_prdy', 'wr_pd', 'rd_pvld', 'rd_prdy', 'rd_pd' ]
+
+#-------------------------------------------
+# Check that p (already passed through fifo.check()) is something this model handles.
+#-------------------------------------------
+def check( p ):
+    if p['is_async']: S.die( f'fifo_model: asynchronous fifos are not supported' )
+    if p['wr_lane_cnt'] != 1 or p['rd_lane_cnt'] != 1: S.die( f'fifo_model: multi-lane fifos are not supported' )
+    if p['w'] > 64: S.die( f'fifo_model: w={p["w"]} is wider than the 64 bits the checker supports' )
+
+#-------------------------------------------
+# Cycle-based reference model of a synchronous, single-lane fifo.make().
+#
+# Each call to step() is one clock cycle. It takes this cycle's inputs, returns this cycle's
+# outputs (wr_prdy, rd_pvld, rd_pd), and then advances to the next cycle.
+#
+# cnt is the occupancy, i.e., the number of entries pushed but not yet popped.
+# The rules are:
+#
+#     rd_pvld = cnt != 0                        (mode=bypass also passes wr_pvld through when cnt == 0)
+#     wr_prdy = cnt != d || popping             (mode=skid has no popping term)
+#     d=0     is a pass-through: wr_prdy = rd_prdy and rd_pvld = wr_pvld
+#     d=1     with mode=fifo is a plain flop that is never stalled, so rd_pvld is last cycle's wr_pvld
+#
+# With ram_kind=ra2, the handshakes depend on the ram's read latency, so they are not modeled.
+#-------------------------------------------
+class FifoModel:
+    def __init__( self, p ):
+        check( p )
+        if p['ram_kind'] != 'ff': S.die( f'fifo_model: FifoModel supports only ram_kind=ff' )
+        self.d          = p['d']
+        self.mode       = p['mode']
+        self.is_flop    = self.d == 1 and self.mode == 'fifo'
+        self.is_bypass  = self.d == 0 or self.mode == 'bypass'
+        self.entries    = collections.deque()
+
+    def step( self, wr_pvld, wr_pd, rd_prdy ):
+        if self.is_flop:
+            rd_pvld = len( self.entries ) != 0
+            rd_pd   = self.entries.popleft() if rd_pvld else 0
+            if wr_pvld: self.entries.append( wr_pd )
+            return 1, int( rd_pvld ), rd_pd
+
+        cnt = len( self.entries )
+        if cnt != 0:
+            rd_pvld, rd_pd = 1, self.entries[0]
+        elif self.is_bypass and wr_pvld:
+            rd_pvld, rd_pd = 1, wr_pd
+        else:
+            rd_pvld, rd_pd = 0, 0
+        popping = rd_pvld and rd_prdy
+        if self.d == 0:
+            wr_prdy = rd_prdy
+        elif self.mode == 'skid':
+            wr_prdy = cnt != self.d
+        else:
+            wr_prdy = cnt != self.d or popping
+        if wr_pvld and wr_prdy: self.entries.append( wr_pd )
+        if popping: self.entries.popleft()
+        return int( wr_prdy ), rd_pvld, rd_pd
+
+#-------------------------------------------
+# Load a trace file into a dict of NumPy arrays, one per column.
+#-------------------------------------------
+def load( trace_name ):
+    a = np.loadtxt( trace_name, dtype=np.uint64, ndmin=2 )
+    if a.shape[1] != len( cols ): S.die( f'fifo_model: {trace_name} does not have {len( cols )} columns per line' )
+    t = { col: a[:, i] for i, col in enumerate( cols ) }
+    for col in [ 'wr_pvld', 'wr_prdy', 'rd_pvld', 'rd_prdy' ]: t[col] = t[col] != 0
+    return t
+
+#-------------------------------------------
+# Check trace t against the fifo described by p.
+#
+# Returns (divergence, stats). divergence is None or a dict with the 'cycle' (0 is the first cycle
+# after reset), the 'what' that diverged, and its 'expected' and 'actual' values. stats is a dict of
+# throughput statistics.
+#-------------------------------------------
+def check_trace( p, t ):
+    check( p )
+    d        = p['d']
+    mode     = p['mode']
+    n        = len( t['wr_pvld'] )
+    pushing  = t['wr_pvld'] & t['wr_prdy']
+    popping  = t['rd_pvld'] & t['rd_prdy']
+    push_cyc = np.flatnonzero( pushing )
+    pop_cyc  = np.flatnonzero( popping )
+    is_flop  = d == 1 and mode == 'fifo' and p['ram_kind'] == 'ff'
+
+    # cnt[i] is the occupancy at the start of cycle i; for the plain flop, it is whether it holds an entry
+    delta = pushing.astype( np.int64 ) - popping.astype( np.int64 )
+    if is_flop: delta = t['wr_pvld'].astype( np.int64 ) - t['rd_pvld'].astype( np.int64 )
+    cnt = np.zeros( n+1, dtype=np.int64 )
+    np.cumsum( delta, out=cnt[1:] )
+
+    # each check is (what, mismatch mask, expected values, actual values)
+    checks = []
+    if p['ram_kind'] == 'ff':
+        if is_flop:
+            exp_wr_prdy = np.ones( n, dtype=bool )
+            exp_rd_pvld = np.zeros( n, dtype=bool )
+            exp_rd_pvld[1:] = t['wr_pvld'][:-1]
+        else:
+            c = cnt[:-1]
+            if d == 0:
+                exp_wr_prdy = t['rd_prdy']
+            elif mode == 'skid':
+                exp_wr_prdy = c != d
+            else:
+                exp_wr_prdy = (c != d) | popping
+            exp_rd_pvld = c != 0
+            if d == 0 or mode == 'bypass': exp_rd_pvld = exp_rd_pvld | t['wr_pvld']
+        checks.append( ('wr_prdy', exp_wr_prdy != t['wr_prdy'], exp_wr_prdy, t['wr_prdy']) )
+        checks.append( ('rd_pvld', exp_rd_pvld != t['rd_pvld'], exp_rd_pvld, t['rd_pvld']) )
+        if is_flop:
+            dropping = t['rd_pvld'] & ~t['rd_prdy']
+            checks.append( ('rd_prdy (the d=1 flop cannot be stalled)', dropping, ~dropping, t['rd_prdy']) )
+    else:
+        # the ra2 prefetch queue holds up to 2 entries beyond d
+        over = (cnt[1:] > d + 2) | (cnt[1:] < 0)
+        checks.append( ('occupancy', over, np.minimum( np.maximum( cnt[1:], 0 ), d+2 ), cnt[1:]) )
+
+    # in every cycle with rd_pvld, whether or not it pops, rd_pd must be the head entry, which is the pushed entry 
+    # after the ones popped so far or, with bypass and an empty fifo, this cycle's wr_pd; an rd_pvld with no 
+    # head entry is a divergence too
+    push_m    = t['wr_pvld'] if is_flop else pushing
+    pop_m     = t['rd_pvld'] if is_flop else popping
+    pushed_pd = np.append( t['wr_pd'][np.flatnonzero( push_m )], np.uint64( 0 ) )
+    head      = np.cumsum( pop_m ) - pop_m
+    has_head  = head < np.cumsum( push_m ) - push_m
+    is_bypass = d == 0 or mode == 'bypass'
+    data_exp  = np.where( has_head, pushed_pd[np.minimum( head, len( pushed_pd )-1 )], t['wr_pd'] )
+    data_bad  = t['rd_pvld'] & ((data_exp != t['rd_pd']) | ~(has_head | (is_bypass & t['wr_pvld'])))
+    checks.append( ('rd_pd', data_bad, data_exp, t['rd_pd']) )
+
+    divergence = None
+    for what, bad, exp, act in checks:
+        bad_cyc = np.flatnonzero( bad )
+        if len( bad_cyc ) == 0: continue
+        i = int( bad_cyc[0] )
+        if divergence is None or i < divergence['cycle']:
+            divergence = { 'cycle': i, 'what': what, 'expected': int( exp[i] ), 'actual': int( act[i] ) }
+
+    pop_cnt = min( len( push_cyc ), len( pop_cyc ) )
+    latency = pop_cyc[:pop_cnt] - push_cyc[:pop_cnt]
+    stats = { 'cycles':         n,
+              'pushes':         len( push_cyc ),
+              'pops':           len( pop_cyc ),
+              'push_rate':      len( push_cyc ) / max( n, 1 ),
+              'pop_rate':       len( pop_cyc ) / max( n, 1 ),
+              'full_cycles':    int( np.count_nonzero( ~t['wr_prdy'] ) ),
+              'stall_cycles':   int( np.count_nonzero( t['wr_pvld'] & ~t['wr_prdy'] ) ),
+              'empty_cycles':   int( np.count_nonzero( t['rd_prdy'] & ~t['rd_pvld'] ) ),
+              'occ_avg':        float( cnt[1:].mean() ) if n != 0 else 0.0,
+              'occ_max':        int( cnt.max() ),
+              'latency_avg':    float( latency.mean() ) if pop_cnt != 0 else 0.0,
+              'latency_max':    int( latency.max() ) if pop_cnt != 0 else 0 }
+    return divergence, stats
+
+#-------------------------------------------
+# Replay trace t through FifoModel one cycle at a time and return the first divergence like check_trace().
+#-------------------------------------------
+def replay( p, t ):
+    model = FifoModel( p )
+    wr_pvld = t['wr_pvld'].tolist()
+    wr_pd   = t['wr_pd'].tolist()
+    rd_prdy = t['rd_prdy'].tolist()
+    actual  = [ t['wr_prdy'].tolist(), t['rd_pvld'].tolist(), t['rd_pd'].tolist() ]
+    for i in range( len( wr_pvld ) ):
+        expected = model.step( wr_pvld[i], wr_pd[i], rd_prdy[i] )
+        for j, what in enumerate( [ 'wr_prdy', 'rd_pvld', 'rd_pd' ] ):
+            if what == 'rd_pd' and not expected[1]: continue
+            if expected[j] != actual[j][i]:
+                return { 'cycle': i, 'what': what, 'expected': int( expected[j] ), 'actual': int( actual[j][i] ) }
+        if model.is_flop and expected[1] and not rd_prdy[i]:
+            return { 'cycle': i, 'what': 'rd_prdy (the d=1 flop cannot be stalled)', 'expected': 1, 'actual': 0 }
+    return None
+
+if __name__ == '__main__':
+    if len( sys.argv ) < 2: S.die( 'usage: fifo_model.py <design> [<trace>] [-slow]' )
+    design = sys.argv[1]
+    trace_name = f'tb_{design}.trace'
+    do_slow = False
+    for arg in sys.argv[2:]:
+        if arg == '-slow':
+            do_slow = True
+        elif arg[0] == '-':
+            S.die( f'fifo_model: unknown option: {arg}' )
+        else:
+            trace_name = arg
+
+    if design not in gen.builders: S.die( f'fifo_model: unknown design: {design}' )
+    builder = gen.builders[design]
+    with V.Gen():
+        C.reinit()
+        builder.reinit()
+        p = getattr( builder, 'params', None )
+        if not isinstance( p, dict ) or 'd' not in p or 'wr' not in p: S.die( f'fifo_model: {design} has no fifo params dict' )
+        p = dict( p )
+        fifo.check( p )
+
+    t = load( trace_name )
+    if do_slow:
+        divergence = replay( p, t )
+        _, stats = check_trace( p, t )
+    else:
+        divergence, stats = check_trace( p, t )
+
+    print( f'{trace_name}: cycles={stats["cycles"]} pushes={stats["pushes"]} pops={stats["pops"]} ' +
+           f'push_rate={stats["push_rate"]:.3f} pop_rate={stats["pop_rate"]:.3f}' )
+    print( f'    full_cycles={stats["full_cycles"]} stall_cycles={stats["stall_cycles"]} empty_cycles={stats["empty_cycles"]}' )
+    print( f'    occ_avg={stats["occ_avg"]:.2f} occ_max={stats["occ_max"]} latency_avg={stats["latency_avg"]:.2f} latency_max={stats["latency_max"]}' )
+    if divergence is not None:
+        S.die( f'fifo_model: first divergence at cycle {divergence["cycle"]}: {divergence["what"]} ' +
+               f'expected={divergence["expected"]} actual={divergence["actual"]}' )
+    print( 'PASS' )
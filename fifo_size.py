@@ -0,0 +1,247 @@
+# Copyright (c) 2017-2025 Robert A. Alfieri
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# 
+# fifo_size.py - recommend a fifo depth from a simulated trace
+#
+# fifo_size.py <design> [-deep_d <d>] [-write] [plusargs]
+#
+# <design> is one of gen.py's designs whose builder has fifo params dicts. A builder with one fifo,
+# such as fifo1, has a params dict, and its testbench instance is u_<design>. A builder with several 
+# fifos, such as pipe1, has fifo_insts( inst_name ), which returns { tb_inst_name: params dict } with 
+# each params dict being the one in the builder that the fifo instance is generated from.
+#
+# fifo_size.py generates <design>.v and tb_<design>.v in fifo_size.<design>/ with each fifo's d 
+# set to deep_d (default: 64) and with_perf=True, then runs tb_<design> there using vsim.py -perf +dump.
+# Each fifo's perf counters give its occupancy high-water mark, and the .vcd gives an occupancy 
+# histogram (fraction of time at each occupancy). Fifos with mode=skid or mode=pipe have a fixed
+# depth and are left alone.
+#
+# The recommended depth of each fifo is the smallest legal d that holds its high-water mark. With it, 
+# the fifo never fills in this run, so the run's throughput is unchanged. fifo_size.py checks that by 
+# rerunning with the recommended depths and comparing the finish times, and that a fifo that never
+# stalled with deep_d also never stalls with its recommended d. Any plusargs (e.g., +wr_cnt_max=1000) 
+# are passed to both runs, so use a run that is long and representative.
+#
+# With -write, the 'd' entry of each fifo's params dict in <design>.py is rewritten with its recommended d.
+#
+import sys
+import os
+import ast
+import S
+import V
+import C
+import fifo
+import gen
+
+vsim = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'vsim.py' )
+
+#-------------------------------------------
+# Return { tb_inst_name: params dict } for the fifos of design whose depth can be sized.
+# Call it after builder.reinit().
+#-------------------------------------------
+def fifo_insts( design, builder ):
+    if hasattr( builder, 'fifo_insts' ):
+        insts = builder.fifo_insts( design )
+    else:
+        p = getattr( builder, 'params', None )
+        if not isinstance( p, dict ) or 'd' not in p or 'wr' not in p: S.die( f'fifo_size: {design} has no fifo params dict' )
+        insts = { f'u_{design}': p }
+    return { inst_name: p for inst_name, p in insts.items() if p.get( 'mode', 'fifo' ) not in [ 'skid', 'pipe' ] }
+
+#-------------------------------------------
+# Generate <design>.v and tb_<design>.v in work_dir with each fifo's d from depths and with_perf=True.
+#-------------------------------------------
+def generate( design, builder, work_dir, depths ):
+    for target in [ design, f'tb_{design}' ]:
+        with V.Gen( emitter=V.Emitter( os.path.join( work_dir, f'{target}.v' ) ) ):
+            C.reinit()
+            builder.reinit()
+            for inst_name, p in fifo_insts( design, builder ).items():
+                p['d'] = depths[inst_name]
+                p['with_perf'] = True
+            if target == design:
+                getattr( builder, f'make_{design}' )( design )
+            else:
+                getattr( builder, f'make_tb_{design}' )( design, design )
+
+#-------------------------------------------
+# Run tb_<design> in work_dir and return the PERF FINAL counters of each fifo instance, 
+# as { inst_name: { 'time': <finish time>, 'pushes': <n>, ... } }.
+#-------------------------------------------
+def simulate( design, work_dir, plusargs ):
+    out = S.cmd( f'cd {work_dir} && {sys.executable} {vsim} tb_{design} -perf {plusargs}', echo=False )
+    if 'PASS' not in out: S.die( f'fifo_size: tb_{design} did not pass:\n{out}' )
+    perfs = {}
+    for line in out.split( '\n' ):
+        m = S.match( line, r'^(\d+): PERF FINAL (\S+): (.*)$' )
+        if not m: continue
+        perf = { 'time': int( m.group( 1 ) ) }
+        for field in m.group( 3 ).split():
+            name, val = field.split( '=' )
+            perf[name] = int( val )
+        perfs[m.group( 2 )] = perf
+    if len( perfs ) == 0: S.die( f'fifo_size: tb_{design} printed no PERF FINAL lines; does the design use fifo.make_tb()?' )
+    return perfs
+
+#-------------------------------------------
+# Return { inst_name: { occupancy: fraction of time } } for each perf_occ signal in the .vcd,
+# where inst_name is the hierarchical name below tb_name.
+#-------------------------------------------
+def occ_histograms( vcd_name, tb_name ):
+    ids = {}
+    scopes = []
+    hists = {}
+    vals = {}
+    t = 0
+    t_last = 0
+    with open( vcd_name ) as f:
+        for line in f:
+            tokens = line.split()
+            if len( tokens ) == 0: continue
+            if tokens[0] == '$scope':
+                scopes.append( tokens[2] )
+            elif tokens[0] == '$upscope':
+                scopes.pop()
+            elif tokens[0] == '$var':
+                if tokens[4] == 'perf_occ' and tb_name in scopes: ids[tokens[3]] = '.'.join( scopes[scopes.index( tb_name )+1:] )
+            elif tokens[0][0] == '#':
+                t = int( tokens[0][1:] )
+                for id in vals: hists[id][vals[id]] = hists[id].get( vals[id], 0 ) + t - t_last
+                t_last = t
+            elif tokens[0][0] == 'b' and len( tokens ) == 2 and tokens[1] in ids:
+                id = tokens[1]
+                if id not in hists: hists[id] = {}
+                vals[id] = int( tokens[0][1:], 2 ) if 'x' not in tokens[0] and 'z' not in tokens[0] else 0
+    r = {}
+    for id in hists:
+        total = sum( hists[id].values() )
+        r[ids[id]] = { occ: hists[id][occ] / total for occ in sorted( hists[id] ) } if total != 0 else {}
+    return r
+
+#-------------------------------------------
+# Return the smallest legal d for p that holds occ_max entries.
+#-------------------------------------------
+def min_depth( p, occ_max ):
+    d = occ_max
+    if p['ram_kind'] == 'ra2': 
+        d -= 1                                  # the prefetch queue holds 2 entries beyond d, but a full ram is not writable while popping
+    elif p['wr_lane_cnt'] > 1 or p['rd_lane_cnt'] > 1:
+        d += p['wr_lane_cnt']                   # the write side needs room for wr_lane_cnt entries, even while popping
+    d = max( d, 1, p['wr_lane_cnt'], p['rd_lane_cnt'] )
+    if p['mode'] == 'fifo': d = max( d, 2 )     # d=1 is a flop that is not stallable, and ra2 and is_async need d >= 2 anyway
+    if p['is_async']: d = V.pow2_ge( d )
+    return d
+
+#-------------------------------------------
+# Rewrite the 'd' entry of params dict p in builder's <design>.py with d.
+# p is found by identity among builder's globals, either as a dict or as an element of a list of dicts,
+# and its 'd' entry is found in the source by parsing <design>.py, so no other dict is touched.
+#-------------------------------------------
+def write_depth( design, builder, p, d ):
+    var = None
+    for name, val in vars( builder ).items():
+        if val is p:
+            var, index = name, None
+        elif isinstance( val, list ):
+            for i in range( len( val ) ):
+                if val[i] is p: var, index = name, i
+    if var is None: S.die( f'fifo_size: cannot find the params dict of a fifo among the globals of {design}.py' )
+
+    file_name = f'{design}.py'
+    with open( file_name ) as f: lines = f.read().split( '\n' )
+    node = None
+    for a in ast.walk( ast.parse( '\n'.join( lines ) ) ):
+        if isinstance( a, ast.Assign ) and len( a.targets ) == 1 and isinstance( a.targets[0], ast.Name ) and a.targets[0].id == var:
+            node = a.value
+            if index is not None: node = node.elts[index] if isinstance( node, ast.List ) else None
+    if not isinstance( node, ast.Dict ): S.die( f'fifo_size: {var} is not assigned a dict literal in {file_name}' )
+    vals = [ val for key, val in zip( node.keys, node.values ) if isinstance( key, ast.Constant ) and key.value == 'd' ]
+    if len( vals ) != 1 or not isinstance( vals[0], ast.Constant ): S.die( f'fifo_size: {var} has no literal \'d\' entry in {file_name}' )
+    val = vals[0]
+    line = lines[val.lineno-1]
+    lines[val.lineno-1] = line[:val.col_offset] + str( d ) + line[val.end_col_offset:]
+    with open( file_name, 'w' ) as f: f.write( '\n'.join( lines ) )
+    print( f'{file_name}: {lines[val.lineno-1]}' )
+
+if __name__ == '__main__':
+    if len( sys.argv ) < 2: S.die( 'usage: fifo_size.py <design> [-deep_d <d>] [-write] [plusargs]' )
+    design = sys.argv[1]
+    deep_d = 64
+    do_write = False
+    plusargs = ''
+    i = 2
+    while i < len( sys.argv ):
+        arg = sys.argv[i]
+        i += 1
+        if arg[0] == '+':
+            plusargs += f' {arg}'
+        elif arg == '-deep_d':
+            deep_d = int( sys.argv[i] )
+            i += 1
+        elif arg == '-write':
+            do_write = True
+        else:
+            S.die( f'fifo_size: unknown option: {arg}' )
+
+    if design not in gen.builders: S.die( f'fifo_size: unknown design: {design}' )
+    builder = gen.builders[design]
+    ps = {}
+    with V.Gen():
+        C.reinit()
+        builder.reinit()
+        for inst_name, p in fifo_insts( design, builder ).items():
+            p = dict( p, d=deep_d )
+            if 'w' not in p: p['w'] = 1               # the width doesn't affect the depth
+            fifo.check( p )
+            ps[inst_name] = p
+    if len( ps ) == 0: S.die( f'fifo_size: {design} has no fifo whose depth can be sized' )
+
+    work_dir = f'fifo_size.{design}'
+    os.makedirs( work_dir, exist_ok=True )
+    generate( design, builder, work_dir, { inst_name: deep_d for inst_name in ps } )
+    deep = simulate( design, work_dir, plusargs + ' +dump' )
+    hists = occ_histograms( os.path.join( work_dir, f'tb_{design}.vcd' ), f'tb_{design}' )
+    depths = {}
+    for inst_name in ps:
+        if inst_name not in deep: S.die( f'fifo_size: tb_{design} printed no PERF FINAL line for {inst_name}' )
+        perf = deep[inst_name]
+        depths[inst_name] = min_depth( ps[inst_name], perf['occ_max'] )
+        print( f'{inst_name} with d={deep_d}: pushes={perf["pushes"]} stall_cycles={perf["stall_cycles"]} occ_max={perf["occ_max"]} finish_time={perf["time"]}' )
+        hist = hists.get( inst_name, {} )
+        for occ in hist: print( f'    occupancy {occ:4d}: {100.0*hist[occ]:6.2f}%' )
+    
+    generate( design, builder, work_dir, depths )
+    checks = simulate( design, work_dir, plusargs )
+    for inst_name in ps:
+        perf  = deep[inst_name]
+        check = checks[inst_name]
+        print( f'{inst_name} with d={depths[inst_name]}: pushes={check["pushes"]} stall_cycles={check["stall_cycles"]} occ_max={check["occ_max"]} finish_time={check["time"]}' )
+        if check['time'] != perf['time'] or check['pushes'] != perf['pushes']:
+            S.die( f'fifo_size: the recommended depths changed the finish time from {perf["time"]} to {check["time"]}' )
+        if perf['stall_cycles'] == 0 and check['stall_cycles'] != 0:
+            S.die( f'fifo_size: the recommended d for {inst_name} made it stall for {check["stall_cycles"]} cycles' )
+    for inst_name in ps: print( f'recommended d for {inst_name}: {depths[inst_name]}' )
+
+    if do_write:
+        with V.Gen():
+            C.reinit()
+            builder.reinit()
+            insts = fifo_insts( design, builder )
+        for inst_name in ps: write_depth( design, builder, insts[inst_name], depths[inst_name] )
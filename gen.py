@@ -18,10 +18,40 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 # 
-# gen.py - generate one .v modules
+# gen.py - generate .v modules
+#
+# gen.py <target>                    -- writes <target>.v to stdout (used by the Makefile for one target)
+# gen.py [-j <n>] <target> ...       -- builds each listed target directly into <target>.v
+# gen.py [-j <n>] --all              -- ditto for every example design and its testbench
+# gen.py --no-cache ...              -- ditto, but ignores and does not update the generation cache
+# gen.py --ir ...                    -- ditto, but generates through the V.py netlist IR (see V.Gen)
+# gen.py --dce ...                   -- ditto, and also removes dead logic from each module
+# gen.py --memoize ...               -- ditto, but generates shared helper modules such as vpy_clz_64 (see V.Gen)
+#
+# A target is a design name or tb_ followed by a design name.
+# With more than one target, the builds are fanned out across a process pool 
+# with one worker per core (or <n> workers), so the S, V, C, and design modules 
+# are imported once per worker rather than once per target. The wall time 
+# of each target is reported.
+#
+# Generation cache:
+#
+# Each target's output is saved in .vpy_cache/ under a key that is a hash of the target name, 
+# the builder's params dict, the V.Gen settings after reinit() (clk, reset_, vdebug, vassert, ramgen_cmd, ir, dce, memoize),
+# and the contents of the .py files that the builder actually imports (transitively) plus gen.py.
+# When the key matches, the saved output is reused. Note that the output of an external ramgen_cmd is 
+# not part of the key, only the command itself.
+#
+# gen.py also writes <target>.d listing those .py files, which the Makefile includes,
+# so make reruns only the targets whose sources changed.
 #
 import sys
-import re
+import os
+import io
+import types
+import hashlib
+import time
+import concurrent.futures
 import S
 import V
 
@@ -29,28 +59,184 @@ import V
 import C                        # config file
 import arb_rr                   # round-robin arbiter
 import fifo1                    # stallable fifo in flops
+import rfifo1                   # stallable fifo in a V.ram()
+import afifo1                   # stallable asynchronous fifo in flops
+import wfifo1                   # stallable wide (multi-lane) fifo in flops
+import pipe1                    # pipeline of inline fifo stages
 import cache1                   # simple L0 cache in flops
+import cache2                   # set-associative L0 cache in flops
+import rcache1                  # set-associative L0 cache in V.ram()s
+import cache3                   # multi-lane L0 cache in flops
+import cache4                   # write-back L0 data cache in flops
+
+builders = { 'arb_rr':  arb_rr,
+             'fifo1':   fifo1,
+             'rfifo1':  rfifo1,
+             'afifo1':  afifo1,
+             'wfifo1':  wfifo1,
+             'pipe1':   pipe1,
+             'cache1':  cache1,
+             'cache2':  cache2,
+             'rcache1': rcache1,
+             'cache3':  cache3,
+             'cache4':  cache4 }
+
+cache_dir = '.vpy_cache'
+cache_version = 1               # bump if the key or cache format changes
+
+#-------------------------------------------
+# Return the sorted list of .py files in gen.py's directory that module imports, 
+# directly or indirectly, including module's own file.
+#-------------------------------------------
+def source_files( module, files=None ):
+    if files is None: files = set()
+    file_name = getattr( module, '__file__', None )
+    if file_name is None or not file_name.endswith( '.py' ): return files
+    file_name = os.path.abspath( file_name )
+    if os.path.dirname( file_name ) != os.path.dirname( os.path.abspath( __file__ ) ) or file_name in files: return files
+    files.add( file_name )
+    for val in list( vars( module ).values() ):
+        if isinstance( val, types.ModuleType ): source_files( val, files )
+    return files
+
+def target_sources( builder ):
+    files = source_files( builder, source_files( C ) )
+    files.add( os.path.abspath( __file__ ) )
+    return sorted( files )
+
+#-------------------------------------------
+# Compute the cache key for a target after C.reinit() and builder.reinit()
+# have been called within Gen g.
+#-------------------------------------------
+def cache_key( target, builder, g, sources ):
+    h = hashlib.sha256()
+    h.update( f'{cache_version} {target}\n'.encode() )
+    h.update( f'{getattr( builder, "params", None )!r}\n'.encode() )
+    h.update( f'{g.clk} {g.reset_} {g.vdebug} {g.vassert} {g.ramgen_cmd!r} {g.ir} {g.dce} {g.memoize}\n'.encode() )
+    for file_name in sources:
+        with open( file_name, 'rb' ) as f:
+            h.update( f'{os.path.basename( file_name )}\n'.encode() )
+            h.update( f.read() )
+    return h.hexdigest()
+
+def cache_file( target, key ):
+    return os.path.join( cache_dir, f'{target}.{key}.v' )
+
+def cache_get( target, key ):
+    try:
+        with open( cache_file( target, key ) ) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def cache_put( target, key, text ):
+    # write under a temporary name then rename, so concurrent gen.py's never see a partial file;
+    # older entries for the same target are removed
+    os.makedirs( cache_dir, exist_ok=True )
+    file_name = cache_file( target, key )
+    tmp_name = f'{file_name}.{os.getpid()}.tmp'
+    with open( tmp_name, 'w' ) as f:
+        f.write( text )
+    os.replace( tmp_name, file_name )
+    for old in os.listdir( cache_dir ):
+        old_key = old[len(target)+1:-2]
+        if old.startswith( f'{target}.' ) and old.endswith( '.v' ) and len( old_key ) == len( key ) and old_key != key:
+            os.remove( os.path.join( cache_dir, old ) )
+
+def write_deps( target, sources ):
+    with open( f'{target}.d', 'w' ) as f:
+        f.write( f'{target}.v: ' + ' '.join( os.path.relpath( s ) for s in sources ) + '\n' )
 
-if len( sys.argv ) != 2: S.die( 'usage: gen.py module_name' )
+#-------------------------------------------
+# Generate one target into file_name (None means stdout).
+# Returns the target name, its wall time, whether the output came from the cache,
+# and the number of signals and bits removed by dead logic elimination.
+# gen_opts are passed to V.Gen (ir, dce, memoize).
+#-------------------------------------------
+def gen_target( target, file_name=None, use_cache=True, gen_opts={} ):
+    t = time.perf_counter()
+    m           = S.subst( target, r'^tb_', '' )
+    for_test    = target != m
+    m_lc        = m.lower()
+    if m_lc not in builders: S.die( f'unknown design: {m_lc}' )
+    builder     = builders[m_lc]
+    sources     = target_sources( builder )
 
-module_name = sys.argv[1]
-m           = S.subst( module_name, r'^tb_', '' )
-for_test    = module_name != m
+    out = io.StringIO()
+    with V.Gen( emitter=V.Emitter( out ), **gen_opts ) as g:
+        C.reinit()
+        builder.reinit()
+        key = cache_key( target, builder, g, sources )
+        text = cache_get( target, key ) if use_cache else None
+        is_hit = text is not None
+        if not is_hit:
+            if for_test:
+                make_fn = getattr( builder, f'make_tb_{m_lc}' )
+                make_fn( m_lc, m_lc )
+            else:
+                make_fn = getattr( builder, f'make_{m_lc}' )
+                make_fn( target )
+    if not is_hit:
+        text = out.getvalue()
+        if use_cache: cache_put( target, key, text )
 
-C.reinit()
+    if file_name is None:
+        sys.stdout.write( text )
+        sys.stdout.flush()
+    else:
+        with open( file_name, 'w' ) as f:
+            f.write( text )
+    write_deps( target, sources )
+    return target, time.perf_counter() - t, is_hit, g.dce_signal_cnt, g.dce_bit_cnt
 
-m_lc = m.lower()
-builder = None
-if m_lc == 'arb_rr':                    builder = arb_rr
-if m_lc == 'fifo1':                     builder = fifo1
-if m_lc == 'cache1':                    builder = cache1
-if not builder: S.die( f'unknown design: {m_lc}' )
+#-------------------------------------------
+# Generate many targets in a process pool.
+#-------------------------------------------
+def gen_targets( targets, worker_cnt=0, use_cache=True, gen_opts={} ):
+    if worker_cnt <= 0: worker_cnt = os.cpu_count() or 1
+    worker_cnt = min( worker_cnt, len(targets) )
+    t = time.perf_counter()
+    failed = []
+    hit_cnt = 0
+    with concurrent.futures.ProcessPoolExecutor( max_workers=worker_cnt ) as pool:
+        futures = { pool.submit( gen_target, target, f'{target}.v', use_cache, gen_opts ): target for target in targets }
+        for future in concurrent.futures.as_completed( futures ):
+            target = futures[future]
+            try:
+                _, target_t, is_hit, dce_signal_cnt, dce_bit_cnt = future.result()
+                hit_cnt += is_hit
+                note = '   (cached)' if is_hit else f'   (dce removed {dce_signal_cnt} signals, {dce_bit_cnt} bits)' if gen_opts.get( 'dce', False ) else ''
+                print( f'{target+".v":30s} {target_t:8.3f} sec{note}', flush=True )
+            except BaseException as e:
+                print( f'{target+".v":30s}   FAILED: {e!r}', flush=True )
+                failed.append( target )
+    print( f'{len(targets)} targets ({hit_cnt} cached) using {worker_cnt} workers: {time.perf_counter() - t:.3f} sec' )
+    if len( failed ) != 0: S.die( f'failed targets: {" ".join( failed )}' )
 
-builder.reinit()
+if __name__ == '__main__':
+    targets = []
+    worker_cnt = 0
+    use_cache = True
+    gen_opts = {}
+    i = 1
+    while i < len( sys.argv ):
+        arg = sys.argv[i]
+        i += 1
+        if arg == '--all':
+            for m in builders: targets += [ m, f'tb_{m}' ]
+        elif arg == '--no-cache':
+            use_cache = False
+        elif arg in [ '--ir', '--dce', '--memoize' ]:
+            gen_opts[arg[2:]] = True
+        elif arg == '-j':
+            if i == len( sys.argv ): S.die( 'gen.py: -j needs a worker count' )
+            worker_cnt = int( sys.argv[i] )
+            i += 1
+        else:
+            targets.append( arg )
+    if len( targets ) == 0: S.die( 'usage: gen.py [-j <n>] [--no-cache] [--ir] [--dce] [--memoize] [--all] target ...' )
 
-if for_test:
-    make_fn = getattr( builder, f'make_tb_{m_lc}' )
-    make_fn( m_lc, m_lc )
-else:
-    make_fn = getattr( builder, f'make_{m_lc}' )
-    make_fn( module_name )
+    if len( targets ) == 1 and worker_cnt == 0 and '--all' not in sys.argv:
+        gen_target( targets[0], use_cache=use_cache, gen_opts=gen_opts )
+    else:
+        gen_targets( targets, worker_cnt, use_cache, gen_opts )
@@ -0,0 +1,168 @@
+# Copyright (c) 2017-2025 Robert A. Alfieri
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# 
+# pipe1.py - pipeline whose stages are buffered by fifos generated inline with fifo.stage()
+#
+import S
+import V
+import fifo
+
+P = V.P
+
+def reinit():
+    global xx2pipe, pipe2xx, stage_fifos
+
+    # normally, this stuff would go in a C.py config file
+    xx2pipe = { 'dat': 8 }
+    pipe2xx = xx2pipe.copy()
+
+    # one fifo per stage; stages with the same fifo params share one fifo module;
+    # mode=credit is instead a V.iface_credit() link with latency flops each way
+    stage_fifos = [ { 'd': 2 },
+                    { 'd': 4 },
+                    { 'd': 2 },
+                    { 'd': 2, 'mode': 'skid' },
+                    { 'd': 1, 'mode': 'pipe' },
+                    { 'd': 2, 'mode': 'bypass' },
+                    { 'd': 2 },
+                    { 'mode': 'credit', 'latency': 2 } ]
+
+# Returns { tb_inst_name: params dict } for the fifo (not credit) stages of the pipeline instance inst_name;
+# fifo_size.py uses it to size each stage.
+def fifo_insts( inst_name ):
+    return { f'u_{inst_name}.u_f{i}_fifo': stage_fifos[i] for i in range( len( stage_fifos ) ) if stage_fifos[i].get( 'mode', '' ) != 'credit' }
+
+def header( module_name ):
+    P(f'// Pipeline with the following properties:' )
+    P(f'// - {len(stage_fifos)} stages, each of which is a fifo followed by an increment of dat' )
+    P(f'// - the fifos are generated after this module by fifo.stage()' )
+    P(f'// - a credit stage is a credit-based link generated inline by V.iface_credit()' )
+    P(f'//' )
+    V.module_header_begin( module_name )
+    V.input( f'{V.clk}', 1 )
+    V.input( f'{V.reset_}', 1 )
+    V.iface_input( f'xx2pipe', xx2pipe )
+    V.iface_output( f'pipe2xx', pipe2xx )
+    V.module_header_end()
+
+def inst_pipe1( module_name, inst_name, do_decls ):
+    if do_decls: 
+        V.iface_wire( f'xx2pipe', xx2pipe, True )
+        V.iface_wire( f'pipe2xx', pipe2xx, True )
+    P()
+    P(f'{module_name} {inst_name}(' ) 
+    P(f'      .{V.clk}({V.clk}), .{V.reset_}({V.reset_})' )
+    V.iface_inst( f'xx2pipe', f'xx2pipe', xx2pipe, True )
+    V.iface_inst( f'pipe2xx', f'pipe2xx', pipe2xx, True )
+    P(f'    );' )
+
+def make_pipe1( module_name ):
+    header( module_name )
+
+    # stage i goes from s{i} through fifo f{i} to s{i+1};
+    # fifo.stage() declares s{i}_prdy and the f{i} wires, and V.iface_credit() declares the f{i} wires except f{i}_prdy
+    stage_cnt = len( stage_fifos )
+    V.iface_wire( f's0', xx2pipe, True, False )
+    P(f'assign s0_pvld = xx2pipe_pvld;' )
+    P(f'assign s0_dat = xx2pipe_dat;' )
+    for i in range( stage_cnt ):
+        if stage_fifos[i].get( 'mode', '' ) == 'credit':
+            V.wire( f's{i}_prdy', 1 )
+            V.wire( f'f{i}_prdy', 1 )
+            V.iface_credit( f's{i}', f'f{i}', xx2pipe, latency=stage_fifos[i]['latency'], do_dprint=False )
+        else:
+            fifo.stage( stage_fifos[i], f's{i}', f'f{i}', xx2pipe )
+        P(f'assign ' + (f'xx2pipe_prdy' if i == 0 else f'f{i-1}_prdy') + f' = s{i}_prdy;' )
+        V.iface_wire( f's{i+1}', xx2pipe, True, i == stage_cnt-1 )
+        P(f'assign s{i+1}_pvld = f{i}_pvld;' )
+        P(f'assign s{i+1}_dat = f{i}_dat + 1;' )
+    P()
+    P(f'assign f{stage_cnt-1}_prdy = s{stage_cnt}_prdy;' )
+    P(f'assign pipe2xx_pvld = s{stage_cnt}_pvld;' )
+    P(f'assign pipe2xx_dat = s{stage_cnt}_dat;' )
+    P(f'assign s{stage_cnt}_prdy = pipe2xx_prdy;' )
+
+    V.module_footer( module_name )
+
+def make_tb_pipe1( module_name, inst_name ):
+    stage_cnt = len( stage_fifos )
+    P(f'// Testbench for {module_name}.v with the following properties beyond those of the pipeline:' )
+    P(f'// - issues a plusarg-selectable number of requests (default: 100) with incrementing dat' )
+    P(f'// - randomly adds bubbles to the input' )
+    P(f'// - randomly stalls the output' )
+    P(f'// - asserts that each output dat is its input dat plus {stage_cnt}' )
+    P(f'//' )
+    V.module_header_begin( f'tb_{module_name}' )
+    V.module_header_end()
+    P()
+    V.tb_clk()
+    V.tb_reset_()
+    V.tb_dump( f'tb_{module_name}', include_saif=False )
+    P()
+    V.tb_rand_init()
+
+    inst_pipe1( module_name, f'u_{inst_name}', True )
+
+    P() 
+    P( f'// PLUSARGS' )
+    P( f'//' )
+    P( f'reg [31:0] req_cnt_max;' )
+    P( f'initial begin' )
+    P( f'    if ( !$value$plusargs( "req_cnt_max=%d", req_cnt_max ) ) req_cnt_max = 100;' )
+    P( f'end' )
+
+    P() 
+    P( f'// REQUESTS' )
+    P( f'//' )
+    V.reg( 'req_cnt', 32 )
+    V.reg( 'rsp_cnt', 32 )
+    V.tb_randbits( 'can_issue_req', 1 )
+    V.tb_randbits( 'can_take_rsp', 1 )
+    V.reg( 'req_dat', xx2pipe['dat'] )
+    V.reg( 'rsp_dat', pipe2xx['dat'] ) # expected
+    P( f'assign xx2pipe_pvld = can_issue_req && req_cnt < req_cnt_max;' )
+    P( f'assign xx2pipe_dat = req_dat;' )
+    P( f'assign pipe2xx_prdy = can_take_rsp;' )
+    V.always_at_posedge()
+    P( f'    if ( !{V.reset_} ) begin' )
+    P( f'        req_cnt <= 0;' )
+    P( f'        rsp_cnt <= 0;' )
+    P( f'        req_dat <= 0;' )
+    P( f'        rsp_dat <= {stage_cnt};' )
+    P( f'    end else begin' )
+    P( f'        if ( xx2pipe_pvld && xx2pipe_prdy ) begin' )
+    P( f'            req_cnt <= req_cnt + 1;' )
+    P( f'            req_dat <= req_dat + 1;' )
+    P( f'        end' )
+    P( f'        if ( pipe2xx_pvld && pipe2xx_prdy ) begin' )
+    P( f'            rsp_cnt <= rsp_cnt + 1;' )
+    P( f'            rsp_dat <= rsp_dat + 1;' )
+    P( f'        end' )
+    P( f'        if ( !xx2pipe_pvld && !pipe2xx_pvld && rsp_cnt === req_cnt_max ) begin' )
+    P( f'            $display( "PASS" );' )
+    P( f'            $finish;' )
+    P( f'        end' )
+    P( f'    end' )
+    P( f'end' )
+    V.dassert( f'pipe2xx_pvld === 0 || pipe2xx_dat === rsp_dat', f'unexpected pipe2xx_dat' )
+    for fifo_inst_name, p in fifo_insts( inst_name ).items():
+        if p.get( 'with_perf', False ): fifo.make_tb_perf( p, fifo_inst_name )
+
+    V.module_footer( f'tb_{module_name}' )
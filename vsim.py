@@ -22,6 +22,8 @@
 #
 # vsim.py <top_name> [options]
 #
+# -perf defines VPY_PERF, which enables perf counters such as those of fifo.make( { 'with_perf': True, ... } ).
+#
 # Parses the top_name.v design and creates some number of <top_name>.rand<n> directories with potentially modified 
 # copies of the design. Then simulates the design with some random seed and creates a .json file in each directory
 # for use in subsequent NN training.
@@ -36,6 +38,7 @@ dut = sys.argv[1]
 dumper = 'vcd'
 do_build = 1
 do_run = 1
+do_perf = 0
 plusargs = ''
 i = 2
 while i < len( sys.argv ):
@@ -45,6 +48,9 @@ while i < len( sys.argv ):
         print( arg )
         plusargs += f' {arg}' 
         continue
+    if arg == '-perf':
+        do_perf = 1
+        continue
     if arg == '-dumper':
         dumper = sys.argv[i]
     elif arg == '-do_build':
@@ -56,6 +62,7 @@ while i < len( sys.argv ):
     i += 1
 
 defines = '-D __VCD=1' if dumper == 'vcd' else ''
+if do_perf: defines += ' -D VPY_PERF=1'
 os.environ['IVERILOG_DUMPER'] = dumper
 if do_build: S.cmd( f'iverilog -g2012 -Wall {defines} -y. -o {dut}.vvp -s {dut} {dut}.v', echo_stdout=True )
 if do_run:   S.cmd( f'vvp ./{dut}.vvp{plusargs}', echo_stdout=True )